@@ -3,15 +3,25 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import datetime
 import sys
 import os
 
 # Add the parent directory to the path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.data_service import data_service
-from utils.bedrock_client import BedrockClient
+from utils.bedrock_client import (BedrockClient, ASSIGNMENT_PROMPT_TEMPLATE, triage_prompt_fingerprint,
+                                  assignment_prompt_fingerprint, parse_assignment_response)
 from utils.settings_manager import settings_manager
+from utils.background_jobs import background_job_manager
+from utils.bulk_triage import BULK_TRIAGE_JOB, start_bulk_triage, count_unprioritised_incidents
+from utils.similarity_index import similarity_index
+from utils.assignment_engine import assignment_engine
+from utils.metrics_service import metrics_service
+from utils.sla_engine import sla_engine, countdowns, format_countdown
+from utils.facet_index import facet_index, facet_series
+from utils.recommendation_store import (recommendation_store, incident_fingerprint, roster_fingerprint,
+                                        ASSIGNMENT_INPUT_FIELDS)
 
 st.set_page_config(page_title="Incidents Dashboard", page_icon="🎫", layout="wide")
 st.title("Incidents Dashboard")
@@ -23,78 +33,217 @@ bedrock_client = BedrockClient()
 data_source_info = data_service.get_data_source_info()
 st.sidebar.info(f"**Data Source**: {data_source_info['source']}\n**Status**: {data_source_info['status']}")
 
-# Load incidents data from MongoDB
-incidents_df = data_service.get_incidents()
+# Load incidents from the snapshot shared by every session (read-only)
+incidents_df = data_service.get_shared_incidents()
 
 # Check if we have incidents data
 if incidents_df.empty:
     st.error("No incidents data available. Please check the Data Management page to generate data.")
     st.stop()
 
-# Use the cleaned incidents data directly (already enriched with categories, services, etc.)
-incidents_enriched = incidents_df.copy()
+# Use the cleaned incidents data directly (already enriched with categories, services, etc.); the tables
+# below only filter and select, so no private copy is needed
+incidents_enriched = incidents_df
 
 if incidents_enriched.empty:
     st.error("No incidents data available")
     st.stop()
 
+
+
+DEFAULT_TRIAGE_PROMPT = "You are an expert ITSM analyst specializing in incident classification and priority assessment."
+DEFAULT_ASSIGNMENT_PROMPT = "You are an ITSM resource allocation expert with deep understanding of skill matching, workload balancing, and performance optimisation for technical support teams. You will consider skillset matching with the title, description and category of incident, but you will also consider the agent's current workload. If the agent is currently fully allocated, do not attempt to assign the item to them."
+
+
+def build_agent_roster(incident_data, agents_df: pd.DataFrame) -> list:
+    """Describe the best locally ranked agents for an incident, one line each, for the assignment prompt"""
+    incident = incident_data.to_dict() if isinstance(incident_data, pd.Series) else dict(incident_data)
+    return assignment_engine.candidate_roster(incident, agents_df.to_dict('records'))
+
+
+def show_recommendation_provenance(recommendation: dict, timestamp_field: str, fresh: bool):
+    """Caption with the model, time and freshness of a stored recommendation"""
+    timestamp = recommendation.get(timestamp_field)
+    when = timestamp.strftime('%Y-%m-%d %H:%M UTC') if isinstance(timestamp, datetime) else 'unknown time'
+    freshness = "✅ Up to date" if fresh else "⚠️ Stale - inputs or prompt changed since; click the button again to refresh"
+    st.caption(f"{freshness} | Model: {recommendation.get('model_id') or 'Unknown'} | {when}")
+
+
+def render_triage_recommendation(incident_id: str, incident_data, triage: dict, fresh: bool):
+    """Show a stored AI priority recommendation with its apply button"""
+    priority = triage.get('priority')
+    st.success(f"**AI Classification for {incident_id}:**")
+    st.write(f"**Predicted Priority:** {priority}")
+    if isinstance(triage.get('confidence'), (int, float)):
+        st.write(f"**Confidence:** {triage['confidence']:.0%}")
+    st.markdown(f"**Reasoning:**")
+    st.markdown(triage.get('reasoning') or '')
+    show_recommendation_provenance(triage, 'classified_at', fresh)
+
+    # Add apply recommendation button
+    current_priority = incident_data.get('priority', 'Unknown')
+    if priority != current_priority:
+        st.write("---")
+        col_apply, col_info = st.columns([1, 2])
+        with col_apply:
+            if st.button(f"Apply Priority {priority}",
+                       key=f"apply_priority_{incident_id}",
+                       type="primary"):
+                success = data_service.update_incident_priority(incident_id, priority)
+                if success:
+                    st.success(f"✅ Updated incident {incident_id} priority to {priority}!")
+                    st.rerun()
+                else:
+                    st.error("❌ Failed to update incident. MongoDB not available.")
+        with col_info:
+            st.info(f"Current priority: {current_priority} → Recommended: {priority}")
+    else:
+        st.info(f"✅ Current priority ({current_priority}) matches AI recommendation")
+
+
+def render_assignment_recommendation(incident_id: str, incident_data, assignment: dict, fresh: bool):
+    """Show a stored AI agent recommendation with its apply button"""
+    recommended_agent = assignment.get('agent') or "UNASSIGNED"
+    st.success(f"**AI Agent Assignment for {incident_id}:**")
+
+    if recommended_agent.upper() == "UNASSIGNED":
+        st.warning(f"**Recommendation:** Leave Unassigned")
+    else:
+        st.info(f"**Recommended Agent:** {recommended_agent}")
+
+    st.write(f"**Confidence:** {assignment.get('confidence', 'Low')}")
+    st.markdown(f"**Reasoning:**")
+    st.markdown(assignment.get('reasoning') or '')
+    show_recommendation_provenance(assignment, 'recommended_at', fresh)
+
+    # Add apply recommendation button for agent assignment
+    current_agent = incident_data.get('assigned_to', '')
+    if recommended_agent.upper() != "UNASSIGNED" and recommended_agent != current_agent:
+        st.write("---")
+        col_apply, col_info = st.columns([1, 2])
+        with col_apply:
+            if st.button(f"Assign to {recommended_agent}",
+                       key=f"apply_assignment_{incident_id}",
+                       type="primary"):
+                success = data_service.update_incident_assignment(incident_id, recommended_agent)
+                if success:
+                    st.success(f"✅ Assigned incident {incident_id} to {recommended_agent}!")
+                    st.rerun()
+                else:
+                    st.error("❌ Failed to update incident. MongoDB not available.")
+        with col_info:
+            current_display = current_agent if current_agent else "Unassigned"
+            st.info(f"Current: {current_display} → Recommended: {recommended_agent}")
+    elif recommended_agent.upper() == "UNASSIGNED":
+        if current_agent:
+            st.write("---")
+            col_apply, col_info = st.columns([1, 2])
+            with col_apply:
+                if st.button("Leave Unassigned",
+                           key=f"apply_unassign_{incident_id}",
+                           type="secondary"):
+                    success = data_service.update_incident_assignment(incident_id, "")
+                    if success:
+                        st.success(f"✅ Unassigned incident {incident_id}!")
+                        st.rerun()
+                    else:
+                        st.error("❌ Failed to update incident. MongoDB not available.")
+            with col_info:
+                st.info(f"Current: {current_agent} → Recommended: Unassigned")
+        else:
+            st.info("✅ Incident is already unassigned as recommended")
+    else:
+        current_display = current_agent if current_agent else "Unassigned"
+        st.info(f"✅ Current assignment ({current_display}) matches AI recommendation")
+
+
+@st.fragment(run_every=3)
+def show_bulk_triage_progress():
+    """Poll the background bulk triage job without rerunning the whole page"""
+    job = background_job_manager.get_active_job(BULK_TRIAGE_JOB)
+    if not job:
+        recent_jobs = background_job_manager.get_recent_jobs(BULK_TRIAGE_JOB, limit=1)
+        job = recent_jobs[0] if recent_jobs else None
+    if not job:
+        return
+
+    total = max(job.get('total', 0), 1)
+    processed = job.get('processed', 0)
+    cost = job.get('cost', {})
+    st.progress(min(processed / total, 1.0),
+                text=f"Job {job['_id']}: {job['status']} - {processed:,}/{job.get('total', 0):,} processed")
+    st.caption(f"✅ {job.get('succeeded', 0):,} classified | ❌ {job.get('failed', 0):,} failed | "
+               f"{cost.get('requests', 0):,} requests | {cost.get('input_tokens', 0):,} in / {cost.get('output_tokens', 0):,} out tokens")
+    if job.get('error'):
+        st.error(f"Job error: {job['error']}")
+    if job['status'] in ('queued', 'running'):
+        if st.button("⏹️ Cancel Bulk Classification", key="cancel_bulk_triage"):
+            background_job_manager.request_cancel(job['_id'])
+
+
 # Create tabs for different views
 tab1, tab2 = st.tabs(["⏳ Current Queue", "📋 All Incidents"])
 
 with tab1:
     st.subheader("Current Workload Queue")
 
-    # Load workload data
-    workload = data_service.get_workload()
+    with st.expander("🤖 Bulk Auto-Classify Open Queue", expanded=bool(background_job_manager.get_active_job(BULK_TRIAGE_JOB))):
+        unprioritised_count = count_unprioritised_incidents()
+        st.write(f"**{unprioritised_count:,}** open incidents have no priority. "
+                 "Bulk classification runs in the background and can be left running while you navigate.")
+        if st.button("🚀 Classify All Unprioritised Incidents", key="start_bulk_triage",
+                     disabled=unprioritised_count == 0 or not bedrock_client.is_available()):
+            bulk_settings = settings_manager.get_ai_model_settings()
+            if bulk_settings.get("selected_model_id"):
+                start_bulk_triage(
+                    bulk_settings["selected_model_id"],
+                    settings_manager.get_setting("system_prompts.incident_triage"),
+                    temperature=bulk_settings.get("temperature", 0.3)
+                )
+            else:
+                st.warning("⚠️ No model configured. Please go to AI Features page and select a model first.")
+        show_bulk_triage_progress()
 
-    if not workload.empty:
-        # Queue metrics
+    # Queue metrics are aggregated in MongoDB; no incident rows are loaded for the tiles
+    kpis = metrics_service.get_incident_kpis()
+    if kpis['queue_total']:
         col1, col2, col3, col4 = st.columns(4)
 
         with col1:
-            st.metric("Total Items", len(workload))
+            st.metric("Total Items", kpis['queue_total'])
 
         with col2:
-            if 'priority' in workload.columns:
-                high_priority = len(workload[workload['priority'].isin(['P1', 'P2'])])
-                st.metric("High Priority", high_priority)
+            st.metric("High Priority", kpis['queue_high_priority'])
 
         with col3:
-            if 'sla_due' in workload.columns:
-                # Count items due soon (within 24 hours)
-                try:
-                    from datetime import datetime, timedelta
-                    now = datetime.now()
-                    due_soon = 0
-                    for sla_due in workload['sla_due']:
-                        if pd.notna(sla_due):
-                            if isinstance(sla_due, str):
-                                try:
-                                    sla_date = pd.to_datetime(sla_due)
-                                    if sla_date <= now + timedelta(hours=24):
-                                        due_soon += 1
-                                except:
-                                    pass
-                    st.metric("Due Soon", due_soon)
-                except:
-                    st.metric("Due Soon", "N/A")
-            else:
-                st.metric("Due Soon", "N/A")
+            # Items due within 24 hours (including overdue)
+            st.metric("Due Soon", kpis['queue_due_soon'])
 
         with col4:
-            if 'assigned_to' in workload.columns:
-                unassigned_items = len(workload[(workload['assigned_to'].isna()) | (workload['assigned_to'] == '')])
-                st.metric("Unassigned", unassigned_items)
-            else:
-                st.metric("Unassigned", "N/A")
+            # The queue holds unassigned incidents only
+            st.metric("Unassigned", kpis['queue_total'])
+
+    # SLA state across all open incidents
+    sla_counts = sla_engine.get_sla_counts()
+    if sla_counts['open_with_sla']:
+        next_breach = sla_engine.next_breaches(k=1)
+        next_breach_text = (f" | ⏰ Next breach: **{next_breach[0]['incident_id']}** in "
+                            f"{format_countdown(next_breach[0]['seconds_remaining'])}") if next_breach else ""
+        st.caption(f"🚨 **{sla_counts['breached']:,}** breached | ⚠️ **{sla_counts['at_risk']:,}** at risk | "
+                   f"🕑 **{sla_counts['due_soon']:,}** due within 24h (of {sla_counts['open_with_sla']:,} open incidents with an SLA)"
+                   f"{next_breach_text}")
 
+    # Load workload data
+    workload = data_service.get_workload()
+
+    if not workload.empty:
         # Current queue table with enriched data
         st.subheader("Queue Items")
 
         # Define preferred columns with human-readable names (using incident schema)
         preferred_queue_columns = [
             'incident_id', 'title', 'status', 'priority', 'urgency', 'impact',
-            'service_name', 'category_name', 'location', 'channel', 'assigned_to', 'sla_due', 'created_on'
+            'service', 'category', 'location', 'channel', 'assigned_to', 'sla_due', 'created_on'
         ]
 
         # Build display columns list based on what's available
@@ -112,6 +261,10 @@ with tab1:
         if queue_display_columns:
             # Rename columns for better display
             queue_display_df = workload[queue_display_columns].copy()
+            if 'sla_due' in queue_display_df.columns:
+                sla_seconds = countdowns(queue_display_df['sla_due'])
+                queue_display_df.insert(queue_display_df.columns.get_loc('sla_due') + 1, 'sla_countdown',
+                                        sla_seconds.map(format_countdown))
 
             # Sort by priority (P1 highest, P2, P3, P4, P5 lowest)
             if 'priority' in queue_display_df.columns:
@@ -128,12 +281,13 @@ with tab1:
                 'priority': 'Priority',
                 'urgency': 'Urgency',
                 'impact': 'Impact',
-                'service_name': 'Service',
-                'category_name': 'Category',
+                'service': 'Service',
+                'category': 'Category',
                 'location': 'Location',
                 'channel': 'Channel',
                 'assigned_to': 'Assigned To',
                 'sla_due': 'SLA Due',
+                'sla_countdown': 'SLA Countdown',
                 'created_on': 'Created'
             }
 
@@ -167,7 +321,7 @@ with tab1:
                             help="Select incident status"
                         )
                     },
-                    disabled=["Incident ID", "Title", "Category", "Created", "Description"]  # Make these read-only
+                    disabled=["Incident ID", "Title", "Category", "Created", "Description", "SLA Countdown"]  # Make these read-only
                 )
 
                 # Handle inline edits - detect changes and update database
@@ -282,43 +436,105 @@ with tab1:
                     if delete_clicked:
                         st.warning(f"Delete {selected_incident_id} - Demo mode (no actual deletion)")
 
-                    if classify_clicked:
-                        # Get the incident data for classification - handle both CSV and AI-generated data
-                        title = incident_data.get('short_description') or incident_data.get('title', '')
-                        description = incident_data.get('description', '')
+                    # Stored recommendations survive reruns, so their Apply buttons keep working
+                    stored = recommendation_store.get(selected_incident_id)
+                    title = incident_data.get('title', '')
+                    description = incident_data.get('description', '')
+                    category = incident_data.get('category', '')
 
+                    if classify_clicked:
                         if title and description:
-                            if bedrock_client.is_available():
-                                with st.spinner(f"Classifying {selected_incident_id}..."):
-                                    # Get settings from MongoDB
-                                    ai_settings = settings_manager.get_ai_model_settings()
-                                    system_prompt = settings_manager.get_setting("system_prompts.incident_triage",
-                                        "You are an expert ITSM analyst specializing in incident classification and priority assessment.")
-
-                                    model_id = ai_settings.get("selected_model_id")
-                                    model_name = ai_settings.get("selected_model_name", "Unknown Model")
-                                    max_tokens = ai_settings.get("max_tokens", 300)
-                                    temperature = ai_settings.get("temperature", 0.3)
-
-                                    if model_id:
-                                        # Use same prompt structure as UC-02
-                                        prompt = f"""Analyze this incident and determine its priority level.
+                            # Get settings from MongoDB
+                            ai_settings = settings_manager.get_ai_model_settings()
+                            system_prompt = settings_manager.get_setting("system_prompts.incident_triage", DEFAULT_TRIAGE_PROMPT)
 
-                                        Incident Title: {title}
-                                        Incident Description: {description}
+                            model_id = ai_settings.get("selected_model_id")
+                            model_name = ai_settings.get("selected_model_name", "Unknown Model")
+                            max_tokens = ai_settings.get("max_tokens", 300)
+                            temperature = ai_settings.get("temperature", 0.3)
 
-                                        Priority Levels:
-                                        - P1: Critical - System down, major business impact
-                                        - P2: High - Significant impact, workaround available
-                                        - P3: Medium - Moderate impact, standard response
-                                        - P4: Low - Minor impact, can be scheduled
+                            input_hash = incident_fingerprint(incident_data)
+                            prompt_hash = triage_prompt_fingerprint(system_prompt)
 
-                                        Respond with:
-                                        Priority: [P1/P2/P3/P4]
-                                        Reasoning: [Brief explanation]
-                                        """
+                            if recommendation_store.is_fresh(stored['ai_triage'], input_hash=input_hash, prompt_hash=prompt_hash):
+                                st.info("Incident and prompt unchanged since the last classification - using the stored recommendation")
+                            elif not bedrock_client.is_available():
+                                st.error("❌ AI service not available - check AWS credentials")
+                            elif not model_id:
+                                st.warning("⚠️ No model configured. Please go to AI Features page and select a model first.")
+                            else:
+                                with st.spinner(f"Classifying {selected_incident_id}..."):
+                                    st.info(f"Using MongoDB settings: {model_name} | Tokens: {max_tokens} | Temp: {temperature}")
+
+                                    try:
+                                        results = bedrock_client.classify_incidents_batch(
+                                            [{"incident_id": selected_incident_id, "title": title, "description": description}],
+                                            model_id=model_id,
+                                            system_prompt=system_prompt,
+                                            temperature=temperature,
+                                            max_output_tokens=max_tokens
+                                        )
+                                        result = results.get(selected_incident_id)
+
+                                        if result and not result.get('failed'):
+                                            # Show structured response for debugging
+                                            with st.expander("🔍 Raw AI Response", expanded=False):
+                                                st.json(result)
+
+                                            if not recommendation_store.save_triage(selected_incident_id, result, model_id, prompt_hash, input_hash):
+                                                st.warning("⚠️ Could not store the recommendation - it will not be kept after this page reloads")
+                                            stored['ai_triage'] = {**result, "model_id": model_id, "prompt_hash": prompt_hash,
+                                                                   "input_hash": input_hash, "classified_at": datetime.utcnow()}
+
+                                            # Show the system prompt used
+                                            with st.expander("🔍 Classification Details", expanded=False):
+                                                st.write(f"**Model:** {model_name}")
+                                                st.write(f"**Model ID:** {model_id}")
+                                                st.write(f"**System Prompt:** {system_prompt}")
+                                                st.write(f"**Title:** {title}")
+                                                st.write(f"**Description:** {description}")
+                                        else:
+                                            st.error("❌ No response from AI model")
+                                    except Exception as e:
+                                        st.error(f"❌ Error during classification: {str(e)}")
+                        else:
+                            st.warning("⚠️ Incident missing title or description")
 
-                                        st.info(f"Using MongoDB settings: {model_name} | Tokens: {max_tokens} | Temp: {temperature}")
+                    if assign_clicked:
+                        if title and description:
+                            # Get agents data
+                            agents_df = data_service.get_agents()
+
+                            if not agents_df.empty:
+                                # Get settings from MongoDB
+                                ai_settings = settings_manager.get_ai_model_settings()
+                                system_prompt = settings_manager.get_setting("system_prompts.agent_assignment", DEFAULT_ASSIGNMENT_PROMPT)
+
+                                model_id = ai_settings.get("selected_model_id")
+                                model_name = ai_settings.get("selected_model_name", "Unknown Model")
+                                max_tokens = ai_settings.get("max_tokens", 400)
+                                temperature = ai_settings.get("temperature", 0.3)
+
+                                agent_info = build_agent_roster(incident_data, agents_df)
+                                input_hash = incident_fingerprint(incident_data, ASSIGNMENT_INPUT_FIELDS)
+                                prompt_hash = assignment_prompt_fingerprint(system_prompt)
+                                roster_hash = roster_fingerprint(agent_info)
+
+                                if recommendation_store.is_fresh(stored['ai_assignment'], input_hash=input_hash,
+                                                                 prompt_hash=prompt_hash, roster_hash=roster_hash):
+                                    st.info("Incident, agent roster and prompt unchanged since the last recommendation - using the stored recommendation")
+                                elif not bedrock_client.is_available():
+                                    st.error("❌ AI service not available - check AWS credentials")
+                                elif not model_id:
+                                    st.warning("⚠️ No model configured. Please go to AI Features page and select a model first.")
+                                else:
+                                    with st.spinner(f"Finding best agent for {selected_incident_id}..."):
+                                        prompt = ASSIGNMENT_PROMPT_TEMPLATE.format(
+                                            title=title,
+                                            description=description,
+                                            category=category,
+                                            agents='\n'.join(agent_info) or "No agents have free capacity"
+                                        )
 
                                         try:
                                             response = bedrock_client.invoke_model(
@@ -334,363 +550,52 @@ with tab1:
                                                 with st.expander("🔍 Raw AI Response", expanded=False):
                                                     st.code(response)
 
-                                                # Parse response with improved logic
-                                                priority = "P3"  # Default
-                                                reasoning = "Unable to determine"  # Default
-
-                                                # Method 1: Look for Priority and Reasoning sections
-                                                lines = response.split('\n')
-
-                                                # Find priority
-                                                for line in lines:
-                                                    line = line.strip()
-                                                    if line.startswith('Priority:'):
-                                                        priority = line.split(':', 1)[1].strip()
-                                                        break
-
-                                                # Find reasoning - look for "Reasoning:" and capture everything after it
-                                                reasoning_found = False
-                                                reasoning_lines = []
-
-                                                for line in lines:
-                                                    line = line.strip()
-                                                    if line.startswith('Reasoning:'):
-                                                        reasoning_found = True
-                                                        # Get any text after "Reasoning:" on the same line
-                                                        after_colon = line.split(':', 1)[1].strip()
-                                                        if after_colon:
-                                                            reasoning_lines.append(after_colon)
-                                                    elif reasoning_found and line:
-                                                        # Continue collecting reasoning lines until we hit another section or end
-                                                        if line.startswith(('Priority:', 'Confidence:', 'Summary:')):
-                                                            break
-                                                        reasoning_lines.append(line)
-
-                                                # Join reasoning lines
-                                                if reasoning_lines:
-                                                    reasoning = '\n'.join(reasoning_lines).strip()
-
-                                                # Method 2: If still no reasoning, try alternative parsing
-                                                if reasoning == "Unable to determine":
-                                                    # Look for text after "Reasoning:" in the entire response
-                                                    if 'Reasoning:' in response:
-                                                        parts = response.split('Reasoning:', 1)
-                                                        if len(parts) > 1:
-                                                            after_reasoning = parts[1].strip()
-                                                            # Take everything until next section or end
-                                                            next_section = None
-                                                            for section in ['Priority:', 'Confidence:', 'Summary:']:
-                                                                if section in after_reasoning:
-                                                                    idx = after_reasoning.find(section)
-                                                                    if next_section is None or idx < after_reasoning.find(next_section):
-                                                                        next_section = section
-
-                                                            if next_section:
-                                                                reasoning = after_reasoning.split(next_section)[0].strip()
-                                                            else:
-                                                                reasoning = after_reasoning.strip()
-
-                                                # Method 3: If still no reasoning, use everything after priority
-                                                if reasoning == "Unable to determine" and 'Priority:' in response:
-                                                    parts = response.split('Priority:', 1)
-                                                    if len(parts) > 1:
-                                                        after_priority = parts[1]
-                                                        # Skip the priority line and use the rest
-                                                        priority_lines = after_priority.split('\n')
-                                                        if len(priority_lines) > 1:
-                                                            reasoning = '\n'.join(priority_lines[1:]).strip()
-
-                                                # Clean up priority (extract just P1, P2, P3, P4)
-                                                import re
-                                                priority_match = re.search(r'P[1-4]', priority.upper())
-                                                if priority_match:
-                                                    priority = priority_match.group()
-
-                                                st.success(f"**AI Classification for {selected_incident_id}:**")
-                                                st.write(f"**Predicted Priority:** {priority}")
-                                                st.markdown(f"**Reasoning:**")
-                                                st.markdown(reasoning)
-
-                                                # Add apply recommendation button
-                                                current_priority = incident_data.get('true_priority', incident_data.get('priority', 'Unknown'))
-                                                if priority != current_priority:
-                                                    st.write("---")
-                                                    col_apply, col_info = st.columns([1, 2])
-                                                    with col_apply:
-                                                        if st.button(f"Apply Priority {priority}",
-                                                                   key=f"apply_priority_{selected_incident_id}",
-                                                                   type="primary"):
-                                                            success = data_service.update_incident_priority(selected_incident_id, priority)
-                                                            if success:
-                                                                st.success(f"✅ Updated incident {selected_incident_id} priority to {priority}!")
-                                                                st.rerun()
-                                                            else:
-                                                                st.error("❌ Failed to update incident. MongoDB not available.")
-                                                    with col_info:
-                                                        st.info(f"Current priority: {current_priority} → Recommended: {priority}")
-                                                else:
-                                                    st.info(f"✅ Current priority ({current_priority}) matches AI recommendation")
-
-                                                # Show the system prompt used
-                                                with st.expander("🔍 Classification Details", expanded=False):
+                                                result = parse_assignment_response(response)
+                                                if not recommendation_store.save_assignment(selected_incident_id, result, model_id,
+                                                                                            prompt_hash, input_hash, roster_hash):
+                                                    st.warning("⚠️ Could not store the recommendation - it will not be kept after this page reloads")
+                                                stored['ai_assignment'] = {**result, "model_id": model_id, "prompt_hash": prompt_hash,
+                                                                           "input_hash": input_hash, "roster_hash": roster_hash,
+                                                                           "recommended_at": datetime.utcnow()}
+
+                                                # Show assignment details
+                                                with st.expander("🔍 Assignment Details", expanded=False):
                                                     st.write(f"**Model:** {model_name}")
                                                     st.write(f"**Model ID:** {model_id}")
                                                     st.write(f"**System Prompt:** {system_prompt}")
-                                                    st.write(f"**Title:** {title}")
-                                                    st.write(f"**Description:** {description}")
+                                                    st.write(f"**Incident Title:** {title}")
+                                                    st.write(f"**Incident Description:** {description}")
+                                                    st.write(f"**Category:** {category}")
+                                                    st.write(f"**Candidate Agents (top {len(agent_info)} of {len(agents_df)}):**")
+                                                    for agent_line in agent_info:
+                                                        st.write(agent_line)
                                             else:
                                                 st.error("❌ No response from AI model")
                                         except Exception as e:
-                                            st.error(f"❌ Error during classification: {str(e)}")
-                                    else:
-                                        st.warning("⚠️ No model configured. Please go to AI Features page and select a model first.")
+                                            st.error(f"❌ Error during agent assignment: {str(e)}")
                             else:
-                                st.error("❌ AI service not available - check AWS credentials")
+                                st.warning("⚠️ No agents data available. Please generate sample agents in the Agents page.")
                         else:
                             st.warning("⚠️ Incident missing title or description")
 
-                    if assign_clicked:
-                        # Get the incident data for agent assignment
-                        title = incident_data.get('short_description') or incident_data.get('title', '')
-                        description = incident_data.get('description', '')
-                        category = incident_data.get('category_name') or incident_data.get('category', '')
-
-                        if title and description:
-                            if bedrock_client.is_available():
-                                with st.spinner(f"Finding best agent for {selected_incident_id}..."):
-                                    # Get agents data
-                                    agents_df = data_service.get_agents()
-
-                                    if not agents_df.empty:
-                                        # Get settings from MongoDB
-                                        ai_settings = settings_manager.get_ai_model_settings()
-                                        system_prompt = settings_manager.get_setting("system_prompts.agent_assignment",
-                                            "You are an ITSM resource allocation expert with deep understanding of skill matching, workload balancing, and performance optimisation for technical support teams. You will consider skillset matching with the title, description and category of incident, but you will also consider the agent's current workload. If the agent is currently fully allocated, do not attempt to assign the item to them.")
-
-                                        model_id = ai_settings.get("selected_model_id")
-                                        model_name = ai_settings.get("selected_model_name", "Unknown Model")
-                                        max_tokens = ai_settings.get("max_tokens", 400)
-                                        temperature = ai_settings.get("temperature", 0.3)
-
-                                        if model_id:
-                                            # Prepare agent information
-                                            agent_info = []
-                                            for _, agent in agents_df.iterrows():
-                                                skills = agent.get('skills', [])
-                                                if isinstance(skills, str):
-                                                    # Handle case where skills might be stored as string
-                                                    skills = [skills]
-                                                elif not isinstance(skills, list):
-                                                    skills = []
-
-                                                queue_load = agent.get('current_queue', 0)
-                                                status = agent.get('status', 'Unknown')
-                                                name = agent.get('name', 'Unknown')
-
-                                                # Determine availability based on queue and status
-                                                if queue_load >= 5:
-                                                    availability = "FULL (5/5 - Cannot take new assignments)"
-                                                elif queue_load >= 4:
-                                                    availability = f"BUSY ({queue_load}/5 - Limited capacity)"
-                                                elif queue_load >= 2:
-                                                    availability = f"MODERATE ({queue_load}/5 - Available)"
-                                                else:
-                                                    availability = f"AVAILABLE ({queue_load}/5 - Good capacity)"
-
-                                                if status != 'Available':
-                                                    availability += f" - Status: {status}"
-
-                                                skills_str = ', '.join(skills) if skills else 'No specific skills listed'
-                                                agent_summary = f"- {name}: Skills: [{skills_str}], Workload: {availability}"
-                                                agent_info.append(agent_summary)
-
-                                            # Create the prompt
-                                            prompt = f"""Analyze this incident and recommend the best agent for assignment.
-
-                                            Incident Details:
-                                            Title: {title}
-                                            Description: {description}
-                                            Category: {category}
-
-                                            Available Agents:
-                                            {chr(10).join(agent_info)}
-
-                                            Assignment Rules:
-                                            1. Match agent skills to incident requirements
-                                            2. Consider current workload - do NOT assign to agents marked as FULL
-                                            3. Prefer agents with AVAILABLE or MODERATE workload
-                                            4. If no suitable agent is available due to workload, recommend leaving unassigned
-                                            5. Consider agent status (Available vs Away/Busy)
-
-                                            Respond with:
-                                            Recommended Agent: [Agent name or "UNASSIGNED"]
-                                            Reasoning: [Brief explanation of why this agent was chosen or why leaving unassigned]
-                                            Confidence: [High/Medium/Low]
-                                            """
-
-                                            try:
-                                                response = bedrock_client.invoke_model(
-                                                    prompt,
-                                                    model_id,
-                                                    max_tokens,
-                                                    temperature,
-                                                    system_prompt=system_prompt
-                                                )
-
-                                                if response:
-                                                    # Show raw response for debugging
-                                                    with st.expander("🔍 Raw AI Response", expanded=False):
-                                                        st.code(response)
-
-                                                    # Parse response with improved logic
-                                                    recommended_agent = "UNASSIGNED"
-                                                    reasoning = "Unable to determine"
-                                                    confidence = "Low"
-
-                                                    # Method 1: Look for structured sections
-                                                    lines = response.split('\n')
-
-                                                    # Find recommended agent
-                                                    for line in lines:
-                                                        line = line.strip()
-                                                        if line.startswith('Recommended Agent:'):
-                                                            recommended_agent = line.split(':', 1)[1].strip()
-                                                            break
-
-                                                    # Find reasoning - look for "Reasoning:" and capture everything after it
-                                                    reasoning_found = False
-                                                    reasoning_lines = []
-
-                                                    for line in lines:
-                                                        line = line.strip()
-                                                        if line.startswith('Reasoning:'):
-                                                            reasoning_found = True
-                                                            # Get any text after "Reasoning:" on the same line
-                                                            after_colon = line.split(':', 1)[1].strip()
-                                                            if after_colon:
-                                                                reasoning_lines.append(after_colon)
-                                                        elif reasoning_found and line:
-                                                            # Continue collecting reasoning lines until we hit another section or end
-                                                            if line.startswith(('Recommended Agent:', 'Confidence:', 'Summary:')):
-                                                                break
-                                                            reasoning_lines.append(line)
-
-                                                    # Join reasoning lines
-                                                    if reasoning_lines:
-                                                        reasoning = '\n'.join(reasoning_lines).strip()
-
-                                                    # Method 2: If still no reasoning, try alternative parsing
-                                                    if reasoning == "Unable to determine":
-                                                        # Look for text after "Reasoning:" in the entire response
-                                                        if 'Reasoning:' in response:
-                                                            parts = response.split('Reasoning:', 1)
-                                                            if len(parts) > 1:
-                                                                after_reasoning = parts[1].strip()
-                                                                # Take everything until next section or end
-                                                                next_section = None
-                                                                for section in ['Recommended Agent:', 'Confidence:', 'Summary:']:
-                                                                    if section in after_reasoning:
-                                                                        idx = after_reasoning.find(section)
-                                                                        if next_section is None or idx < after_reasoning.find(next_section):
-                                                                            next_section = section
-
-                                                                if next_section:
-                                                                    reasoning = after_reasoning.split(next_section)[0].strip()
-                                                                else:
-                                                                    reasoning = after_reasoning.strip()
-
-                                                    # Method 3: If still no reasoning, use everything after recommended agent
-                                                    if reasoning == "Unable to determine" and 'Recommended Agent:' in response:
-                                                        parts = response.split('Recommended Agent:', 1)
-                                                        if len(parts) > 1:
-                                                            after_agent = parts[1]
-                                                            # Skip the agent line and use the rest
-                                                            agent_lines = after_agent.split('\n')
-                                                            if len(agent_lines) > 1:
-                                                                reasoning = '\n'.join(agent_lines[1:]).strip()
-
-                                                    # Find confidence
-                                                    for line in lines:
-                                                        line = line.strip()
-                                                        if line.startswith('Confidence:'):
-                                                            confidence = line.split(':', 1)[1].strip()
-                                                            break
-
-                                                    # Display results
-                                                    st.success(f"**AI Agent Assignment for {selected_incident_id}:**")
-
-                                                    if recommended_agent.upper() == "UNASSIGNED":
-                                                        st.warning(f"**Recommendation:** Leave Unassigned")
-                                                    else:
-                                                        st.info(f"**Recommended Agent:** {recommended_agent}")
-
-                                                    st.write(f"**Confidence:** {confidence}")
-                                                    st.markdown(f"**Reasoning:**")
-                                                    st.markdown(reasoning)
-
-                                                    # Add apply recommendation button for agent assignment
-                                                    current_agent = incident_data.get('assigned_to', '')
-                                                    if recommended_agent.upper() != "UNASSIGNED" and recommended_agent != current_agent:
-                                                        st.write("---")
-                                                        col_apply, col_info = st.columns([1, 2])
-                                                        with col_apply:
-                                                            if st.button(f"Assign to {recommended_agent}",
-                                                                       key=f"apply_assignment_{selected_incident_id}",
-                                                                       type="primary"):
-                                                                success = data_service.update_incident_assignment(selected_incident_id, recommended_agent)
-                                                                if success:
-                                                                    st.success(f"✅ Assigned incident {selected_incident_id} to {recommended_agent}!")
-                                                                    st.rerun()
-                                                                else:
-                                                                    st.error("❌ Failed to update incident. MongoDB not available.")
-                                                        with col_info:
-                                                            current_display = current_agent if current_agent else "Unassigned"
-                                                            st.info(f"Current: {current_display} → Recommended: {recommended_agent}")
-                                                    elif recommended_agent.upper() == "UNASSIGNED":
-                                                        if current_agent:
-                                                            st.write("---")
-                                                            col_apply, col_info = st.columns([1, 2])
-                                                            with col_apply:
-                                                                if st.button("Leave Unassigned",
-                                                                           key=f"apply_unassign_{selected_incident_id}",
-                                                                           type="secondary"):
-                                                                    success = data_service.update_incident_assignment(selected_incident_id, "")
-                                                                    if success:
-                                                                        st.success(f"✅ Unassigned incident {selected_incident_id}!")
-                                                                        st.rerun()
-                                                                    else:
-                                                                        st.error("❌ Failed to update incident. MongoDB not available.")
-                                                            with col_info:
-                                                                st.info(f"Current: {current_agent} → Recommended: Unassigned")
-                                                        else:
-                                                            st.info("✅ Incident is already unassigned as recommended")
-                                                    else:
-                                                        current_display = current_agent if current_agent else "Unassigned"
-                                                        st.info(f"✅ Current assignment ({current_display}) matches AI recommendation")
-
-                                                    # Show assignment details
-                                                    with st.expander("🔍 Assignment Details", expanded=False):
-                                                        st.write(f"**Model:** {model_name}")
-                                                        st.write(f"**Model ID:** {model_id}")
-                                                        st.write(f"**System Prompt:** {system_prompt}")
-                                                        st.write(f"**Incident Title:** {title}")
-                                                        st.write(f"**Incident Description:** {description}")
-                                                        st.write(f"**Category:** {category}")
-                                                        st.write("**Available Agents:**")
-                                                        for agent_line in agent_info:
-                                                            st.write(agent_line)
-                                                else:
-                                                    st.error("❌ No response from AI model")
-                                            except Exception as e:
-                                                st.error(f"❌ Error during agent assignment: {str(e)}")
-                                        else:
-                                            st.warning("⚠️ No model configured. Please go to AI Features page and select a model first.")
-                                    else:
-                                        st.warning("⚠️ No agents data available. Please generate sample agents in the Agents page.")
-                            else:
-                                st.error("❌ AI service not available - check AWS credentials")
-                        else:
-                            st.warning("⚠️ Incident missing title or description")
+                    if stored['ai_triage']:
+                        system_prompt = settings_manager.get_setting("system_prompts.incident_triage", DEFAULT_TRIAGE_PROMPT)
+                        triage_fresh = recommendation_store.is_fresh(
+                            stored['ai_triage'],
+                            input_hash=incident_fingerprint(incident_data),
+                            prompt_hash=triage_prompt_fingerprint(system_prompt)
+                        )
+                        render_triage_recommendation(selected_incident_id, incident_data, stored['ai_triage'], triage_fresh)
+
+                    if stored['ai_assignment']:
+                        system_prompt = settings_manager.get_setting("system_prompts.agent_assignment", DEFAULT_ASSIGNMENT_PROMPT)
+                        assignment_fresh = recommendation_store.is_fresh(
+                            stored['ai_assignment'],
+                            input_hash=incident_fingerprint(incident_data, ASSIGNMENT_INPUT_FIELDS),
+                            prompt_hash=assignment_prompt_fingerprint(system_prompt),
+                            roster_hash=roster_fingerprint(build_agent_roster(incident_data, data_service.get_agents()))
+                        )
+                        render_assignment_recommendation(selected_incident_id, incident_data, stored['ai_assignment'], assignment_fresh)
 
                 # Show details if requested
                 if st.session_state.get(f"show_queue_details_{selected_incident_id}", False):
@@ -702,6 +607,40 @@ with tab1:
                         with detail_cols[1]:
                             for col in queue_display_df.columns[len(queue_display_df.columns)//2:]:
                                 st.write(f"**{col}:** {selected_row[col]}")
+
+                        similarity_index.refresh_if_due()
+                        similar_col, kb_col = st.columns(2)
+                        with similar_col:
+                            st.write("**🔁 Similar Resolved Incidents:**")
+                            similar_incidents = similarity_index.similar_incidents(incident_data.to_dict(), k=5)
+                            if similar_incidents:
+                                for similar in similar_incidents:
+                                    similar_title = similar.get('title', 'No title')
+                                    st.write(f"- **{similar['incident_id']}** ({similar['similarity']:.0%}) {similar_title}")
+                                    st.caption(f"Resolution: {str(similar.get('resolution_notes', ''))[:200]}")
+                            else:
+                                st.caption("No similar resolved incidents found")
+                        with kb_col:
+                            st.write("**📚 Related KB Articles:**")
+                            related_articles = similarity_index.related_kb_articles(incident_data.to_dict(), k=5)
+                            if related_articles:
+                                for article in related_articles:
+                                    st.write(f"- **{article.get('title', 'Untitled Article')}** ({article['similarity']:.0%})")
+                            else:
+                                st.caption("No related KB articles found")
+
+                        if incident_data.get('status') in ['Open', 'In Progress', 'Assigned']:
+                            with st.form(f"resolve_{selected_incident_id}"):
+                                resolution_notes = st.text_area("Resolution Notes",
+                                                                placeholder="Describe how the incident was resolved...")
+                                if st.form_submit_button("✅ Resolve Incident", type="primary"):
+                                    if not resolution_notes.strip():
+                                        st.warning("Please add resolution notes before resolving")
+                                    elif data_service.resolve_incident(selected_incident_id, resolution_notes.strip()):
+                                        st.success(f"✅ Resolved incident {selected_incident_id}!")
+                                        st.rerun()
+                                    else:
+                                        st.error("❌ Failed to resolve incident")
             else:
                 st.info("👆 Click on a row in the table above to select it and perform actions")
 
@@ -713,126 +652,71 @@ with tab1:
 with tab2:
     st.subheader("All Incidents")
 
-    # Enhanced filters using enriched data
-    col1, col2, col3, col4, col5 = st.columns(5)
-
-    with col1:
-        if 'true_priority' in incidents_enriched.columns:
-            priorities = ['All'] + sorted(incidents_enriched['true_priority'].dropna().unique().tolist())
-            selected_priority = st.selectbox("Priority", priorities)
-        else:
-            selected_priority = 'All'
-
-    with col2:
-        # Use enriched category names if available
-        if 'category_name' in incidents_enriched.columns:
-            category_options = incidents_enriched[['category_id', 'category_name']].dropna().drop_duplicates()
-            category_choices = ['All'] + [f"{row['category_name']} ({row['category_id']})"
-                                        for _, row in category_options.iterrows()]
-            selected_category_display = st.selectbox("Category", category_choices)
-            if selected_category_display == 'All':
-                selected_category = 'All'
-            else:
-                selected_category = selected_category_display.split('(')[-1].rstrip(')')
-        elif 'category_id' in incidents_enriched.columns:
-            categories_list = ['All'] + sorted(incidents_enriched['category_id'].dropna().unique().tolist())
-            selected_category = st.selectbox("Category", categories_list)
-        else:
-            selected_category = 'All'
-
-    with col3:
-        # Use enriched service names if available
-        if 'service_name' in incidents_enriched.columns:
-            service_options = incidents_enriched[['service_id', 'service_name']].dropna().drop_duplicates()
-            service_choices = ['All'] + [f"{row['service_name']} ({row['service_id']})"
-                                       for _, row in service_options.iterrows()]
-            selected_service_display = st.selectbox("Service", service_choices)
-            if selected_service_display == 'All':
-                selected_service = 'All'
-            else:
-                selected_service = selected_service_display.split('(')[-1].rstrip(')')
-        elif 'service_id' in incidents_enriched.columns:
-            services_list = ['All'] + sorted(incidents_enriched['service_id'].dropna().unique().tolist())
-            selected_service = st.selectbox("Service", services_list)
-        else:
-            selected_service = 'All'
-
-    with col4:
-        # Assignment group filter
-        if 'group_name' in incidents_enriched.columns:
-            group_options = incidents_enriched[['true_assignment_group_id', 'group_name']].dropna().drop_duplicates()
-            group_choices = ['All'] + [f"{row['group_name']} ({row['true_assignment_group_id']})"
-                                     for _, row in group_options.iterrows()]
-            selected_group_display = st.selectbox("Assignment Group", group_choices)
-            if selected_group_display == 'All':
-                selected_group = 'All'
-            else:
-                selected_group = selected_group_display.split('(')[-1].rstrip(')')
-        else:
-            selected_group = 'All'
-
-    with col5:
-        # Status filter
-        if 'status' in incidents_enriched.columns:
-            statuses = ['All'] + sorted(incidents_enriched['status'].dropna().unique().tolist())
-            selected_status = st.selectbox("Status", statuses)
-        else:
-            selected_status = 'All'
+    # Filters come from the precomputed facets document; counts are narrowed by the other selections
+    incident_facets = facet_index.get_facets('incidents')
+    visible_facets = [facet for facet, definition in incident_facets['facets'].items()
+                      if definition['values']] if incident_facets else []
+    for facet in visible_facets:
+        # A selection can disappear when the data is regenerated
+        known_values = {value['value'] for value in incident_facets['facets'][facet]['values']}
+        if st.session_state.get(f"incident_facet_{facet}", 'All') not in known_values:
+            st.session_state[f"incident_facet_{facet}"] = 'All'
+    facet_selections = {facet: st.session_state[f"incident_facet_{facet}"] for facet in visible_facets}
+    narrowed_counts = facet_index.facet_counts('incidents', facet_selections)
+
+    filter_cols = st.columns(max(len(visible_facets), 1))
+    for filter_col, facet in zip(filter_cols, visible_facets):
+        definition = incident_facets['facets'][facet]
+        displays = {value['value']: value['display'] for value in definition['values']}
+        counts = narrowed_counts.get(facet, {})
+        with filter_col:
+            st.selectbox(
+                definition['label'],
+                ['All'] + list(displays),
+                key=f"incident_facet_{facet}",
+                format_func=lambda value, displays=displays, counts=counts, total=sum(counts.values()):
+                    f"All ({total:,})" if value == 'All' else f"{displays[value]} ({counts.get(value, 0):,})"
+            )
 
     # Apply filters to enriched data
-    filtered_incidents = incidents_enriched.copy()
-
-    if selected_priority != 'All':
-        filtered_incidents = filtered_incidents[filtered_incidents['true_priority'] == selected_priority]
-
-    if selected_category != 'All':
-        filtered_incidents = filtered_incidents[filtered_incidents['category_id'] == selected_category]
-
-    if selected_service != 'All':
-        filtered_incidents = filtered_incidents[filtered_incidents['service_id'] == selected_service]
-
-    if selected_group != 'All':
-        filtered_incidents = filtered_incidents[filtered_incidents['true_assignment_group_id'] == selected_group]
-
-    if selected_status != 'All':
-        filtered_incidents = filtered_incidents[filtered_incidents['status'] == selected_status]
+    filtered_incidents = incidents_enriched
+    for facet, selected_value in facet_selections.items():
+        if selected_value != 'All':
+            filtered_incidents = filtered_incidents[facet_series(filtered_incidents, 'incidents', facet) == selected_value]
 
     # Display filtered results
     total_incidents = len(filtered_incidents)
     st.write(f"Showing {total_incidents:,} of {len(incidents_enriched):,} incidents")
 
-    # Enhanced display columns - handle both CSV and AI-generated formats
+    # Display columns (canonical incident schema)
     display_columns = []
 
-    # Define column mappings for different data sources
+    # Define column display names
     column_mappings = [
-        # (preferred_column, fallback_column, display_name)
-        ('incident_id', None, 'Incident ID'),
-        ('created_on', None, 'Created'),
-        ('short_description', 'title', 'Title'),  # CSV vs AI-generated
-        ('description', None, 'Description'),  # Add description column
-        ('true_priority', 'priority', 'Priority'),  # CSV vs AI-generated
-        ('status', None, 'Status'),
-        ('category_name', 'category', 'Category'),  # Enriched vs AI-generated readable
-        ('service_name', 'service', 'Service'),  # Enriched vs AI-generated readable
-        ('urgency', None, 'Urgency'),
-        ('impact', None, 'Impact'),
-        ('assigned_to', None, 'Assigned To'),
-        ('resolution_notes', None, 'Resolution Notes'),
-        ('resolved_date', None, 'Resolved Date'),
-        ('created_by', None, 'Created By'),
-        ('location', None, 'Location'),
+        # (column, display_name)
+        ('incident_id', 'Incident ID'),
+        ('created_on', 'Created'),
+        ('title', 'Title'),
+        ('description', 'Description'),
+        ('priority', 'Priority'),
+        ('status', 'Status'),
+        ('category', 'Category'),
+        ('service', 'Service'),
+        ('urgency', 'Urgency'),
+        ('impact', 'Impact'),
+        ('assigned_to', 'Assigned To'),
+        ('resolution_notes', 'Resolution Notes'),
+        ('resolved_date', 'Resolved Date'),
+        ('created_by', 'Created By'),
+        ('location', 'Location'),
     ]
 
     # Build display columns based on what's available
     column_renames = {}
-    for preferred, fallback, display_name in column_mappings:
-        if preferred in filtered_incidents.columns:
-            display_columns.append(preferred)
-            column_renames[preferred] = display_name
-        elif fallback and fallback in filtered_incidents.columns:
-            display_columns.append(fallback)
-            column_renames[fallback] = display_name
+    for column, display_name in column_mappings:
+        if column in filtered_incidents.columns:
+            display_columns.append(column)
+            column_renames[column] = display_name
 
     if display_columns and total_incidents > 0:
         # Create display dataframe with selected columns
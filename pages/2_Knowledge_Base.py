@@ -1,5 +1,4 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import sys
@@ -8,31 +7,169 @@ import os
 # Add the parent directory to the path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.data_ingest import data_ingest_manager
+from utils.kb_service import kb_service
+from utils.kb_generation import kb_article_updater
 
 st.set_page_config(page_title="Knowledge Base", page_icon="📚", layout="wide")
 st.title("Knowledge Base")
 
-# Get knowledge base data from MongoDB only
-kb_articles_csv = pd.DataFrame()  # No longer using CSV data
-kb_templates = pd.DataFrame()  # No longer using CSV data
-
-# Get KB articles from MongoDB (both AI-generated and manually created)
-mongodb_kb_articles = []
-if data_ingest_manager.is_available():
-    try:
-        mongodb_articles = list(data_ingest_manager.kb_articles_collection.find({}, {"_id": 0}))
-        mongodb_kb_articles = pd.DataFrame(mongodb_articles) if mongodb_articles else pd.DataFrame()
-    except Exception as e:
-        st.sidebar.warning(f"Could not load MongoDB articles: {str(e)}")
-        mongodb_kb_articles = pd.DataFrame()
-else:
-    mongodb_kb_articles = pd.DataFrame()
-
-# Combine CSV and MongoDB articles
-kb_articles = pd.concat([kb_articles_csv, mongodb_kb_articles], ignore_index=True) if not mongodb_kb_articles.empty else kb_articles_csv
-categories = dfs.get("category_tree.csv", pd.DataFrame())
-services = dfs.get("services_catalog.csv", pd.DataFrame())
-incidents = dfs.get("incidents_resolved.csv", pd.DataFrame())
+ARTICLES_PER_PAGE = 20
+PUBLISH_STATES = ["Draft", "Published", "Archived"]
+
+
+def render_article(article_id: str):
+    """Load one article in full and show it with its edit/delete actions"""
+    article = kb_service.get_article(article_id)
+    if not article:
+        st.warning("Article not found - it may have been deleted")
+        return
+
+    is_ai_generated = article.get('ai_generated', False)
+
+    if is_ai_generated:
+        # Display AI-generated article format
+        st.markdown(f"### {article.get('title', 'Untitled Article')}")
+
+        if article.get('problem'):
+            st.write("**Problem Description:**")
+            st.markdown(article['problem'])
+
+        if article.get('root_cause'):
+            st.write("**Root Cause:**")
+            st.markdown(article['root_cause'])
+
+        if article.get('solution'):
+            st.write("**Solution Steps:**")
+            st.markdown(article['solution'])
+
+        if article.get('prevention'):
+            st.write("**Prevention:**")
+            st.markdown(article['prevention'])
+
+        if article.get('tags'):
+            st.write("**Tags:**")
+            st.code(article['tags'])
+
+        # Show generation metadata
+        st.write("---")
+        st.write("**Generation Info:**")
+        if article.get('source_incidents'):
+            st.write(f"Generated from {article['source_incidents']} resolved incidents")
+        if article.get('_created_at'):
+            st.write(f"Created: {article['_created_at']}")
+        if article.get('publish_state'):
+            st.write(f"Status: {article['publish_state']}")
+        if article.get('version', 1) > 1:
+            st.write(f"Version {article['version']}, last updated: {article.get('_updated_at', 'Unknown')}")
+            with st.expander("🕘 Version History"):
+                for previous in kb_article_updater.get_versions(article_id):
+                    st.write(f"**Version {previous['version']}** - {previous.get('title', 'Untitled')} "
+                             f"({previous.get('source_incidents', 0)} source incidents, archived {previous.get('archived_at')})")
+                    st.caption(str(previous.get('solution', ''))[:300])
+    else:
+        # Display standard article format
+        col1, col2 = st.columns([2, 1])
+
+        with col1:
+            if article.get('body'):
+                st.write("**Content:**")
+                st.write(article['body'])
+            else:
+                st.write("*No content available*")
+
+        with col2:
+            st.write("**Details:**")
+            if article.get('service_id'):
+                st.write(f"**Service:** {article['service_id']}")
+            if article.get('category_id'):
+                st.write(f"**Category:** {article['category_id']}")
+            if article.get('tags'):
+                st.write(f"**Tags:** {article['tags']}")
+            if article.get('publish_state'):
+                st.write(f"**Status:** {article['publish_state']}")
+            if article.get('owner_group_id'):
+                st.write(f"**Owner:** {article['owner_group_id']}")
+
+    # Action buttons
+    if data_ingest_manager.is_available():
+        st.write("---")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("✏️ Edit", key=f"edit_{article_id}"):
+                st.session_state[f"editing_article_{article_id}"] = True
+        with col2:
+            if st.button("🗑️ Delete", key=f"delete_{article_id}"):
+                if kb_service.delete_article(article_id):
+                    st.session_state.kb_open_article = None
+                    st.success("✅ Article deleted!")
+                    st.rerun()
+                else:
+                    st.error("Error deleting article")
+
+    # Show edit form if editing this article
+    if st.session_state.get(f"editing_article_{article_id}", False):
+        st.write("---")
+        st.write("**Edit Article:**")
+
+        with st.form(f"edit_form_{article_id}"):
+            # Pre-populate form with existing data
+            edit_title = st.text_input("Title", value=article.get('title', ''))
+
+            if is_ai_generated:
+                # Edit structured fields
+                edit_problem = st.text_area("Problem Description", value=article.get('problem', ''), height=100)
+                edit_root_cause = st.text_area("Root Cause", value=article.get('root_cause', ''), height=100)
+                edit_solution = st.text_area("Solution Steps", value=article.get('solution', ''), height=150)
+                edit_prevention = st.text_area("Prevention", value=article.get('prevention', ''), height=100)
+                edit_tags = st.text_input("Tags", value=article.get('tags', ''))
+            else:
+                # Edit standard fields
+                edit_body = st.text_area("Content", value=article.get('body', ''), height=200)
+                edit_category = st.text_input("Category ID", value=article.get('category_id') or '')
+                edit_service = st.text_input("Service ID", value=article.get('service_id') or '')
+                edit_tags = st.text_input("Tags", value=article.get('tags') or '')
+                edit_status = st.selectbox("Status", PUBLISH_STATES,
+                                         index=PUBLISH_STATES.index(article.get('publish_state')) if article.get('publish_state') in PUBLISH_STATES else 0)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                save_clicked = st.form_submit_button("💾 Save Changes", type="primary")
+            with col2:
+                cancel_clicked = st.form_submit_button("❌ Cancel")
+
+            if save_clicked:
+                if not edit_title.strip():
+                    st.error("Title is required")
+                else:
+                    # Prepare update data
+                    update_data = {'title': edit_title.strip()}
+
+                    if is_ai_generated:
+                        update_data.update({
+                            'problem': edit_problem.strip(),
+                            'root_cause': edit_root_cause.strip(),
+                            'solution': edit_solution.strip(),
+                            'prevention': edit_prevention.strip(),
+                            'tags': edit_tags.strip()
+                        })
+                    else:
+                        update_data.update({
+                            'body': edit_body.strip(),
+                            'category_id': edit_category.strip(),
+                            'service_id': edit_service.strip(),
+                            'tags': edit_tags.strip(),
+                            'publish_state': edit_status
+                        })
+
+                    if kb_service.update_article(article_id, update_data):
+                        st.success("✅ Article updated successfully!")
+                        st.session_state[f"editing_article_{article_id}"] = False
+                    else:
+                        st.error("No changes were made or article not found")
+
+            if cancel_clicked:
+                st.session_state[f"editing_article_{article_id}"] = False
+
 
 # Create tabs for CRUD operations
 tab1, tab2 = st.tabs(["📖 Browse Articles", "➕ Create Article"])
@@ -40,233 +177,88 @@ tab1, tab2 = st.tabs(["📖 Browse Articles", "➕ Create Article"])
 with tab1:
     st.subheader("Browse Knowledge Base Articles")
 
-    if not kb_articles.empty:
-        # Filters for articles
+    if kb_service.available:
+        articles_without_id = kb_service.count_articles_without_id()
+        if articles_without_id:
+            st.warning(f"{articles_without_id} older articles have no article id and cannot be opened. "
+                       "Run the KB article id migration on the Data Management page.")
+
+        # Filter values come from the database, not from loading every article
+        filter_options = kb_service.get_filter_options()
+
+        search_text = st.text_input("🔍 Search", key="articles_search",
+                                    placeholder="Search titles, problems, solutions and tags")
+
         col1, col2, col3 = st.columns(3)
 
         with col1:
-            if 'service_id' in kb_articles.columns:
-                services_list = ['All'] + sorted(kb_articles['service_id'].dropna().unique().tolist())
-                selected_service = st.selectbox("Service", services_list, key="articles_service")
-            else:
-                selected_service = 'All'
+            selected_service = st.selectbox("Service", ['All'] + filter_options['service_id'], key="articles_service")
 
         with col2:
-            if 'category_id' in kb_articles.columns:
-                categories_list = ['All'] + sorted(kb_articles['category_id'].dropna().unique().tolist())
-                selected_category = st.selectbox("Category", categories_list, key="articles_category")
-            else:
-                selected_category = 'All'
+            selected_category = st.selectbox("Category", ['All'] + filter_options['category_id'], key="articles_category")
 
         with col3:
-            if 'publish_state' in kb_articles.columns:
-                states = ['All'] + sorted(kb_articles['publish_state'].dropna().unique().tolist())
-                selected_state = st.selectbox("Publish State", states, key="articles_state")
-            else:
-                selected_state = 'All'
-
-        # Apply filters
-        filtered_articles = kb_articles.copy()
-
-        if selected_service != 'All':
-            filtered_articles = filtered_articles[filtered_articles['service_id'] == selected_service]
-
-        if selected_category != 'All':
-            filtered_articles = filtered_articles[filtered_articles['category_id'] == selected_category]
-
-        if selected_state != 'All':
-            filtered_articles = filtered_articles[filtered_articles['publish_state'] == selected_state]
+            selected_state = st.selectbox("Publish State", ['All'] + filter_options['publish_state'], key="articles_state")
+
+        # Go back to the first page whenever the query changes
+        query_signature = (search_text, selected_service, selected_category, selected_state)
+        if st.session_state.get("articles_query") != query_signature:
+            st.session_state.articles_query = query_signature
+            st.session_state.articles_page = 1
+
+        results = kb_service.search_articles(
+            search_text, selected_service, selected_category, selected_state,
+            page=st.session_state.articles_page, page_size=ARTICLES_PER_PAGE
+        )
+
+        if results['total']:
+            # Show article counts
+            first_shown = (results['page'] - 1) * ARTICLES_PER_PAGE + 1
+            last_shown = first_shown + len(results['articles']) - 1
+            st.write(f"Showing {first_shown:,}-{last_shown:,} of {results['total']:,} articles "
+                     f"({results['ai_count']} AI-generated, {results['total'] - results['ai_count']} standard)")
+
+            # Title-only listing; a body is loaded only when its article is opened
+            for article in results['articles']:
+                article_id = article.get('article_id')
+                is_open = st.session_state.get("kb_open_article") == article_id
 
-        # Show article counts
-        ai_count = len([a for _, a in filtered_articles.iterrows() if a.get('ai_generated', False)])
-        standard_count = len(filtered_articles) - ai_count
-        st.write(f"Showing {len(filtered_articles):,} articles ({ai_count} AI-generated, {standard_count} standard) of {len(kb_articles):,} total")
-
-        # Display articles
-        if not filtered_articles.empty:
-            for idx, article in filtered_articles.iterrows():
-                # Check if this is an AI-generated article
-                is_ai_generated = article.get('ai_generated', False)
-
-                # Create title with tag and unique key
                 title = article.get('title', 'Untitled Article')
-                article_key = f"{title}_{article.get('_created_at', idx)}"  # Use title + timestamp as unique key
-                if is_ai_generated:
-                    title_display = f"{title} 🤖"
-                else:
-                    title_display = title
-
-                with st.expander(title_display):
-                    if is_ai_generated:
-                        # Display AI-generated article format
-                        st.markdown(f"### {article.get('title', 'Untitled Article')}")
-
-                        if article.get('problem'):
-                            st.write("**Problem Description:**")
-                            st.markdown(article['problem'])
-
-                        if article.get('root_cause'):
-                            st.write("**Root Cause:**")
-                            st.markdown(article['root_cause'])
-
-                        if article.get('solution'):
-                            st.write("**Solution Steps:**")
-                            st.markdown(article['solution'])
-
-                        if article.get('prevention'):
-                            st.write("**Prevention:**")
-                            st.markdown(article['prevention'])
-
-                        if article.get('tags'):
-                            st.write("**Tags:**")
-                            st.code(article['tags'])
-
-                        # Show generation metadata
-                        st.write("---")
-                        st.write("**Generation Info:**")
-                        if article.get('source_incidents'):
-                            st.write(f"Generated from {article['source_incidents']} resolved incidents")
-                        if article.get('_created_at'):
-                            st.write(f"Created: {article['_created_at']}")
-
-                        # Action buttons for AI-generated articles
-                        if data_ingest_manager.is_available():
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                if st.button("✏️ Edit", key=f"edit_ai_{article_key}"):
-                                    st.session_state[f"editing_article_{article_key}"] = True
-                            with col2:
-                                if st.button("🗑️ Delete", key=f"delete_ai_{article_key}"):
-                                    try:
-                                        data_ingest_manager.kb_articles_collection.delete_one({"title": article['title'], "_created_at": article.get('_created_at')})
-                                        st.success("✅ Article deleted! Please refresh the page (F5) to see the updated list.")
-                                    except Exception as e:
-                                        st.error(f"Error deleting article: {str(e)}")
-                    else:
-                        # Display standard article format
-                        col1, col2 = st.columns([2, 1])
-
-                        with col1:
-                            if 'body' in article and pd.notna(article['body']):
-                                st.write("**Content:**")
-                                st.write(article['body'])
-                            else:
-                                st.write("*No content available*")
-
-                        with col2:
-                            st.write("**Details:**")
-                            if 'service_id' in article and pd.notna(article['service_id']):
-                                st.write(f"**Service:** {article['service_id']}")
-                            if 'category_id' in article and pd.notna(article['category_id']):
-                                st.write(f"**Category:** {article['category_id']}")
-                            if 'tags' in article and pd.notna(article['tags']):
-                                st.write(f"**Tags:** {article['tags']}")
-                            if 'publish_state' in article and pd.notna(article['publish_state']):
-                                st.write(f"**Status:** {article['publish_state']}")
-                            if 'owner_group_id' in article and pd.notna(article['owner_group_id']):
-                                st.write(f"**Owner:** {article['owner_group_id']}")
-
-                        # Action buttons for standard articles
-                        if data_ingest_manager.is_available():
-                            st.write("---")
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                if st.button("✏️ Edit", key=f"edit_std_{article_key}"):
-                                    st.session_state[f"editing_article_{article_key}"] = True
-                            with col2:
-                                if st.button("🗑️ Delete", key=f"delete_std_{article_key}"):
-                                    try:
-                                        # For standard articles, use a different identifier
-                                        delete_filter = {"title": article['title']}
-                                        if 'service_id' in article and pd.notna(article['service_id']):
-                                            delete_filter['service_id'] = article['service_id']
-                                        data_ingest_manager.kb_articles_collection.delete_one(delete_filter)
-                                        st.success("✅ Article deleted! Please refresh the page (F5) to see the updated list.")
-                                    except Exception as e:
-                                        st.error(f"Error deleting article: {str(e)}")
-
-                # Show edit form if editing this article
-                if st.session_state.get(f"editing_article_{article_key}", False):
-                    st.write("---")
-                    st.write("**Edit Article:**")
-
-                    with st.form(f"edit_form_{article_key}"):
-                        # Pre-populate form with existing data
-                        edit_title = st.text_input("Title", value=article.get('title', ''))
-
-                        if is_ai_generated:
-                            # Edit structured fields
-                            edit_problem = st.text_area("Problem Description", value=article.get('problem', ''), height=100)
-                            edit_root_cause = st.text_area("Root Cause", value=article.get('root_cause', ''), height=100)
-                            edit_solution = st.text_area("Solution Steps", value=article.get('solution', ''), height=150)
-                            edit_prevention = st.text_area("Prevention", value=article.get('prevention', ''), height=100)
-                            edit_tags = st.text_input("Tags", value=article.get('tags', ''))
-                        else:
-                            # Edit standard fields
-                            edit_body = st.text_area("Content", value=article.get('body', ''), height=200)
-                            edit_category = st.text_input("Category ID", value=article.get('category_id', ''))
-                            edit_service = st.text_input("Service ID", value=article.get('service_id', ''))
-                            edit_tags = st.text_input("Tags", value=article.get('tags', ''))
-                            edit_status = st.selectbox("Status", ["Draft", "Published", "Archived"],
-                                                     index=["Draft", "Published", "Archived"].index(article.get('publish_state', 'Draft')) if article.get('publish_state') in ["Draft", "Published", "Archived"] else 0)
-
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            save_clicked = st.form_submit_button("💾 Save Changes", type="primary")
-                        with col2:
-                            cancel_clicked = st.form_submit_button("❌ Cancel")
-
-                        if save_clicked:
-                            if not edit_title.strip():
-                                st.error("Title is required")
-                            else:
-                                try:
-                                    # Prepare update data
-                                    update_data = {
-                                        'title': edit_title.strip(),
-                                        '_updated_at': pd.Timestamp.now().isoformat()
-                                    }
-
-                                    if is_ai_generated:
-                                        update_data.update({
-                                            'problem': edit_problem.strip(),
-                                            'root_cause': edit_root_cause.strip(),
-                                            'solution': edit_solution.strip(),
-                                            'prevention': edit_prevention.strip(),
-                                            'tags': edit_tags.strip()
-                                        })
-                                    else:
-                                        update_data.update({
-                                            'body': edit_body.strip(),
-                                            'category_id': edit_category.strip(),
-                                            'service_id': edit_service.strip(),
-                                            'tags': edit_tags.strip(),
-                                            'publish_state': edit_status
-                                        })
-
-                                    # Update in MongoDB
-                                    filter_criteria = {"title": article['title']}
-                                    if '_created_at' in article:
-                                        filter_criteria['_created_at'] = article['_created_at']
-
-                                    result = data_ingest_manager.kb_articles_collection.update_one(
-                                        filter_criteria,
-                                        {"$set": update_data}
-                                    )
-
-                                    if result.modified_count > 0:
-                                        st.success("✅ Article updated successfully!")
-                                        st.session_state[f"editing_article_{article_key}"] = False
-                                    else:
-                                        st.error("No changes were made or article not found")
-
-                                except Exception as e:
-                                    st.error(f"Error updating article: {str(e)}")
-
-                        if cancel_clicked:
-                            st.session_state[f"editing_article_{article_key}"] = False
-        else:
+                title_display = f"{title} 🤖" if article.get('ai_generated', False) else title
+                details = [str(article[field]) for field in ('service_id', 'category_id', 'publish_state') if article.get(field)]
+
+                row_col, open_col = st.columns([6, 1])
+                with row_col:
+                    st.write(f"**{title_display}**")
+                    if details:
+                        st.caption(" | ".join(details))
+                with open_col:
+                    if st.button("Close" if is_open else "Open", key=f"open_{article_id or id(article)}",
+                                 use_container_width=True, disabled=not article_id):
+                        st.session_state.kb_open_article = None if is_open else article_id
+                        st.rerun()
+
+                if is_open:
+                    with st.container(border=True):
+                        render_article(article_id)
+
+            # Pagination
+            if results['pages'] > 1:
+                prev_col, page_col, next_col = st.columns([1, 2, 1])
+                with prev_col:
+                    if st.button("⬅️ Previous", disabled=results['page'] <= 1, use_container_width=True):
+                        st.session_state.articles_page = results['page'] - 1
+                        st.rerun()
+                with page_col:
+                    st.write(f"Page {results['page']} of {results['pages']}")
+                with next_col:
+                    if st.button("Next ➡️", disabled=results['page'] >= results['pages'], use_container_width=True):
+                        st.session_state.articles_page = results['page'] + 1
+                        st.rerun()
+        elif any(value not in ('', 'All') for value in query_signature):
             st.info("No articles match the selected filters")
+        else:
+            st.info("No knowledge base articles available")
     else:
         st.info("No knowledge base articles available")
 
@@ -339,14 +331,13 @@ with tab2:
                     try:
                         # Add timestamp
                         from datetime import datetime
-                        new_article['_created_at'] = datetime.now().isoformat()
-                        new_article['_updated_at'] = datetime.now().isoformat()
+                        new_article['_updated_at'] = datetime.utcnow()
 
-                        # Insert into MongoDB
-                        result = data_ingest_manager.kb_articles_collection.insert_one(new_article)
+                        # Insert into MongoDB with a newly allocated article id
+                        article_id = kb_service.create_article(new_article)
 
-                        if result.inserted_id:
-                            st.success(f"✅ Article '{title}' created successfully!")
+                        if article_id:
+                            st.success(f"✅ Article '{title}' created successfully as {article_id}!")
                             st.info("💡 Switch to the Browse Articles tab to see your new article")
                         else:
                             st.error("Failed to create article")
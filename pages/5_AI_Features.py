@@ -7,9 +7,20 @@ import logging
 # Add the parent directory to the path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.data_service import data_service
-from utils.bedrock_client import bedrock_client, refresh_bedrock_client
+from utils.bedrock_client import (bedrock_client, refresh_bedrock_client, ASSIGNMENT_PROMPT_TEMPLATE,
+                                  assignment_prompt_fingerprint, parse_assignment_response)
 from utils.settings_manager import settings_manager
 from utils.data_ingest import data_ingest_manager
+from utils.triage_model import local_triage_model, triage_cascade, incident_label, in_holdout
+from utils.triage_evaluation import triage_evaluator
+from utils.incident_clustering import incident_clusterer
+from utils.kb_service import kb_service
+from utils.assignment_engine import assignment_engine, required_skills, ASSIGNMENT_CANDIDATES
+from utils.metrics_service import metrics_service
+from utils.background_jobs import background_job_manager
+from utils.bulk_kb_generation import BULK_KB_JOB, start_bulk_kb_generation
+from utils.kb_generation import (kb_coverage_checker, kb_article_updater, build_generation_prompt,
+                                 parse_article_response, cluster_signature, ARTICLE_SECTIONS)
 
 st.set_page_config(page_title="AI Features", page_icon="🤖", layout="wide")
 st.title("AI-Powered ITSM Features")
@@ -181,6 +192,41 @@ if st.sidebar.checkbox("🔍 Show Debug Info"):
         st.sidebar.write(f"- `{model_id}`")
         st.sidebar.write(f"  {name}")
 
+@st.fragment(run_every=3)
+def show_bulk_kb_progress():
+    """Poll the background KB generation job without rerunning the whole page"""
+    job = background_job_manager.get_active_job(BULK_KB_JOB)
+    if not job:
+        recent_jobs = background_job_manager.get_recent_jobs(BULK_KB_JOB, limit=1)
+        job = recent_jobs[0] if recent_jobs else None
+    if not job:
+        return
+
+    total = max(job.get('total', 0), 1)
+    processed = job.get('processed', 0)
+    cost = job.get('cost', {})
+    st.progress(min(processed / total, 1.0),
+                text=f"Job {job['_id']}: {job['status']} - {processed:,}/{job.get('total', 0):,} clusters")
+    st.caption(f"✅ {job.get('succeeded', 0):,} drafts | ⏭️ {job.get('skipped', 0):,} already covered | "
+               f"❌ {job.get('failed', 0):,} failed | {cost.get('requests', 0):,} requests | "
+               f"{cost.get('input_tokens', 0):,} in / {cost.get('output_tokens', 0):,} out tokens")
+    if job.get('error'):
+        st.error(f"Job error: {job['error']}")
+    if job.get('clusters'):
+        cluster_rows = [{
+            "Cluster": cluster_id,
+            "Label": outcome.get('label', ''),
+            "Status": outcome.get('status', ''),
+            "Article": outcome.get('article_id', ''),
+            "Input Tokens": outcome.get('cost', {}).get('input_tokens', 0),
+            "Output Tokens": outcome.get('cost', {}).get('output_tokens', 0)
+        } for cluster_id, outcome in job['clusters'].items()]
+        st.dataframe(pd.DataFrame(cluster_rows), use_container_width=True, hide_index=True, height=200)
+    if job['status'] in ('queued', 'running'):
+        if st.button("⏹️ Cancel KB Generation", key="cancel_bulk_kb"):
+            background_job_manager.request_cancel(job['_id'])
+
+
 # Create tabs for different AI features
 tab1, tab2, tab3, tab4 = st.tabs(["🎯 UC-02: Incident Triage", "📚 UC-21: KB Generation", "👥 UC-31: Agent Matching", "⚙️ Admin & Testing"])
 
@@ -241,44 +287,14 @@ with tab1:
             if incident_title and incident_description:
                 with st.spinner(f"AI is analyzing the incident using {selected_model_name}..."):
                     # Use global model settings and system prompt
-                    prompt = f"""Analyze this incident and determine its priority level.
-
-                    Incident Title: {incident_title}
-                    Incident Description: {incident_description}
-
-                    Priority Levels:
-                    - P1: Critical - System down, major business impact
-                    - P2: High - Significant impact, workaround available
-                    - P3: Medium - Moderate impact, standard response
-                    - P4: Low - Minor impact, can be scheduled
-
-                    Respond with:
-                    Priority: [P1/P2/P3/P4]
-                    Reasoning: [Brief explanation]
-                    """
-
-                    response = bedrock_client.invoke_model(
-                        prompt,
-                        selected_model_id,
-                        min(max_tokens, 300),
-                        temperature,
-                        system_prompt=settings_manager.get_setting("system_prompts.incident_triage")
+                    results = bedrock_client.classify_incidents_batch(
+                        [{"incident_id": "TEST", "title": incident_title, "description": incident_description}],
+                        model_id=selected_model_id,
+                        system_prompt=settings_manager.get_setting("system_prompts.incident_triage"),
+                        temperature=temperature,
+                        max_output_tokens=min(max_tokens, 300)
                     )
-
-                    if response:
-                        lines = response.split('\n')
-                        priority = "P3"  # Default
-                        reasoning = "Unable to determine"
-
-                        for line in lines:
-                            if line.startswith('Priority:'):
-                                priority = line.split(':')[1].strip()
-                            elif line.startswith('Reasoning:'):
-                                reasoning = line.split(':', 1)[1].strip()
-
-                        result = {"priority": priority, "reasoning": reasoning}
-                    else:
-                        result = {"priority": "P3", "reasoning": "AI classification failed"}
+                    result = results.get("TEST", {"priority": "P3", "reasoning": "AI classification failed"})
 
                 st.success(f"**Predicted Priority: {result['priority']}**")
                 st.write(f"**Reasoning:** {result['reasoning']}")
@@ -288,70 +304,195 @@ with tab1:
     with col2:
         st.write("**Historical Incident Analysis:**")
         
-        incidents = data_service.get_incidents()
-        if not incidents.empty:
-            # Show priority distribution
-            if 'true_priority' in incidents.columns:
-                priority_counts = incidents['true_priority'].value_counts()
-                st.write("**Current Priority Distribution:**")
-                for priority, count in priority_counts.items():
-                    st.write(f"- {priority}: {count} incidents")
+        # Show priority distribution (aggregated in MongoDB)
+        priority_counts = metrics_service.get_incident_kpis()['by_priority']
+        if priority_counts:
+            st.write("**Current Priority Distribution:**")
+            for priority, count in priority_counts.items():
+                st.write(f"- {priority}: {count} incidents")
+
+        if priority_counts:
             
             # Sample incidents for batch processing
             st.write("**Batch Processing Demo:**")
+            sample_size = st.number_input("Sample size", min_value=1, max_value=200, value=10, key="triage_sample_size")
             if st.button("🔄 Analyze Random Sample"):
-                sample_incidents = incidents.sample(min(3, len(incidents)))
-                
-                for idx, incident in sample_incidents.iterrows():
-                    title = incident.get('short_description', 'No title')
-                    desc = incident.get('description', 'No description')
-                    actual_priority = incident.get('true_priority', 'Unknown')
-                    
-                    with st.spinner(f"Analyzing: {title[:30]}..."):
-                        prompt = f"""Analyze this incident and determine its priority level.
-
-                        Incident Title: {title}
-                        Incident Description: {desc}
-
-                        Priority Levels:
-                        - P1: Critical - System down, major business impact
-                        - P2: High - Significant impact, workaround available
-                        - P3: Medium - Moderate impact, standard response
-                        - P4: Low - Minor impact, can be scheduled
-
-                        Respond with:
-                        Priority: [P1/P2/P3/P4]
-                        Reasoning: [Brief explanation]
-                        """
-
-                        response = bedrock_client.invoke_model(
-                            prompt,
-                            selected_model_id,
-                            min(max_tokens, 200),
-                            temperature,
-                            system_prompt=settings_manager.get_setting("system_prompts.incident_triage")
-                        )
+                sample_incidents = data_service.sample_incidents(int(sample_size))
+
+                with st.spinner(f"Classifying {len(sample_incidents)} incidents in batched requests..."):
+                    results, usage = bedrock_client.classify_incidents_batch_with_usage(
+                        sample_incidents.to_dict('records'),
+                        model_id=selected_model_id,
+                        system_prompt=settings_manager.get_setting("system_prompts.incident_triage"),
+                        temperature=temperature
+                    )
 
-                        if response:
-                            lines = response.split('\n')
-                            priority = "P3"
-                            reasoning = "Unable to determine"
+                st.caption(f"{len(results)} incidents classified in {usage['requests']} request(s) | "
+                           f"{usage['input_tokens']:,} input / {usage['output_tokens']:,} output tokens")
 
-                            for line in lines:
-                                if line.startswith('Priority:'):
-                                    priority = line.split(':')[1].strip()
-                                elif line.startswith('Reasoning:'):
-                                    reasoning = line.split(':', 1)[1].strip()
+                for idx, incident in sample_incidents.iterrows():
+                    title = incident.get('title', 'No title')
+                    actual_priority = incident_label(incident) or 'Unknown'
+                    result = results.get(str(incident.get('incident_id')), {"priority": "P3", "reasoning": "AI classification failed"})
 
-                            result = {"priority": priority, "reasoning": reasoning}
-                        else:
-                            result = {"priority": "P3", "reasoning": "AI classification failed"}
-                    
                     st.write(f"**{title[:50]}...**")
                     st.write(f"- AI Predicted: {result['priority']} | Actual: {actual_priority}")
                     st.write(f"- Reasoning: {result['reasoning']}")
                     st.write("---")
 
+    st.divider()
+    st.subheader("🧠 Local Triage Model + LLM Fallback")
+    st.write("A locally trained classifier handles confident predictions; only low-confidence incidents are escalated to Bedrock.")
+
+    model_col, cascade_col = st.columns([1, 1])
+
+    with model_col:
+        st.write("**Local Model:**")
+        if local_triage_model.is_trained():
+            model_info = local_triage_model.metadata
+            st.write(f"- Trained: {model_info.get('trained_at', 'Unknown')}")
+            st.write(f"- Training samples: {model_info.get('training_samples', 0):,}")
+            st.write(f"- Holdout accuracy: {model_info.get('holdout_accuracy', 0):.1%}")
+        else:
+            st.info("No local model trained yet")
+
+        if st.button("🏋️ Retrain from Resolved Incidents", key="retrain_local_triage"):
+            with st.spinner("Training local triage model..."):
+                training_result = local_triage_model.train_from_mongodb()
+            if training_result.get("success"):
+                st.success(f"✅ Trained on {training_result['training_samples']:,} incidents "
+                           f"(holdout accuracy {training_result['holdout_accuracy']:.1%})")
+            else:
+                st.error(f"❌ Training failed: {training_result.get('error', 'Unknown error')}")
+
+    with cascade_col:
+        st.write("**Cascade:**")
+        cascade_threshold = st.slider("Local confidence threshold", 0.0, 1.0,
+                                      triage_cascade.confidence_threshold, 0.05, key="cascade_threshold")
+        cascade_sample_size = st.number_input("Held-out incidents to classify", min_value=1, max_value=500,
+                                              value=50, key="cascade_sample_size",
+                                              help="Sampled from the labelled incidents the local model never trains on")
+
+        if st.button("⚡ Run Cascade on Held-out Sample", key="run_cascade"):
+            # Only held-out incidents, so the per-path accuracy below is never training accuracy
+            incidents = data_service.get_shared_incidents()
+            resolved = incidents[incidents.apply(lambda row: incident_label(row) is not None and in_holdout(row), axis=1)] \
+                if not incidents.empty else incidents
+            if resolved.empty:
+                st.warning("No held-out incidents with a priority label")
+            else:
+                cascade_sample = resolved.sample(min(int(cascade_sample_size), len(resolved)))
+                with st.spinner(f"Classifying {len(cascade_sample)} incidents..."):
+                    cascade_results = triage_cascade.classify(
+                        cascade_sample.to_dict('records'),
+                        model_id=selected_model_id,
+                        system_prompt=settings_manager.get_setting("system_prompts.incident_triage"),
+                        temperature=temperature,
+                        confidence_threshold=cascade_threshold
+                    )
+                local_count = sum(1 for r in cascade_results.values() if r["source"] == "local")
+                st.success(f"✅ {local_count} resolved locally, {len(cascade_results) - local_count} escalated to the LLM")
+
+    st.write("**Cumulative Cascade Statistics:**")
+    cascade_stats = triage_cascade.get_stats()
+    stat_cols = st.columns(2)
+    for stat_col, (source, label) in zip(stat_cols, [("local", "Local model"), ("llm", "LLM (Bedrock)")]):
+        path_stats = cascade_stats[source]
+        with stat_col:
+            st.metric(f"{label} share", f"{path_stats['share']:.0%}", help=f"{path_stats['count']:,} incidents")
+            accuracy = path_stats['accuracy']
+            st.metric(f"{label} accuracy", f"{accuracy:.1%}" if accuracy is not None else "N/A",
+                      help=f"Measured on {path_stats['labelled']:,} held-out incidents with a known priority")
+
+    st.divider()
+    st.subheader("📏 Triage Evaluation")
+    st.write("Score the selected model and triage prompt against the known priority of a stratified sample of resolved incidents.")
+
+    eval_cols = st.columns(4)
+    with eval_cols[0]:
+        eval_sample_size = st.number_input("Sample size", min_value=10, max_value=2000, value=100, step=10, key="eval_sample_size")
+    with eval_cols[1]:
+        eval_chunk_size = st.number_input("Incidents per request", min_value=1, max_value=50, value=10, key="eval_chunk_size")
+    with eval_cols[2]:
+        eval_concurrency = st.number_input("Parallel requests", min_value=1, max_value=16, value=4, key="eval_concurrency")
+    with eval_cols[3]:
+        eval_label = st.text_input("Run label", value="", key="eval_label", placeholder="e.g. new rubric")
+
+    if st.button("▶️ Run Evaluation", key="run_triage_evaluation"):
+        eval_progress = st.progress(0.0, text="Sampling resolved incidents...")
+        evaluation = triage_evaluator.run(
+            int(eval_sample_size),
+            model_id=selected_model_id,
+            system_prompt=settings_manager.get_setting("system_prompts.incident_triage"),
+            temperature=temperature,
+            chunk_size=int(eval_chunk_size),
+            concurrency=int(eval_concurrency),
+            label=eval_label,
+            progress_callback=lambda done, total: eval_progress.progress(done / total, text=f"Classified {done}/{total} incidents")
+        )
+        eval_progress.empty()
+
+        if evaluation.get("success"):
+            metric_cols = st.columns(5)
+            metric_cols[0].metric("Accuracy", f"{evaluation['accuracy']:.1%}", help=f"{evaluation['scored']} scored, {evaluation['failed']} failed")
+            metric_cols[1].metric("p50 / p95 latency", f"{evaluation['latency_ms']['p50']:.0f} / {evaluation['latency_ms']['p95']:.0f} ms")
+            metric_cols[2].metric("Tokens / incident", f"{evaluation['tokens_per_incident']:.0f}")
+            metric_cols[3].metric("Incidents / minute", f"{evaluation['incidents_per_minute']:.0f}")
+            metric_cols[4].metric("Macro recall", f"{evaluation['macro_recall']:.1%}")
+
+            matrix_col, class_col = st.columns(2)
+            with matrix_col:
+                st.write("**Confusion Matrix** (rows = actual, columns = predicted):")
+                st.dataframe(pd.DataFrame(evaluation['confusion_matrix'], index=evaluation['labels'], columns=evaluation['labels']),
+                             use_container_width=True)
+            with class_col:
+                st.write("**Per-Class Metrics:**")
+                st.dataframe(pd.DataFrame(evaluation['per_class']).T.style.format(
+                    {"precision": "{:.1%}", "recall": "{:.1%}", "f1": "{:.2f}", "support": "{:.0f}"}),
+                    use_container_width=True)
+        else:
+            st.error(f"❌ Evaluation failed: {evaluation.get('error', 'Unknown error')}")
+
+    evaluation_runs = triage_evaluator.get_runs()
+    if evaluation_runs:
+        st.write("**Run History:**")
+        runs_df = pd.DataFrame([{
+            "Run": run["_id"],
+            "Label": run.get("label", ""),
+            "Created": run["created_at"].strftime('%Y-%m-%d %H:%M'),
+            "Model": available_models.get(run["model_id"], run["model_id"]),
+            "Prompt": run["prompt_hash"],
+            "Batch": run["chunk_size"],
+            "Sample": run["sample_size"],
+            "Accuracy": run["accuracy"],
+            "Macro Recall": run["macro_recall"],
+            **{f"{priority} Recall": run["per_class"][priority]["recall"] for priority in run["labels"]},
+            "p50 ms": run["latency_ms"]["p50"],
+            "p95 ms": run["latency_ms"]["p95"],
+            "Tokens/Incident": run["tokens_per_incident"],
+            "Incidents/Min": run["incidents_per_minute"]
+        } for run in evaluation_runs])
+        percent_columns = [column for column in runs_df.columns if "Recall" in column or column == "Accuracy"]
+        st.dataframe(runs_df.style.format({**{column: "{:.1%}" for column in percent_columns},
+                                           "p50 ms": "{:.0f}", "p95 ms": "{:.0f}",
+                                           "Tokens/Incident": "{:.0f}", "Incidents/Min": "{:.0f}"}),
+                     use_container_width=True, hide_index=True)
+
+        compare_ids = st.multiselect("Compare runs side by side", runs_df["Run"].tolist(),
+                                     default=runs_df["Run"].tolist()[:2], key="compare_evaluation_runs")
+        if compare_ids:
+            compare_cols = st.columns(len(compare_ids))
+            for compare_col, run_id in zip(compare_cols, compare_ids):
+                run = next(run for run in evaluation_runs if run["_id"] == run_id)
+                with compare_col:
+                    st.write(f"**{run.get('label') or run_id}**")
+                    st.caption(f"{available_models.get(run['model_id'], run['model_id'])} | prompt {run['prompt_hash']} | temp {run['temperature']}")
+                    st.dataframe(pd.DataFrame(run['confusion_matrix'], index=run['labels'], columns=run['labels']),
+                                 use_container_width=True)
+                    if st.button("🗑️ Delete Run", key=f"delete_eval_{run_id}"):
+                        triage_evaluator.delete_run(run_id)
+                        st.rerun()
+
 with tab2:
     st.subheader("📚 UC-21: AI-Generated Knowledge Base Articles")
     st.write("Generate KB articles from clusters of similar resolved incidents.")
@@ -393,44 +534,109 @@ with tab2:
             col1, col2 = st.columns([1, 1])
             
             with col1:
-                st.write("**Filter Resolved Tickets for KB Generation:**")
+                st.write("**Incident Clusters:**")
+                cluster_state = incident_clusterer.get_state()
+                unclustered_count = incident_clusterer.count_unclustered()
+
+                with st.expander("⚙️ Clustering", expanded=not incident_clusterer.is_fitted()):
+                    if incident_clusterer.is_fitted():
+                        st.write(f"- {cluster_state.get('n_clusters', 0)} clusters over {cluster_state.get('incidents_clustered', 0):,} resolved incidents")
+                        st.write(f"- Last updated: {cluster_state.get('last_update_at', 'Unknown')}")
+                        st.write(f"- {unclustered_count:,} new resolutions not yet clustered")
+                    else:
+                        st.info("Resolved incidents have not been clustered yet")
+
+                    n_clusters = st.number_input("Number of clusters", min_value=2, max_value=500,
+                                                 value=int(cluster_state.get('n_clusters', 50)), key="kb_n_clusters")
+                    recluster_col, update_col = st.columns(2)
+                    with recluster_col:
+                        if st.button("🔄 Re-cluster All", key="recluster_incidents"):
+                            with st.spinner("Clustering resolved incidents..."):
+                                clustering_result = incident_clusterer.fit(n_clusters=int(n_clusters))
+                            if clustering_result.get("success"):
+                                st.success(f"✅ {clustering_result['incidents_clustered']:,} incidents in {clustering_result['n_clusters']} clusters")
+                                st.rerun()
+                            else:
+                                st.error(f"❌ Clustering failed: {clustering_result.get('error', 'Unknown error')}")
+                    with update_col:
+                        if st.button(f"➕ Add {unclustered_count:,} New", key="update_incident_clusters",
+                                     disabled=not incident_clusterer.is_fitted() or unclustered_count == 0):
+                            with st.spinner("Adding new resolutions to clusters..."):
+                                incident_clusterer.update_incremental()
+                            st.rerun()
+
+                with st.expander("🌙 Generate Drafts for All Clusters",
+                                 expanded=bool(background_job_manager.get_active_job(BULK_KB_JOB))):
+                    st.write("Generates a **Draft** article in the background for every cluster that no existing "
+                             "article covers yet. Safe to leave running overnight; an interrupted run resumes where it stopped.")
+                    bulk_min_size = st.number_input("Minimum cluster size", min_value=1, max_value=1000, value=3,
+                                                    key="bulk_kb_min_size")
+                    if st.button("🚀 Generate Missing Articles", key="start_bulk_kb",
+                                 disabled=not incident_clusterer.is_fitted() or not bedrock_client.is_available()):
+                        start_bulk_kb_generation(
+                            selected_model_id,
+                            settings_manager.get_setting("system_prompts.kb_generation"),
+                            max_tokens=min(max_tokens, 1500),
+                            temperature=temperature,
+                            min_cluster_size=int(bulk_min_size)
+                        )
+                    show_bulk_kb_progress()
+
+                incident_clusters = incident_clusterer.get_clusters()
+                cluster_labels = {cluster['_id']: f"#{cluster['_id']}: {cluster.get('label', '')} ({cluster.get('size', 0)} incidents)"
+                                  for cluster in incident_clusters}
+                selected_kb_cluster = st.selectbox(
+                    "Generate from cluster:",
+                    [None] + list(cluster_labels.keys()),
+                    format_func=lambda cluster_id: "Manual filters" if cluster_id is None else cluster_labels[cluster_id],
+                    help="Automatic clusters of similar resolved incidents; the most central incidents are used"
+                )
+
+                if selected_kb_cluster is not None:
+                    # Most central incidents first, so head(10) below picks the best examples
+                    resolved_incidents = pd.DataFrame(incident_clusterer.get_central_incidents(selected_kb_cluster, limit=10))
+                    selected_priority = 'All'
+                    selected_category = 'All'
+                    selected_cluster = cluster_labels[selected_kb_cluster]
+                else:
+                    st.write("**Filter Resolved Tickets for KB Generation:**")
                 
-                # Filter options
-                filter_col1, filter_col2 = st.columns([1, 1])
+                    # Filter options
+                    filter_col1, filter_col2 = st.columns([1, 1])
                 
-                with filter_col1:
-                    # Priority filter - handle both MongoDB and CSV column names
-                    priority_col = 'priority' if 'priority' in resolved_incidents.columns else 'true_priority'
-                    if priority_col in resolved_incidents.columns:
-                        priorities = ['All'] + sorted(resolved_incidents[priority_col].dropna().unique().tolist())
-                        selected_priority = st.selectbox("Filter by Priority:", priorities)
+                    with filter_col1:
+                        # Priority filter
+                        priority_col = 'priority'
+                        if priority_col in resolved_incidents.columns:
+                            priorities = ['All'] + sorted(resolved_incidents[priority_col].dropna().unique().tolist())
+                            selected_priority = st.selectbox("Filter by Priority:", priorities)
                         
-                        if selected_priority != 'All':
-                            resolved_incidents = resolved_incidents[resolved_incidents[priority_col] == selected_priority]
-                    else:
-                        selected_priority = 'All'
+                            if selected_priority != 'All':
+                                resolved_incidents = resolved_incidents[resolved_incidents[priority_col] == selected_priority]
+                        else:
+                            selected_priority = 'All'
                 
-                with filter_col2:
-                    # Category filter - handle both MongoDB and CSV column names
-                    category_col = 'category' if 'category' in resolved_incidents.columns else 'category_id'
-                    if category_col in resolved_incidents.columns:
-                        categories = ['All'] + sorted(resolved_incidents[category_col].dropna().unique().tolist())
-                        selected_category = st.selectbox("Filter by Category:", categories)
+                    with filter_col2:
+                        # Category filter
+                        category_col = 'category'
+                        if category_col in resolved_incidents.columns:
+                            categories = ['All'] + sorted(resolved_incidents[category_col].dropna().unique().tolist())
+                            selected_category = st.selectbox("Filter by Category:", categories)
                         
-                        if selected_category != 'All':
-                            resolved_incidents = resolved_incidents[resolved_incidents[category_col] == selected_category]
-                    else:
-                        selected_category = 'All'
+                            if selected_category != 'All':
+                                resolved_incidents = resolved_incidents[resolved_incidents[category_col] == selected_category]
+                        else:
+                            selected_category = 'All'
                 
-                # Ground truth cluster filter (for similar incidents) - only available in CSV data
-                if 'ground_truth_cluster' in resolved_incidents.columns:
-                    clusters = ['All'] + sorted(resolved_incidents['ground_truth_cluster'].dropna().unique().tolist())
-                    selected_cluster = st.selectbox("Filter by Issue Type:", clusters, help="Groups similar incidents together")
+                    # Ground truth cluster filter (for similar incidents) - only available in CSV data
+                    if 'ground_truth_cluster' in resolved_incidents.columns:
+                        clusters = ['All'] + sorted(resolved_incidents['ground_truth_cluster'].dropna().unique().tolist())
+                        selected_cluster = st.selectbox("Filter by Issue Type:", clusters, help="Groups similar incidents together")
                     
-                    if selected_cluster != 'All':
-                        resolved_incidents = resolved_incidents[resolved_incidents['ground_truth_cluster'] == selected_cluster]
-                else:
-                    selected_cluster = 'All'
+                        if selected_cluster != 'All':
+                            resolved_incidents = resolved_incidents[resolved_incidents['ground_truth_cluster'] == selected_cluster]
+                    else:
+                        selected_cluster = 'All'
                 
                 st.write(f"**Filtered Results: {len(resolved_incidents)} incidents**")
                 
@@ -439,8 +645,8 @@ with tab2:
                     st.write("**Sample incidents to include:**")
                     sample_incidents = resolved_incidents.head(5)
                     for idx, incident in sample_incidents.iterrows():
-                        st.write(f"- **{incident.get('short_description', 'No description')}**")
-                        priority = incident.get('priority', incident.get('true_priority', 'Unknown'))
+                        st.write(f"- **{incident.get('title', 'No description')}**")
+                        priority = incident.get('priority', 'Unknown')
                         st.write(f"  Priority: {priority} | Resolution: {incident.get('resolution_notes', 'No notes')[:50]}...")
                     
                     if len(resolved_incidents) > 5:
@@ -448,92 +654,87 @@ with tab2:
                     
                     if st.button("📝 Generate KB Article from Filtered Tickets", type="primary"):
                         # Use all filtered incidents, limit to 10 for token efficiency
-                        incident_cluster = resolved_incidents.head(10).to_dict('records')
-                        
-                        with st.spinner(f"AI is analyzing {len(incident_cluster)} resolved tickets using {selected_model_name}..."):
-                            # Prepare detailed incident summaries with resolutions
-                            incident_summaries = []
-                            for i, incident in enumerate(incident_cluster, 1):
-                                summary = f"{i}. **Issue:** {incident.get('short_description', 'No description')}"
-                                if incident.get('description'):
-                                    summary += f"\n   **Details:** {incident.get('description', '')[:100]}..."
-                                if incident.get('resolution_notes'):
-                                    summary += f"\n   **Resolution:** {incident.get('resolution_notes', '')}"
-                                if incident.get('time_to_resolve_mins'):
-                                    summary += f"\n   **Resolution Time:** {incident.get('time_to_resolve_mins')} minutes"
-                                incident_summaries.append(summary)
-
-                            incidents_text = '\n\n'.join(incident_summaries)
-
-                            prompt = f"""Analyze these {len(incident_cluster)} resolved IT support tickets and create a comprehensive knowledge base article.
-
-                            RESOLVED TICKETS:
-                            {incidents_text}
-
-                            Based on the common patterns in these resolved tickets, create a knowledge base article that would help users and support agents resolve similar issues quickly.
-
-                            Requirements:
-                            1. **Title**: Create a clear, searchable title that covers the main issue
-                            2. **Problem Description**: Describe what users typically experience
-                            3. **Root Cause**: Explain why this issue occurs
-                            4. **Solution Steps**: Provide step-by-step resolution instructions
-                            5. **Prevention**: Suggest how to prevent this issue
-                            6. **Tags**: List relevant keywords for searchability
-
-                            Format your response exactly as:
-                            Title: [Clear, specific title]
-                            Problem: [What users experience]
-                            Root Cause: [Why this happens]
-                            Solution: [Step-by-step instructions]
-                            Prevention: [How to avoid this issue]
-                            Tags: [comma-separated keywords]
-                            """
+                        pending_cluster = resolved_incidents.head(10).to_dict('records')
+                        st.session_state.kb_pending_cluster = pending_cluster
+                        st.session_state.kb_pending_source = {
+                            "selected_priority": selected_priority,
+                            "selected_category": selected_category,
+                            "selected_cluster": selected_cluster,
+                            "cluster_id": selected_kb_cluster
+                        }
+                        # Look for an article that already documents these incidents before spending tokens
+                        st.session_state.kb_coverage = kb_coverage_checker.find_existing_coverage(pending_cluster)
+
+                    pending_cluster = st.session_state.get('kb_pending_cluster')
+                    generate_now = False
+                    if pending_cluster:
+                        coverage = st.session_state.get('kb_coverage', [])
+                        if coverage:
+                            st.warning("⚠️ These incidents already look documented by existing articles:")
+                            for match in coverage:
+                                match_col, reuse_col, update_col = st.columns([3, 1, 1])
+                                with match_col:
+                                    st.write(f"**{match['article_id']}** {match['title']}")
+                                    st.caption(match['reason'])
+                                with reuse_col:
+                                    if st.button("♻️ Reuse", key=f"reuse_kb_{match['article_id']}"):
+                                        existing_article = kb_service.get_article(match['article_id'])
+                                        if existing_article:
+                                            st.session_state.generated_article = {section: existing_article.get(section) or ''
+                                                                                  for section in ARTICLE_SECTIONS}
+                                            st.session_state.saved_article_id = match['article_id']
+                                            st.session_state.incident_cluster = pending_cluster
+                                            for key, value in st.session_state.kb_pending_source.items():
+                                                st.session_state[key] = value
+                                            st.session_state.kb_pending_cluster = None
+                                            st.rerun()
+                                with update_col:
+                                    if st.button("🔄 Update", key=f"update_kb_{match['article_id']}",
+                                                 help="Revise this article with any of these incidents it doesn't include yet"):
+                                        with st.spinner(f"Updating {match['article_id']} using {selected_model_name}..."):
+                                            update_result = kb_article_updater.update_article(
+                                                match['article_id'], selected_model_id, min(max_tokens, 1500), temperature,
+                                                system_prompt=settings_manager.get_setting("system_prompts.kb_generation"),
+                                                incidents=pending_cluster
+                                            )
+                                        if update_result.get("success"):
+                                            updated_article = kb_service.get_article(match['article_id'])
+                                            st.session_state.generated_article = {section: updated_article.get(section) or ''
+                                                                                  for section in ARTICLE_SECTIONS}
+                                            st.session_state.saved_article_id = match['article_id']
+                                            st.session_state.incident_cluster = pending_cluster
+                                            for key, value in st.session_state.kb_pending_source.items():
+                                                st.session_state[key] = value
+                                            st.session_state.kb_pending_cluster = None
+                                            st.rerun()
+                                        else:
+                                            st.error(f"❌ {update_result.get('error', 'Update failed')}")
+                            if st.button("📝 Generate a New Article Anyway", key="kb_generate_anyway"):
+                                generate_now = True
+                        else:
+                            generate_now = True
+
+                    if generate_now:
+                        incident_cluster = pending_cluster
 
+                        with st.spinner(f"AI is analyzing {len(incident_cluster)} resolved tickets using {selected_model_name}..."):
                             response = bedrock_client.invoke_model(
-                                prompt,
+                                build_generation_prompt(incident_cluster),
                                 selected_model_id,
                                 min(max_tokens, 1500),
                                 temperature,
                                 system_prompt=settings_manager.get_setting("system_prompts.kb_generation")
                             )
+                            article = parse_article_response(response)
 
-                            if response:
-                                sections = {"title": "", "problem": "", "root_cause": "", "solution": "", "prevention": "", "tags": ""}
-                                current_section = None
-
-                                for line in response.split('\n'):
-                                    line = line.strip()
-                                    if line.startswith('Title:'):
-                                        sections['title'] = line.split(':', 1)[1].strip()
-                                    elif line.startswith('Problem:'):
-                                        sections['problem'] = line.split(':', 1)[1].strip()
-                                        current_section = 'problem'
-                                    elif line.startswith('Root Cause:'):
-                                        sections['root_cause'] = line.split(':', 1)[1].strip()
-                                        current_section = 'root_cause'
-                                    elif line.startswith('Solution:'):
-                                        sections['solution'] = line.split(':', 1)[1].strip()
-                                        current_section = 'solution'
-                                    elif line.startswith('Prevention:'):
-                                        sections['prevention'] = line.split(':', 1)[1].strip()
-                                        current_section = 'prevention'
-                                    elif line.startswith('Tags:'):
-                                        sections['tags'] = line.split(':', 1)[1].strip()
-                                        current_section = None
-                                    elif current_section and line:
-                                        sections[current_section] += '\n' + line
-
-                                article = sections
-                            else:
-                                article = {"title": "Generated Article", "problem": "", "root_cause": "", "solution": "", "prevention": "", "tags": ""}
-                        
                         # Store in session state
                         st.session_state.generated_article = article
+                        st.session_state.saved_article_id = None
                         st.session_state.incident_cluster = incident_cluster
-                        st.session_state.selected_priority = selected_priority
-                        st.session_state.selected_category = selected_category
-                        st.session_state.selected_cluster = selected_cluster
-                        
+                        for key, value in st.session_state.kb_pending_source.items():
+                            st.session_state[key] = value
+                        st.session_state.kb_pending_cluster = None
+
                         st.success("✅ KB Article Generated from Resolved Tickets!")
                         
                         
@@ -544,6 +745,7 @@ with tab2:
                 selected_priority = st.session_state.selected_priority
                 selected_category = st.session_state.selected_category
                 selected_cluster = st.session_state.selected_cluster
+                saved_article_id = st.session_state.get('saved_article_id')
                 
                 with col2:
                     st.write("**Generated Knowledge Base Article:**")
@@ -576,8 +778,11 @@ with tab2:
                         st.write(f"**Issue Type:** {selected_cluster}")
                     
                     # Option to save to KB
-                    if st.button("💾 Save to Knowledge Base", help="Save this article to the knowledge base"):
-                        # Save to MongoDB
+                    if saved_article_id:
+                        st.info(f"📚 Stored in the knowledge base as {saved_article_id}")
+                    elif st.button("💾 Save to Knowledge Base", help="Save this article to the knowledge base"):
+                        # Save to MongoDB, recording the sources so regeneration can be avoided
+                        source_incident_ids = [str(incident['incident_id']) for incident in incident_cluster if incident.get('incident_id')]
                         kb_data = {
                             'title': article['title'],
                             'problem': article['problem'],
@@ -586,6 +791,9 @@ with tab2:
                             'prevention': article['prevention'],
                             'tags': article['tags'],
                             'source_incidents': len(incident_cluster),
+                            'source_incident_ids': source_incident_ids,
+                            'cluster_signature': cluster_signature(source_incident_ids),
+                            'cluster_id': st.session_state.get('cluster_id'),
                             'ai_generated': True,
                             'filters': {
                                 'priority': selected_priority if selected_priority != 'All' else None,
@@ -596,7 +804,8 @@ with tab2:
                         
                         success = data_ingest_manager.save_kb_article(kb_data)
                         if success:
-                            st.success("✅ Article saved to knowledge base!")
+                            st.session_state.saved_article_id = kb_data['article_id']
+                            st.success(f"✅ Article saved to knowledge base as {kb_data['article_id']}!")
                             st.balloons()
                         else:
                             st.error("❌ Failed to save article. Check MongoDB connection.")
@@ -608,7 +817,7 @@ with tab2:
                     # Show statistics about resolved incidents
                     st.write("**Resolved Incidents Overview:**")
                     
-                    priority_col = 'priority' if 'priority' in resolved_incidents.columns else 'true_priority'
+                    priority_col = 'priority'
                     if priority_col in resolved_incidents.columns:
                         priority_counts = resolved_incidents[priority_col].value_counts()
                         st.write("**By Priority:**")
@@ -627,6 +836,32 @@ with tab2:
     else:
         st.warning("No incident data available. Please check your data source.")
 
+    # Incremental refresh: fold newly resolved cluster incidents into existing articles
+    st.write("---")
+    st.write("**🔄 Refresh Existing Articles with New Incidents:**")
+    st.caption("Sends the model the current article plus only the incidents resolved since it was last written, "
+               "so updates stay cheap as clusters grow. Add new resolutions to the clusters first.")
+    articles_to_refresh = kb_article_updater.get_articles_with_new_incidents()
+    if articles_to_refresh:
+        refresh_labels = {article['article_id']: f"{article['article_id']}: {article['title']} "
+                                                 f"(v{article['version']}, {article['new_incidents']} new incidents)"
+                          for article in articles_to_refresh}
+        refresh_article_id = st.selectbox("Article to refresh:", list(refresh_labels.keys()),
+                                          format_func=lambda article_id: refresh_labels[article_id], key="kb_refresh_article")
+        if st.button("🔄 Update Article", key="kb_refresh_button"):
+            with st.spinner(f"Updating {refresh_article_id} using {selected_model_name}..."):
+                update_result = kb_article_updater.update_article(
+                    refresh_article_id, selected_model_id, min(max_tokens, 1500), temperature,
+                    system_prompt=settings_manager.get_setting("system_prompts.kb_generation")
+                )
+            if update_result.get("success"):
+                st.success(f"✅ {refresh_article_id} is now version {update_result['version']} "
+                           f"({update_result['incorporated']} incidents added, {update_result['remaining']} still waiting)")
+            else:
+                st.error(f"❌ {update_result.get('error', 'Update failed')}")
+    else:
+        st.info("No KB articles have new resolved incidents waiting")
+
 with tab3:
     st.subheader("👥 UC-31: AI-Powered Agent Assignment")
     st.write("Intelligently match incidents to the best available agents based on skills, capacity, and performance.")
@@ -655,11 +890,9 @@ with tab3:
 
     workload = data_service.get_workload()
     agents = data_service.get_agents()
-    # Note: agent_skills and skills_catalog not yet in MongoDB, using empty DataFrames
-    agent_skills = pd.DataFrame()
-    skills_catalog = pd.DataFrame()
     
     if not workload.empty and not agents.empty:
+        agent_records = agents.to_dict('records')
         col1, col2 = st.columns([1, 1])
         
         with col1:
@@ -669,85 +902,41 @@ with tab3:
             if len(workload) > 0:
                 queue_options = []
                 for idx, item in workload.head(10).iterrows():
-                    desc = item.get('description', item.get('record_id', 'Unknown'))
-                    queue_options.append(f"{desc[:50]}...")
+                    desc = item.get('title') or item.get('description') or item.get('incident_id', 'Unknown')
+                    queue_options.append(f"{str(desc)[:50]}...")
                 
                 selected_incident_idx = st.selectbox("Choose incident:", range(len(queue_options)), format_func=lambda x: queue_options[x])
-                selected_incident = workload.iloc[selected_incident_idx]
+                selected_incident = workload.iloc[selected_incident_idx].to_dict()
                 
                 st.write("**Incident Details:**")
-                st.write(f"- **Type:** {selected_incident.get('record_type', 'Unknown')}")
+                st.write(f"- **Category:** {selected_incident.get('category', 'Unknown')}")
                 st.write(f"- **Priority:** {selected_incident.get('priority', 'Unknown')}")
-                st.write(f"- **Required Skills:** {selected_incident.get('required_skills', 'None')}")
+                st.write(f"- **Required Skills:** {', '.join(required_skills(selected_incident))}")
                 
-                # Mock available agents with skills
-                mock_agents = [
-                    {"name": "Alice Johnson", "skills": ["Password Reset", "VPN Troubleshooting"], "current_capacity": "60%", "performance_score": "4.8/5"},
-                    {"name": "Bob Smith", "skills": ["Printer Support", "Wi-Fi Access"], "current_capacity": "40%", "performance_score": "4.6/5"},
-                    {"name": "Carol Davis", "skills": ["Outlook/Exchange", "MFA Support"], "current_capacity": "80%", "performance_score": "4.9/5"},
-                    {"name": "David Wilson", "skills": ["VPN Troubleshooting", "Printer Support"], "current_capacity": "30%", "performance_score": "4.7/5"}
-                ]
+                # Best candidates from the local assignment engine, rather than the whole roster
+                ranked_agents = assignment_engine.rank_agents(selected_incident, agent_records, k=ASSIGNMENT_CANDIDATES)
                 
                 if st.button("🎯 Find Best Agent", type="primary"):
                     with st.spinner(f"AI is analyzing agent assignments using {selected_model_name}..."):
-                        # Prepare agent information
-                        agent_info = []
-                        for agent in mock_agents[:10]:  # Limit to 10 agents
-                            skills = agent.get('skills', [])
-                            capacity = agent.get('current_capacity', 'Unknown')
-                            performance = agent.get('performance_score', 'Unknown')
-
-                            agent_summary = f"- {agent.get('name', 'Unknown')}: Skills: {', '.join(skills)}, Capacity: {capacity}, Performance: {performance}"
-                            agent_info.append(agent_summary)
-
-                        agents_text = '\n'.join(agent_info)
-
-                        prompt = f"""Recommend the best agent for this incident.
-
-                        Incident Details:
-                        - Title: {selected_incident.get('description', 'No title')}
-                        - Type: {selected_incident.get('record_type', 'Unknown')}
-                        - Priority: {selected_incident.get('priority', 'Unknown')}
-                        - Required Skills: {selected_incident.get('required_skills', 'None specified')}
-
-                        Available Agents:
-                        {agents_text}
-
-                        Consider:
-                        1. Skill match for the incident type
-                        2. Current capacity/workload
-                        3. Performance history
-                        4. Priority level urgency
-
-                        Respond with:
-                        Recommended Agent: [Agent name]
-                        Reasoning: [Why this agent is best suited]
-                        Confidence: [High/Medium/Low]
-                        """
+                        # Same prompt as the dashboard, over the candidates ranked above
+                        system_prompt = settings_manager.get_setting("system_prompts.agent_assignment")
+                        prompt = ASSIGNMENT_PROMPT_TEMPLATE.format(
+                            title=selected_incident.get('title', 'No title'),
+                            description=selected_incident.get('description', ''),
+                            category=selected_incident.get('category', 'Unknown'),
+                            agents='\n'.join(assignment_engine.roster_lines(ranked_agents)) or "No agents have free capacity"
+                        )
 
                         response = bedrock_client.invoke_model(
                             prompt,
                             selected_model_id,
                             min(max_tokens, 400),
                             temperature,
-                            system_prompt=settings_manager.get_setting("system_prompts.agent_assignment")
+                            system_prompt=system_prompt
                         )
 
                         if response:
-                            lines = response.split('\n')
-                            agent = "No recommendation"
-                            reasoning = "Unable to determine"
-                            confidence = "Low"
-
-                            for line in lines:
-                                if line.startswith('Recommended Agent:'):
-                                    agent = line.split(':', 1)[1].strip()
-                                elif line.startswith('Reasoning:'):
-                                    reasoning = line.split(':', 1)[1].strip()
-                                elif line.startswith('Confidence:'):
-                                    confidence = line.split(':', 1)[1].strip()
-
-                            recommendation = {"agent": agent, "reasoning": reasoning, "confidence": confidence}
+                            recommendation = parse_assignment_response(response)
                         else:
                             recommendation = {"agent": "No recommendation", "reasoning": "AI assignment failed", "confidence": "Low"}
                     
@@ -758,17 +947,54 @@ with tab3:
                         st.write(f"**Recommended Agent:** {recommendation['agent']}")
                         st.write(f"**Reasoning:** {recommendation['reasoning']}")
                         st.write(f"**Confidence:** {recommendation['confidence']}")
-                        
-                        st.write("**Available Agents:**")
-                        for agent in mock_agents:
-                            st.write(f"- **{agent['name']}**: {', '.join(agent['skills'])} (Capacity: {agent['current_capacity']}, Score: {agent['performance_score']})")
-                        
-                        if st.button("✅ Assign to Recommended Agent"):
-                            st.success(f"Incident assigned to {recommendation['agent']}! (Demo)")
+                        st.caption(f"Prompt fingerprint: {assignment_prompt_fingerprint(system_prompt)}")
         
         with col2:
-            if 'recommendation' not in locals():
-                st.info("👈 Select an incident and get AI recommendation")
+            st.write("**Top Candidates (local ranking):**")
+            if ranked_agents:
+                st.dataframe(pd.DataFrame([{
+                    "Agent": candidate['agent'].get('name', 'Unknown'),
+                    "Score": round(candidate['score'], 2),
+                    "Skill Match": f"{candidate['skill_match']:.0%}",
+                    "Free Slots": candidate['free_slots'],
+                    "Status": candidate['agent'].get('status', 'Unknown')
+                } for candidate in ranked_agents]), use_container_width=True, hide_index=True)
+            else:
+                st.warning("No agents have free capacity")
+
+        # Whole-queue assignment without any model calls
+        st.write("---")
+        st.write("**⚡ Batch Assignment for the Open Queue:**")
+        st.caption("Scores every open, unassigned incident against every agent locally and assigns within each "
+                   "agent's free capacity, higher priorities first when capacity is short.")
+        solver_method = st.radio("Solver:", ["auto", "hungarian", "greedy"], horizontal=True, key="assignment_solver",
+                                 format_func=lambda method: {"auto": "Auto", "hungarian": "Optimal (Hungarian)",
+                                                             "greedy": "Greedy by priority"}[method])
+        if st.button("🧮 Compute Assignments", key="compute_batch_assignment"):
+            st.session_state.batch_assignment = assignment_engine.solve_open_queue(method=solver_method)
+
+        batch_assignment = st.session_state.get('batch_assignment')
+        if batch_assignment:
+            if batch_assignment.get('error'):
+                st.error(f"❌ Assignment failed: {batch_assignment['error']}")
+            metric_col1, metric_col2, metric_col3 = st.columns(3)
+            with metric_col1:
+                st.metric("Assigned", f"{len(batch_assignment['assignments']):,}")
+            with metric_col2:
+                st.metric("Left Unassigned", f"{len(batch_assignment['unassigned']):,}")
+            with metric_col3:
+                st.metric("Solve Time", f"{batch_assignment['elapsed_ms']:.0f} ms", help=f"Solver: {batch_assignment['method']}")
+
+            if batch_assignment['assignments']:
+                st.dataframe(pd.DataFrame(batch_assignment['assignments']), use_container_width=True, hide_index=True, height=250)
+                if st.button(f"✅ Apply {len(batch_assignment['assignments']):,} Assignments", key="apply_batch_assignment"):
+                    applied = data_service.assign_incidents({assignment['incident_id']: assignment['agent_id']
+                                                             for assignment in batch_assignment['assignments']})
+                    st.session_state.batch_assignment = None
+                    st.success(f"✅ Assigned {applied:,} incidents")
+                    st.rerun()
+    else:
+        st.info("Agent assignment needs open incidents and agents. Add agents on the Agents page.")
 
 with tab4:
     st.subheader("⚙️ Admin & Testing Interface")
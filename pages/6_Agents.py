@@ -8,6 +8,8 @@ import random
 from datetime import datetime, timedelta
 from utils.data_ingest import data_ingest_manager
 from utils.data_service import data_service
+from utils.agent_load import agent_load_tracker
+from utils.facet_index import facet_index
 
 # Page configuration
 st.set_page_config(
@@ -59,16 +61,8 @@ def generate_sample_agents():
         num_skills = random.randint(2, 4)
         agent_skills = random.sample(available_skills, num_skills)
 
-        # Generate current queue (0-5, where 5 is full)
-        current_queue = random.randint(0, 5)
-
-        # Status based on queue level
-        if current_queue >= 5:
-            status = 'Busy'
-        elif current_queue >= 3:
-            status = random.choice(['Available', 'Busy'])
-        else:
-            status = random.choice(['Available', 'Available', 'Away'])
+        # Queue counters start empty and are filled in from assigned incidents on save
+        status = random.choice(['Available', 'Available', 'Busy', 'Away'])
 
         agent = {
             'agent_id': f'AGT{str(i+1).zfill(3)}',
@@ -76,7 +70,9 @@ def generate_sample_agents():
             'email': f"{name.lower().replace(' ', '.')}.{random.randint(100,999)}@company.com",
             'department': 'IT Support',
             'status': status,
-            'current_queue': current_queue,
+            'current_queue': 0,
+            'open_by_priority': {},
+            'weighted_load': 0.0,
             'skills': agent_skills,
             'skill_count': len(agent_skills),
             'last_updated': datetime.now().isoformat()
@@ -94,6 +90,11 @@ def save_agents_to_mongodb(agents_data):
             
             # Insert new agents
             result = data_ingest_manager.db.agents.insert_many(agents_data)
+            data_ingest_manager.bump_collection_version('agents')
+
+            # Pick up incidents already assigned to these agents
+            agent_load_tracker.reconcile(fix=True)
+            facet_index.rebuild('agents')
             return len(result.inserted_ids)
         return 0
     except Exception as e:
@@ -111,6 +112,9 @@ def get_agents_from_mongodb():
         st.error(f"Error loading agents: {str(e)}")
         return pd.DataFrame()
 
+# Keep queue counters honest even if an increment was lost
+agent_load_tracker.reconcile_if_due()
+
 # Main content
 tab1, tab2, tab3 = st.tabs(["📋 All Agents", "➕ Add Agent", "⚙️ Manage Data"])
 
@@ -151,19 +155,31 @@ with tab1:
             st.subheader("Filters")
             col1, col2, col3 = st.columns(3)
 
+            # Status and skill options come from the precomputed facets document, with counts narrowed by each other
+            agent_facets = facet_index.get_facets('agents')
+            for facet in ('status', 'skills'):
+                known_values = [value['value'] for value in agent_facets['facets'][facet]['values']] if agent_facets else []
+                if st.session_state.get(f"agent_facet_{facet}", "All") not in known_values:
+                    st.session_state[f"agent_facet_{facet}"] = "All"
+            agent_counts = facet_index.facet_counts('agents', {facet: st.session_state[f"agent_facet_{facet}"]
+                                                               for facet in ('status', 'skills')})
+
+            def facet_options(facet):
+                """Filter options for an agent facet, labelled with narrowed counts"""
+                values = [value['value'] for value in agent_facets['facets'][facet]['values']] if agent_facets else []
+                counts = agent_counts.get(facet, {})
+                return ["All"] + values, lambda value: value if value == "All" else f"{value} ({counts.get(value, 0)})"
+
             with col1:
-                status_filter = st.selectbox("Status", ["All"] + list(agents_df['status'].unique()))
+                status_options, status_format = facet_options('status')
+                status_filter = st.selectbox("Status", status_options, key="agent_facet_status", format_func=status_format)
 
             with col2:
                 queue_filter = st.selectbox("Queue Load", ["All", "Light (0-1)", "Medium (2-3)", "Heavy (4-5)"])
 
             with col3:
-                # Get all unique skills
-                all_skills = []
-                for skills_list in agents_df['skills']:
-                    all_skills.extend(skills_list)
-                unique_skills = list(set(all_skills))
-                skill_filter = st.selectbox("Has Skill", ["All"] + unique_skills)
+                skill_options, skill_format = facet_options('skills')
+                skill_filter = st.selectbox("Has Skill", skill_options, key="agent_facet_skills", format_func=skill_format)
         
             # Apply filters
             filtered_df = agents_df.copy()
@@ -232,12 +248,38 @@ with tab3:
         if st.button("🗑️ Clear All Agents", type="secondary"):
             if data_ingest_manager.available:
                 data_ingest_manager.db.agents.delete_many({})
+                data_ingest_manager.bump_collection_version('agents')
+                facet_index.rebuild('agents')
                 st.success("All agents cleared!")
                 st.rerun()
     else:
         st.warning("No agents found in MongoDB")
     
     st.markdown("---")
+
+    # Queue counter reconciliation
+    st.subheader("Queue Counters")
+    st.write("Agent queues are updated on every assignment and resolution; reconciliation recomputes them from the open incidents and reports any drift")
+
+    if st.button("🔄 Reconcile Queue Counters"):
+        with st.spinner("Reconciling queue counters..."):
+            agent_load_tracker.reconcile(fix=True)
+        st.rerun()
+
+    last_report = agent_load_tracker.get_last_report()
+    if last_report and last_report.get('success'):
+        st.caption(f"Last reconciled {last_report['checked_at'].strftime('%Y-%m-%d %H:%M')} UTC - "
+                   f"{last_report['agents_checked']} agents checked in {last_report['elapsed_ms']:.0f} ms")
+        if last_report['drifted']:
+            st.warning(f"⚠️ {len(last_report['drifted'])} agents had drifted counters"
+                       f"{' (corrected)' if last_report.get('fixed') else ''}")
+            st.dataframe(pd.DataFrame(last_report['drifted']), use_container_width=True, hide_index=True)
+        else:
+            st.success("✅ All queue counters match the open incidents")
+        if last_report['unknown_assignees']:
+            st.info(f"Open incidents are assigned to unknown agents: {', '.join(last_report['unknown_assignees'][:20])}")
+
+    st.markdown("---")
     
     # Generate sample data
     st.subheader("Generate Sample Data")
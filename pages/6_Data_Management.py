@@ -10,6 +10,13 @@ from datetime import datetime
 # Add the parent directory to the path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.data_ingest import data_ingest_manager
+from utils.kb_service import kb_service
+from utils.incident_rollups import incident_rollups
+from utils.incident_clustering import incident_clusterer
+from utils.agent_load import agent_load_tracker
+from utils.facet_index import facet_index
+from utils.incident_schema import decode_incidents, memory_report
+from utils.sla_engine import sla_engine
 
 st.set_page_config(page_title="Data Management", page_icon="🗄️", layout="wide")
 st.title("Data Management")
@@ -200,7 +207,7 @@ with preview_tabs[0]:
 
                 # Select key columns for better display
                 key_columns = ['incident_id', 'title', 'status', 'priority', 'urgency', 'impact',
-                              'category_id', 'assigned_to', 'created_on', 'sla_due']
+                              'category', 'service', 'assigned_to', 'created_on', 'sla_due']
                 available_columns = [col for col in key_columns if col in df.columns]
 
                 if available_columns:
@@ -288,9 +295,15 @@ with danger_col1:
             with st.spinner("Clearing all data..."):
                 try:
                     data_ingest_manager.incidents_collection.delete_many({})
+                    data_ingest_manager.record_deletions('incidents')
                     data_ingest_manager.agents_collection.delete_many({})
                     data_ingest_manager.workload_collection.delete_many({})
-                    data_ingest_manager.metadata_collection.delete_many({})
+                    data_ingest_manager.clear_metadata()
+                    incident_rollups.backfill()
+                    agent_load_tracker.reconcile(fix=True)
+                    facet_index.rebuild('incidents')
+                    facet_index.rebuild('agents')
+                    incident_clusterer.reset()
                     st.success("✅ All data cleared successfully!")
                     st.rerun()
                 except Exception as e:
@@ -306,3 +319,72 @@ with danger_col2:
         st.write(f"**Indexes**: {db_stats.get('indexes', 0)}")
     except Exception as e:
         st.write(f"Could not get database stats: {str(e)}")
+
+    with st.expander("Incident DataFrame Memory"):
+        st.caption("Footprint of the incidents frame each page loads, as plain objects and with the typed schema")
+        if st.button("Measure", key="measure_incident_memory", disabled=not data_exists.get("incidents", False)):
+            with st.spinner("Loading incidents..."):
+                raw_df = pd.DataFrame(data_ingest_manager.get_incidents()).drop(columns=['_id'], errors='ignore')
+                report = memory_report(raw_df, decode_incidents(raw_df.copy()))
+            total = report.iloc[-1]
+            rows = max(len(raw_df), 1)
+            st.write(f"**Before**: {total['bytes_before'] / 1024 / 1024:.2f} MB "
+                     f"({total['bytes_before'] / rows:,.0f} bytes/row)")
+            st.write(f"**After**: {total['bytes_after'] / 1024 / 1024:.2f} MB "
+                     f"({total['bytes_after'] / rows:,.0f} bytes/row) - {total['reduction']:.1f}x smaller")
+            st.write(f"**At 1M rows**: {total['bytes_before'] / rows * 1e6 / 1024 ** 3:.2f} GB → "
+                     f"{total['bytes_after'] / rows * 1e6 / 1024 ** 3:.2f} GB")
+            st.dataframe(report, use_container_width=True, hide_index=True)
+
+# One-off data migrations
+st.header("Data Migrations")
+
+st.subheader("KB Article IDs")
+articles_without_id = kb_service.count_articles_without_id()
+if articles_without_id:
+    st.write(f"**{articles_without_id}** knowledge base articles were created before stable article ids "
+             "and cannot be opened, edited or deleted until they are given one.")
+    if st.button("Assign Article IDs", key="migrate_kb_article_ids"):
+        with st.spinner("Assigning article ids..."):
+            migration_result = kb_service.migrate_article_ids()
+        if migration_result.get("success"):
+            st.success(f"✅ Assigned ids to {migration_result['migrated']} articles")
+            st.rerun()
+        else:
+            st.error(f"❌ Migration failed: {migration_result.get('error', 'Unknown error')}")
+else:
+    st.success("✅ All knowledge base articles have an article id")
+
+st.subheader("Canonical Incident Schema")
+legacy_incidents = data_ingest_manager.count_legacy_incidents()
+if legacy_incidents:
+    st.write(f"**{legacy_incidents}** incidents still carry CSV-schema fields (short_description, true_priority, "
+             "category_name, service_name, resolved_at) instead of title, priority, category, service and "
+             "resolved_on, or lack the "
+             "ground-truth priority_label used to train and evaluate triage.")
+    if st.button("Migrate Incidents", key="migrate_canonical_incidents"):
+        with st.spinner("Migrating incidents..."):
+            migration_result = data_ingest_manager.migrate_canonical_incidents()
+        if migration_result.get("success"):
+            st.success(f"✅ Migrated {migration_result['migrated']} incidents")
+            st.rerun()
+        else:
+            st.error(f"❌ Migration failed: {migration_result.get('error', 'Unknown error')}")
+else:
+    st.success("✅ All incidents use the canonical schema")
+
+st.subheader("SLA Timestamps")
+string_date_incidents = sla_engine.count_string_dates()
+if string_date_incidents:
+    st.write(f"**{string_date_incidents}** incidents store created_on, sla_due or resolved_on as text, so they are "
+             "left out of the breached, at-risk and due-soon SLA counts until converted to dates.")
+    if st.button("Convert Timestamps", key="migrate_sla_dates"):
+        with st.spinner("Converting timestamps..."):
+            migration_result = sla_engine.migrate_dates()
+        if migration_result.get("success"):
+            st.success(f"✅ Converted timestamps of {migration_result['migrated']} incidents")
+            st.rerun()
+        else:
+            st.error(f"❌ Migration failed: {migration_result.get('error', 'Unknown error')}")
+else:
+    st.success("✅ All incident timestamps are stored as dates")
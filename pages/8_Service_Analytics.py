@@ -0,0 +1,100 @@
+"""
+Service analytics page with incident volume, backlog and MTTR trends
+"""
+import streamlit as st
+import plotly.express as px
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add the parent directory to the path to import utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.data_ingest import data_ingest_manager
+from utils.incident_rollups import incident_rollups, HISTOGRAM_BINS, OVERALL
+
+st.set_page_config(page_title="Service Analytics", page_icon="📊", layout="wide")
+st.title("Service Analytics")
+st.write("Incident volume, backlog and time-to-resolve trends, read from hourly and daily rollups")
+
+if not incident_rollups.is_available():
+    st.error("❌ MongoDB not available")
+    st.stop()
+
+# Rollups are rebuilt on ingest; build them once for data loaded before they existed
+if (incident_rollups.collections["daily"].estimated_document_count() == 0
+        and data_ingest_manager.incidents_collection.estimated_document_count() > 0):
+    with st.spinner("Building incident rollups..."):
+        incident_rollups.backfill()
+
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    granularity = st.selectbox("Granularity", ["daily", "hourly"], format_func=str.title)
+with col2:
+    default_days = 90 if granularity == "daily" else 7
+    days = st.number_input("Days", min_value=1, max_value=730, value=default_days, step=1)
+with col3:
+    dimension = st.selectbox("Break down by", [OVERALL, "service", "category", "priority"],
+                             format_func=lambda d: "Nothing" if d == OVERALL else d.title())
+with col4:
+    top_n = st.slider("Series", 1, 15, 6, disabled=dimension == OVERALL,
+                      help="Busiest values to chart when breaking down")
+
+end = datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+start = end - timedelta(days=int(days))
+trend = incident_rollups.get_trend(granularity=granularity, dimension=dimension, start=start, end=end)
+
+if trend.empty:
+    st.info("No incidents created or resolved in this period")
+    st.stop()
+
+if dimension != OVERALL:
+    busiest = trend.groupby("value")["created"].sum().nlargest(top_n).index.tolist()
+    trend = trend[trend["value"].isin(busiest)]
+
+created, resolved = int(trend["created"].sum()), int(trend["resolved"].sum())
+resolution_hours = (trend["mean_resolution_hours"].fillna(0) * trend["resolved"]).sum()
+closing_backlog = trend.sort_values("bucket").groupby("value")["backlog"].last().sum()
+
+metric_cols = st.columns(4)
+metric_cols[0].metric("Created", f"{created:,}")
+metric_cols[1].metric("Resolved", f"{resolved:,}")
+metric_cols[2].metric("MTTR", f"{resolution_hours / resolved:.1f}h" if resolved else "—")
+metric_cols[3].metric("Open backlog", f"{closing_backlog:,.0f}")
+
+color = None if dimension == OVERALL else "value"
+labels = {"bucket": "", "value": dimension.title()}
+
+chart_col1, chart_col2 = st.columns(2)
+with chart_col1:
+    if dimension == OVERALL:
+        volume = trend.melt(id_vars="bucket", value_vars=["created", "resolved"], var_name="event", value_name="incidents")
+        fig = px.line(volume, x="bucket", y="incidents", color="event", title="Incident Volume", labels=labels)
+    else:
+        fig = px.line(trend, x="bucket", y="created", color=color, title="Incidents Created", labels=labels)
+    st.plotly_chart(fig, use_container_width=True)
+with chart_col2:
+    fig = px.line(trend, x="bucket", y="backlog", color=color, title="Open Backlog", labels=labels)
+    st.plotly_chart(fig, use_container_width=True)
+
+chart_col3, chart_col4 = st.columns(2)
+with chart_col3:
+    fig = px.line(trend.dropna(subset=["mean_resolution_hours"]), x="bucket", y="mean_resolution_hours", color=color,
+                  title="Mean Time to Resolve (hours, by resolution time)", labels=labels, markers=True)
+    st.plotly_chart(fig, use_container_width=True)
+with chart_col4:
+    histogram = trend.groupby("value")[HISTOGRAM_BINS].sum().reset_index().melt(
+        id_vars="value", var_name="resolution_time", value_name="incidents")
+    histogram["resolution_time"] = histogram["resolution_time"].str.replace("le_", "≤ ").str.replace("gt_", "> ")
+    fig = px.bar(histogram, x="resolution_time", y="incidents", color=color, barmode="group",
+                 title="Resolution Time Distribution", labels={"resolution_time": "", "value": dimension.title()})
+    st.plotly_chart(fig, use_container_width=True)
+
+with st.expander("Rollup data"):
+    st.dataframe(trend, use_container_width=True, hide_index=True)
+    if st.button("🔄 Rebuild rollups", help="Recount every bucket from the incidents"):
+        with st.spinner("Rebuilding..."):
+            result = incident_rollups.backfill()
+        if result["success"]:
+            st.success(f"✅ Rebuilt {sum(result['buckets'].values()):,} buckets in {result['elapsed_ms']:.0f} ms")
+        else:
+            st.error(f"❌ Failed to rebuild rollups: {result['error']}")
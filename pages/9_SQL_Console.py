@@ -0,0 +1,84 @@
+"""
+SQL console page for ad-hoc analytics over Parquet snapshots with DuckDB
+"""
+import streamlit as st
+import pandas as pd
+import os
+import sys
+
+# Add the parent directory to the path to import utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.data_ingest import data_ingest_manager
+from utils.analytics_engine import analytics_engine, view_snapshots, ANALYTICS_VIEWS, SNAPSHOTS
+
+st.set_page_config(page_title="SQL Console", page_icon="🦆", layout="wide")
+st.title("SQL Console")
+st.write("Query columnar snapshots of incidents, agents and KB articles with DuckDB - analytics never touch the operational database")
+
+manifest = analytics_engine.get_manifest()
+
+col1, col2 = st.columns([3, 1])
+with col1:
+    if manifest:
+        st.dataframe(pd.DataFrame([{"table": name, "rows": entry.get("rows", 0), "source_version": entry.get("version"),
+                                    "exported_at": entry.get("exported_at")} for name, entry in manifest.items()]),
+                     use_container_width=True, hide_index=True)
+    else:
+        st.info("No snapshots exported yet")
+with col2:
+    force = st.checkbox("Re-export unchanged collections", value=False)
+    if st.button("🔄 Refresh Snapshots", type="primary", disabled=not data_ingest_manager.is_available(),
+                 help="Export collections that changed since their last snapshot"):
+        with st.spinner("Exporting snapshots to Parquet..."):
+            result = analytics_engine.refresh_snapshots(force=force)
+        if result["success"]:
+            exported = result["exported"]
+            st.success(f"✅ Exported {', '.join(exported)}" if exported else "✅ Snapshots are up to date")
+            st.rerun()
+        else:
+            st.error(f"❌ Failed to export snapshots: {result['error']}")
+
+st.markdown("---")
+
+tab1, tab2 = st.tabs(["📈 Analytics Views", "⌨️ Ad-hoc SQL"])
+
+with tab1:
+    view = st.selectbox("View", list(ANALYTICS_VIEWS))
+    with st.expander("SQL"):
+        st.code(ANALYTICS_VIEWS[view].strip(), language="sql")
+    missing_snapshots = [name for name in view_snapshots(view) if name not in manifest]
+    if missing_snapshots:
+        st.info(f"This view reads the {', '.join(missing_snapshots)} snapshot, which has not been exported yet. "
+                "Click **🔄 Refresh Snapshots** above to export it.")
+    else:
+        result = analytics_engine.run_view(view)
+        if result["success"]:
+            st.dataframe(result["data"], use_container_width=True, hide_index=True)
+            st.caption(f"{len(result['data']):,} rows in {result['elapsed_ms']:.0f} ms")
+        else:
+            st.error(f"❌ {result['error']}")
+
+with tab2:
+    sql = st.text_area("SQL", height=180, key="sql_console_query",
+                       value="SELECT status, count(*) AS incidents\nFROM incidents\nGROUP BY status\nORDER BY incidents DESC")
+    max_rows = st.number_input("Max rows", min_value=100, max_value=100000, value=10000, step=1000)
+    st.caption(f"Tables: {', '.join(SNAPSHOTS)}. One SELECT statement per run; snapshots are read-only.")
+    if not manifest:
+        st.info("Tables are empty until snapshots are exported. Click **🔄 Refresh Snapshots** above first.")
+
+    if st.button("▶️ Run Query", type="primary"):
+        st.session_state.sql_console_result = analytics_engine.query(sql, max_rows=int(max_rows))
+
+    query_result = st.session_state.get('sql_console_result')
+    if query_result:
+        if query_result["success"]:
+            data = query_result["data"]
+            st.dataframe(data, use_container_width=True, hide_index=True)
+            note = f" (first {len(data):,} rows)" if query_result["truncated"] else ""
+            st.caption(f"{len(data):,} rows{note} in {query_result['elapsed_ms']:.0f} ms")
+            st.download_button("📥 Download CSV", data.to_csv(index=False), file_name="query_result.csv", mime="text/csv")
+        else:
+            st.error(f"❌ {query_result['error']}")
+
+    with st.expander("Schema"):
+        st.dataframe(analytics_engine.describe(), use_container_width=True, hide_index=True)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test delta merges of the shared Arrow snapshot against MongoDB
+Uses a scratch collection and snapshot directory, both removed afterwards
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.data_ingest import data_ingest_manager
+from utils.shared_snapshot import SharedSnapshot
+
+TEST_COLLECTION = 'snapshot_test_incidents'
+
+
+def _setup(count: int = 20):
+    """Fill the scratch collection and publish its snapshot, returning (snapshot, snapshot_dir)"""
+    collection = data_ingest_manager.db[TEST_COLLECTION]
+    collection.delete_many({})
+    data_ingest_manager.tombstones_collection.delete_many({"collection": TEST_COLLECTION})
+    ingested_at = datetime.utcnow() - timedelta(minutes=10)
+    collection.insert_many([{"incident_id": f"INC{i:03d}", "priority": "P3", "status": "Open",
+                             "_ingested_at": ingested_at} for i in range(count)])
+    snapshot_dir = tempfile.mkdtemp()
+    snapshot = SharedSnapshot(TEST_COLLECTION, snapshot_dir=snapshot_dir)
+    snapshot.publish(1)
+    return snapshot, snapshot_dir
+
+
+def _teardown(snapshot_dir: str):
+    """Drop the scratch collection, its tombstones and the snapshot files"""
+    data_ingest_manager.db[TEST_COLLECTION].drop()
+    data_ingest_manager.tombstones_collection.delete_many({"collection": TEST_COLLECTION})
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+def _rows(snapshot: SharedSnapshot) -> dict:
+    """Snapshot rows keyed by incident_id"""
+    return {row["incident_id"]: row for row in snapshot._map().to_dict("records")}
+
+
+def test_single_edit_moves_one_document():
+    """An edited document is the only one read back, and its row shows the edit"""
+    snapshot, snapshot_dir = _setup()
+    try:
+        data_ingest_manager.db[TEST_COLLECTION].update_one(
+            {"incident_id": "INC005"}, {"$set": {"priority": "P1", "_updated_at": datetime.utcnow()}})
+        assert snapshot.merge_changes(2) == 1
+        rows = _rows(snapshot)
+        assert len(rows) == 20
+        assert rows["INC005"]["priority"] == "P1"
+        assert rows["INC006"]["priority"] == "P3"
+        print("✅ Single edit merged")
+    finally:
+        _teardown(snapshot_dir)
+
+
+def test_tombstone_removes_row():
+    """A tombstoned document's row is dropped without reading anything back"""
+    snapshot, snapshot_dir = _setup()
+    try:
+        data_ingest_manager.db[TEST_COLLECTION].delete_one({"incident_id": "INC007"})
+        data_ingest_manager.record_deletions(TEST_COLLECTION, ["INC007"])
+        assert snapshot.merge_changes(2) == 0
+        rows = _rows(snapshot)
+        assert len(rows) == 19
+        assert "INC007" not in rows
+        print("✅ Tombstoned row removed")
+    finally:
+        _teardown(snapshot_dir)
+
+
+def test_ingest_race_within_overlap():
+    """A document stamped just before the watermark but committed after the snapshot was built is still merged"""
+    snapshot, snapshot_dir = _setup()
+    try:
+        collection = data_ingest_manager.db[TEST_COLLECTION]
+        watermark = datetime.utcnow()
+        collection.update_one({"incident_id": "INC001"}, {"$set": {"status": "Assigned", "_updated_at": watermark}})
+        assert snapshot.merge_changes(2) == 1
+
+        # Stamped before the edit that set the watermark, inserted after the merge read
+        collection.insert_one({"incident_id": "INC999", "priority": "P2", "status": "Open",
+                               "_ingested_at": watermark - timedelta(seconds=2)})
+        assert snapshot.merge_changes(3) is not None
+        rows = _rows(snapshot)
+        assert "INC999" in rows
+        assert rows["INC001"]["status"] == "Assigned"
+        print("✅ Late-committed ingest merged")
+    finally:
+        _teardown(snapshot_dir)
+
+
+if __name__ == "__main__":
+    print(f"MongoDB available: {data_ingest_manager.is_available()}")
+    if not data_ingest_manager.is_available():
+        sys.exit(1)
+    test_single_edit_moves_one_document()
+    test_tombstone_removes_row()
+    test_ingest_race_within_overlap()
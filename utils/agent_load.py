@@ -0,0 +1,222 @@
+"""
+Live agent load counters
+Keeps each agent's open incident count, per-priority counts and priority-weighted load
+current with $inc alongside every assignment, reassignment, priority change and
+resolution, and reconciles them against the incidents with one aggregation
+"""
+import time
+import logging
+from typing import Dict, Iterable, Optional
+from datetime import datetime, timedelta
+from collections import defaultdict
+
+from pymongo import UpdateOne
+
+from utils.data_ingest import data_ingest_manager
+from utils.background_jobs import background_job_manager, JobContext
+from utils.assignment_engine import PRIORITY_WEIGHTS, DEFAULT_PRIORITY_WEIGHT
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ['Open', 'In Progress', 'Assigned']
+UNSET_PRIORITY = "unset"
+COUNTED_PRIORITIES = list(PRIORITY_WEIGHTS) + [UNSET_PRIORITY]
+
+RECONCILE_JOB = "agent_load_reconcile"
+RECONCILE_INTERVAL = timedelta(hours=1)
+RECONCILE_STATE_ID = "agent_load_reconcile"
+
+# Incident fields that decide which agent counter, if any, an incident counts towards
+LOAD_FIELDS_PROJECTION = {"_id": 0, "incident_id": 1, "assigned_to": 1, "status": 1, "priority": 1}
+
+
+def incident_priority(incident: Dict) -> str:
+    """The priority an incident counts under (unset when it has none)"""
+    priority = incident.get("priority")
+    return priority if priority in PRIORITY_WEIGHTS else UNSET_PRIORITY
+
+
+def load_key(incident: Optional[Dict]):
+    """(agent, priority) an incident counts towards, or None when it adds no load"""
+    if not incident or incident.get("status") not in OPEN_STATUSES or not incident.get("assigned_to"):
+        return None
+    return str(incident["assigned_to"]), incident_priority(incident)
+
+
+def _counter_update(priority: str, sign: int) -> Dict:
+    """$inc for one open incident of a priority joining (+1) or leaving (-1) an agent's queue"""
+    return {
+        "current_queue": sign,
+        f"open_by_priority.{priority}": sign,
+        "weighted_load": sign * PRIORITY_WEIGHTS.get(priority, DEFAULT_PRIORITY_WEIGHT)
+    }
+
+
+def _agent_filter(agent: str) -> Dict:
+    """Incidents name their assignee by agent_id or, when assigned by the LLM, by name"""
+    return {"$or": [{"agent_id": agent}, {"name": agent}]}
+
+
+class AgentLoadTracker:
+    """Maintains and reconciles per-agent open incident counters"""
+
+    def is_available(self) -> bool:
+        """Check if counters can be maintained"""
+        return data_ingest_manager.is_available()
+
+    def apply_changes(self, changes: Iterable[tuple]):
+        """
+        Move load between agents for incident writes
+
+        Args:
+            changes: (before, after) incident documents (with LOAD_FIELDS_PROJECTION fields) per write
+        """
+        if not self.is_available():
+            return
+        deltas = defaultdict(lambda: defaultdict(int))
+        for before, after in changes:
+            old_key, new_key = load_key(before), load_key(after)
+            if old_key == new_key:
+                continue
+            for key, sign in ((old_key, -1), (new_key, 1)):
+                if key:
+                    for field, value in _counter_update(key[1], sign).items():
+                        deltas[key[0]][field] += value
+
+        operations = [
+            UpdateOne(_agent_filter(agent), {"$inc": {field: value for field, value in inc.items() if value}})
+            for agent, inc in deltas.items() if any(inc.values())
+        ]
+        if not operations:
+            return
+        try:
+            data_ingest_manager.agents_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # Reconciliation corrects any counter a failed increment leaves behind
+            logger.error(f"Failed to update agent load counters: {str(e)}")
+
+    def compute_loads(self) -> Dict[str, Dict]:
+        """Recompute every agent's counters from the incidents in one aggregation, keyed by assignee"""
+        loads = {}
+        for row in data_ingest_manager.incidents_collection.aggregate([
+            {"$match": {"status": {"$in": OPEN_STATUSES}, "assigned_to": {"$nin": ["", None]}}},
+            {"$group": {
+                "_id": {"agent": "$assigned_to", "priority": "$priority"},
+                "count": {"$sum": 1}
+            }}
+        ]):
+            agent = str(row["_id"]["agent"])
+            priority = incident_priority({"priority": row["_id"].get("priority")})
+            load = loads.setdefault(agent, {"current_queue": 0, "open_by_priority": {p: 0 for p in COUNTED_PRIORITIES},
+                                            "weighted_load": 0.0})
+            load["current_queue"] += row["count"]
+            load["open_by_priority"][priority] += row["count"]
+            load["weighted_load"] += row["count"] * PRIORITY_WEIGHTS.get(priority, DEFAULT_PRIORITY_WEIGHT)
+        return loads
+
+    def reconcile(self, fix: bool = True) -> Dict:
+        """
+        Compare stored counters with recomputed ones and optionally correct them
+
+        Returns:
+            Dict with agents checked, drifted agents (stored vs actual queue) and unknown assignees
+        """
+        if not self.is_available():
+            return {"success": False, "error": "MongoDB not available"}
+
+        try:
+            started = time.perf_counter()
+            # Counters are read before the incidents: an $inc landing after this read changes the stored
+            # values, so the conditional update below skips that agent instead of overwriting the $inc
+            agents = list(data_ingest_manager.agents_collection.find(
+                {}, {"_id": 1, "agent_id": 1, "name": 1, "current_queue": 1, "open_by_priority": 1, "weighted_load": 1}))
+            loads = self.compute_loads()
+
+            matched = set()
+            drift = []
+            operations = []
+            for agent in agents:
+                actual = {"current_queue": 0, "open_by_priority": {p: 0 for p in COUNTED_PRIORITIES}, "weighted_load": 0.0}
+                for key in (agent.get("agent_id"), agent.get("name")):
+                    if key and key in loads and key not in matched:
+                        matched.add(key)
+                        load = loads[key]
+                        actual["current_queue"] += load["current_queue"]
+                        actual["weighted_load"] += load["weighted_load"]
+                        for priority, count in load["open_by_priority"].items():
+                            actual["open_by_priority"][priority] += count
+
+                stored_by_priority = {p: (agent.get("open_by_priority") or {}).get(p, 0) for p in COUNTED_PRIORITIES}
+                if (agent.get("current_queue") != actual["current_queue"] or stored_by_priority != actual["open_by_priority"]
+                        or abs((agent.get("weighted_load") or 0) - actual["weighted_load"]) > 1e-6):
+                    drift.append({
+                        "agent_id": agent.get("agent_id"),
+                        "name": agent.get("name"),
+                        "stored_queue": agent.get("current_queue"),
+                        "actual_queue": actual["current_queue"],
+                        "stored_weighted_load": agent.get("weighted_load"),
+                        "actual_weighted_load": actual["weighted_load"]
+                    })
+                    stored = {"_id": agent["_id"], "current_queue": agent.get("current_queue"),
+                              "weighted_load": agent.get("weighted_load")}
+                    stored.update({f"open_by_priority.{p}": (agent.get("open_by_priority") or {}).get(p)
+                                   for p in COUNTED_PRIORITIES})
+                    operations.append(UpdateOne(stored, {"$set": actual}))
+
+            skipped = 0
+            if fix and operations:
+                result = data_ingest_manager.agents_collection.bulk_write(operations, ordered=False)
+                # Agents whose counters moved since they were read; the next run corrects them
+                skipped = len(operations) - result.matched_count
+
+            report = {
+                "success": True,
+                "checked_at": datetime.utcnow(),
+                "agents_checked": len(agents),
+                "drifted": drift,
+                "fixed": fix,
+                "skipped": skipped,
+                "unknown_assignees": sorted(set(loads) - matched),
+                "elapsed_ms": (time.perf_counter() - started) * 1000
+            }
+            data_ingest_manager.metadata_collection.update_one(
+                {"_id": RECONCILE_STATE_ID}, {"$set": {"last_report": report}}, upsert=True)
+            if drift:
+                logger.warning(f"Agent load counters drifted for {len(drift)} agents{' (corrected)' if fix else ''}")
+            return report
+
+        except Exception as e:
+            logger.error(f"Failed to reconcile agent load counters: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def get_last_report(self) -> Optional[Dict]:
+        """The most recent reconciliation report"""
+        if not self.is_available():
+            return None
+        try:
+            state = data_ingest_manager.metadata_collection.find_one({"_id": RECONCILE_STATE_ID})
+            return state.get("last_report") if state else None
+        except Exception as e:
+            logger.error(f"Failed to load agent load reconciliation report: {str(e)}")
+            return None
+
+    def reconcile_if_due(self) -> Optional[str]:
+        """Start the reconciliation job in the background when the last run is older than RECONCILE_INTERVAL"""
+        report = self.get_last_report()
+        if report and report.get("checked_at") and datetime.utcnow() - report["checked_at"] < RECONCILE_INTERVAL:
+            return None
+        return background_job_manager.start_job(RECONCILE_JOB, total=1)
+
+
+def _run_reconcile(context: JobContext):
+    """Job handler: reconcile and correct agent load counters"""
+    report = agent_load_tracker.reconcile(fix=True)
+    context.update(inc={"processed": 1, "succeeded": 1 if report.get("success") else 0,
+                        "failed": 0 if report.get("success") else 1},
+                   set_fields={"drifted": len(report.get("drifted", []))})
+
+
+# Global instance
+agent_load_tracker = AgentLoadTracker()
+
+background_job_manager.register(RECONCILE_JOB, _run_reconcile)
@@ -0,0 +1,314 @@
+"""
+DuckDB analytics over columnar snapshots
+Exports incidents, agents and KB articles to Parquet (incidents partitioned by creation
+month) and answers analytical SQL with DuckDB over those files, so heavy queries never
+run against the operational MongoDB
+"""
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import threading
+from typing import Dict, List, Optional
+from datetime import datetime
+
+import duckdb
+import pandas as pd
+
+from utils.data_ingest import data_ingest_manager
+from utils.triage_model import MODELS_DIR
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.path.join(MODELS_DIR, "snapshots")
+EXPORT_BATCH_SIZE = 50000
+DEFAULT_MAX_ROWS = 10000
+
+# Snapshot (and SQL view) name -> source collection, Parquet partition columns and the columns every
+# file carries with a fixed type, so views and saved queries work even when a field was never set
+SNAPSHOTS = {
+    "incidents": {
+        "collection": "incidents",
+        "partition_by": ["created_year", "created_month"],
+        "columns": {
+            "incident_id": "string", "status": "string", "priority": "string", "category": "string", "service": "string",
+            "assigned_to": "string", "resolution_code": "string",
+            "created_on": "datetime", "resolved_on": "datetime", "sla_due": "datetime"
+        }
+    },
+    "agents": {
+        "collection": "agents",
+        "partition_by": [],
+        "columns": {"agent_id": "string", "name": "string", "status": "string", "current_queue": "number"}
+    },
+    "kb_articles": {
+        "collection": "kb_articles",
+        "partition_by": [],
+        "columns": {"article_id": "string", "title": "string", "category": "string", "publish_state": "string"}
+    }
+}
+
+ANALYTICS_VIEWS = {
+    "MTTR percentiles by category": """
+        SELECT coalesce(category, 'unset') AS category,
+               count(*) AS resolved,
+               round(quantile_cont(hours, 0.5), 1) AS p50_hours,
+               round(quantile_cont(hours, 0.9), 1) AS p90_hours,
+               round(avg(hours), 1) AS mean_hours
+        FROM (
+            SELECT *, date_diff('minute', created_on, resolved_on) / 60.0 AS hours
+            FROM incidents
+            WHERE status IN ('Resolved', 'Closed')
+        )
+        WHERE hours >= 0
+        GROUP BY 1
+        ORDER BY resolved DESC
+    """,
+    "Backlog by agent": """
+        SELECT coalesce(a.name, i.assigned_to) AS agent,
+               any_value(a.status) AS agent_status,
+               count(*) AS open_incidents,
+               count(*) FILTER (WHERE i.priority IN ('P1', 'P2')) AS high_priority,
+               count(*) FILTER (WHERE i.sla_due < now()::TIMESTAMP) AS breached,
+               round(avg(date_diff('minute', i.created_on, now()::TIMESTAMP)) / 60.0, 1) AS mean_age_hours
+        FROM incidents i
+        LEFT JOIN agents a ON i.assigned_to IN (a.agent_id, a.name)
+        WHERE i.status IN ('Open', 'In Progress', 'Assigned') AND coalesce(i.assigned_to, '') <> ''
+        GROUP BY 1
+        ORDER BY open_incidents DESC
+    """,
+    "Resolution code mix": """
+        SELECT coalesce(nullif(resolution_code, ''), 'unset') AS resolution_code,
+               count(*) AS incidents,
+               round(100.0 * count(*) / sum(count(*)) OVER (), 1) AS share_pct,
+               round(median(date_diff('minute', created_on, resolved_on)) / 60.0, 1) AS median_hours
+        FROM incidents
+        WHERE status IN ('Resolved', 'Closed')
+        GROUP BY 1
+        ORDER BY incidents DESC
+    """,
+    "Monthly volume by priority": """
+        SELECT created_year, created_month,
+               coalesce(nullif(priority, ''), 'unset') AS priority,
+               count(*) AS created,
+               count(*) FILTER (WHERE status IN ('Resolved', 'Closed')) AS resolved
+        FROM incidents
+        WHERE created_year IS NOT NULL
+        GROUP BY ALL
+        ORDER BY created_year, created_month, priority
+    """
+}
+
+
+def view_snapshots(view: str) -> List[str]:
+    """Snapshots a predefined analytics view reads"""
+    return [name for name in SNAPSHOTS if re.search(rf"\b(FROM|JOIN)\s+{name}\b", ANALYTICS_VIEWS[view])]
+
+
+def _normalise_frame(df: pd.DataFrame, columns: Dict[str, str]) -> pd.DataFrame:
+    """Give a batch of documents Parquet-friendly column types"""
+    for column, kind in columns.items():
+        if column not in df.columns:
+            df[column] = None
+        if kind == "datetime":
+            df[column] = pd.to_datetime(df[column].replace('', None), errors='coerce', utc=True, format='mixed').dt.tz_localize(None)
+        elif kind == "number":
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+        else:
+            # The string dtype keeps all-empty columns VARCHAR instead of letting DuckDB infer INTEGER
+            df[column] = df[column].map(lambda value: None if value is None or value != value else str(value)).astype("string")
+
+    for column in df.columns:
+        if column in columns or df[column].dtype != object:
+            continue
+        kinds = {type(value) for value in df[column] if value is not None and value == value}
+        if kinds and kinds <= {list}:
+            # Lists of scalars (e.g. agent skills) stay lists so SQL can use list_contains()
+            df[column] = df[column].map(lambda value: [str(item) for item in value] if isinstance(value, list) else None)
+        elif kinds & {dict, list} or len(kinds) > 1:
+            # Sub-documents (ai_triage, ...) and mixed-type fields are kept as JSON text
+            df[column] = df[column].map(lambda value: None if value is None or value != value
+                                        else value if isinstance(value, str) else json.dumps(value, default=str))
+    return df
+
+
+class AnalyticsEngine:
+    """Parquet snapshots of the operational collections, queried with DuckDB"""
+
+    def __init__(self, snapshot_dir: str = SNAPSHOT_DIR):
+        """Initialize the engine over a snapshot directory"""
+        self.snapshot_dir = snapshot_dir
+        self.manifest_path = os.path.join(snapshot_dir, "manifest.json")
+        self._lock = threading.Lock()
+
+    def get_manifest(self) -> Dict:
+        """Snapshot name -> source version, row count and export time"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest: Dict):
+        """Persist the manifest atomically"""
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _snapshot_path(self, name: str) -> str:
+        """Directory holding a snapshot's Parquet files"""
+        return os.path.join(self.snapshot_dir, name)
+
+    def export_snapshot(self, name: str) -> Dict:
+        """Write a collection to a fresh Parquet snapshot, batch by batch, and swap it in"""
+        definition = SNAPSHOTS[name]
+        collection = data_ingest_manager.db[definition["collection"]]
+        version = data_ingest_manager.get_collection_version(definition["collection"])
+        target = self._snapshot_path(name)
+        staging = f"{target}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        started = time.perf_counter()
+        rows = 0
+        connection = duckdb.connect()
+        try:
+            cursor = collection.find({}, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE)
+            batch_number = 0
+            while True:
+                batch = [document for _, document in zip(range(EXPORT_BATCH_SIZE), cursor)]
+                if not batch:
+                    break
+                frame = _normalise_frame(pd.DataFrame(batch), definition["columns"])
+                if "created_on" in definition["columns"]:
+                    frame["created_year"] = frame["created_on"].dt.year.astype("Int64")
+                    frame["created_month"] = frame["created_on"].dt.month.astype("Int64")
+                connection.register("batch_frame", frame)
+                if definition["partition_by"]:
+                    connection.execute(
+                        f"COPY batch_frame TO '{staging}' (FORMAT PARQUET, PARTITION_BY ({', '.join(definition['partition_by'])}), "
+                        "FILENAME_PATTERN 'part_{uuid}', APPEND)")
+                else:
+                    connection.execute(f"COPY batch_frame TO '{os.path.join(staging, f'batch{batch_number}.parquet')}' (FORMAT PARQUET)")
+                connection.unregister("batch_frame")
+                rows += len(frame)
+                batch_number += 1
+        finally:
+            connection.close()
+
+        # Swap the new snapshot in; readers opening files mid-swap retry against the new one
+        previous = f"{target}.old"
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(target):
+            os.replace(target, previous)
+        os.replace(staging, target)
+        shutil.rmtree(previous, ignore_errors=True)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Exported {rows} {name} to Parquet in {elapsed_ms:.0f}ms")
+        return {"version": version, "rows": rows, "exported_at": datetime.utcnow().isoformat(), "elapsed_ms": elapsed_ms}
+
+    def refresh_snapshots(self, names: Optional[List[str]] = None, force: bool = False) -> Dict:
+        """
+        Export snapshots whose source collection changed since the last export
+
+        Args:
+            names: Snapshots to refresh (defaults to all)
+            force: Export even when the collection version is unchanged
+
+        Returns:
+            Dict with success, and per-snapshot manifest entries under "snapshots" (exported ones flagged)
+        """
+        if not data_ingest_manager.is_available():
+            return {"success": False, "error": "MongoDB not available"}
+
+        with self._lock:
+            try:
+                os.makedirs(self.snapshot_dir, exist_ok=True)
+                manifest = self.get_manifest()
+                exported = []
+                for name in names or list(SNAPSHOTS):
+                    version = data_ingest_manager.get_collection_version(SNAPSHOTS[name]["collection"])
+                    current = manifest.get(name)
+                    # Unversioned collections (e.g. KB articles) are re-exported every time
+                    if (not force and current and version is not None and current.get("version") == version
+                            and os.path.isdir(self._snapshot_path(name))):
+                        continue
+                    manifest[name] = self.export_snapshot(name)
+                    exported.append(name)
+                self._save_manifest(manifest)
+                return {"success": True, "exported": exported, "snapshots": manifest}
+
+            except Exception as e:
+                logger.error(f"Failed to export analytics snapshots: {str(e)}")
+                return {"success": False, "error": str(e)}
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        """Sandboxed in-memory DuckDB connection with a view per available snapshot"""
+        connection = duckdb.connect()
+        snapshot_dir = os.path.join(os.path.abspath(self.snapshot_dir), "")
+        for name in SNAPSHOTS:
+            path = self._snapshot_path(name)
+            if os.path.isdir(path) and any(True for _, _, files in os.walk(path) for file in files if file.endswith(".parquet")):
+                connection.execute(
+                    f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{path}/**/*.parquet', "
+                    f"hive_partitioning = true, union_by_name = true)")
+            else:
+                connection.execute(f"CREATE VIEW {name} AS SELECT NULL::VARCHAR AS missing_snapshot WHERE false")
+        # Queries may read the snapshots and nothing else on disk, and cannot lift that restriction
+        connection.execute(f"SET allowed_directories = ['{snapshot_dir}']")
+        connection.execute("SET enable_external_access = false")
+        connection.execute("SET lock_configuration = true")
+        return connection
+
+    def query(self, sql: str, max_rows: int = DEFAULT_MAX_ROWS) -> Dict:
+        """
+        Run one read-only SQL statement against the snapshots
+
+        Args:
+            sql: A single SELECT (or WITH ... SELECT) statement over incidents, agents and kb_articles
+            max_rows: Rows returned at most
+
+        Returns:
+            Dict with success, the result DataFrame, whether it was truncated and elapsed_ms
+        """
+        started = time.perf_counter()
+        connection = None
+        try:
+            connection = self._connect()
+            statements = connection.extract_statements(sql)
+            if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+                return {"success": False, "error": "Only a single SELECT statement can be run"}
+            df = connection.sql(statements[0].query).limit(max_rows + 1).df()
+            return {"success": True, "data": df.head(max_rows), "truncated": len(df) > max_rows,
+                    "elapsed_ms": (time.perf_counter() - started) * 1000}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def run_view(self, view: str, max_rows: int = DEFAULT_MAX_ROWS) -> Dict:
+        """Run one of the predefined analytics views"""
+        return self.query(ANALYTICS_VIEWS[view], max_rows=max_rows)
+
+    def describe(self) -> pd.DataFrame:
+        """Columns and types of every snapshot view"""
+        rows = []
+        connection = self._connect()
+        try:
+            for name in SNAPSHOTS:
+                for column, column_type, *_ in connection.execute(f"DESCRIBE {name}").fetchall():
+                    rows.append({"table": name, "column": column, "type": column_type})
+        except Exception as e:
+            logger.error(f"Failed to describe analytics snapshots: {str(e)}")
+        finally:
+            connection.close()
+        return pd.DataFrame(rows, columns=["table", "column", "type"])
+
+
+# Global instance
+analytics_engine = AnalyticsEngine()
@@ -0,0 +1,310 @@
+"""
+UC-31 local assignment engine
+Scores every open incident against every agent with NumPy (skill match from the incident's
+category, current queue load and status) and solves the whole queue at once as a
+capacity-constrained assignment - optimally with the Hungarian algorithm, or greedily by
+priority when the problem is too large
+"""
+import time
+import logging
+from typing import Dict, List
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from utils.data_ingest import data_ingest_manager
+
+logger = logging.getLogger(__name__)
+
+# Queue length at which an agent is full (matches the 0-5 scale of generated agents)
+AGENT_CAPACITY = 5
+
+# How much of an agent's free capacity counts, by status
+STATUS_AVAILABILITY = {"Available": 1.0, "Busy": 0.5}
+
+PRIORITY_WEIGHTS = {"P1": 4.0, "P2": 3.0, "P3": 2.0, "P4": 1.0}
+DEFAULT_PRIORITY_WEIGHT = 2.0
+
+# Keywords in an incident's category (or title, when the category says nothing) -> agent skills
+CATEGORY_SKILL_KEYWORDS = {
+    "password": ["Security & Authentication"],
+    "account": ["Security & Authentication"],
+    "lockout": ["Security & Authentication"],
+    "authentication": ["Security & Authentication"],
+    "mfa": ["Security & Authentication", "Mobile Device Support"],
+    "vpn": ["VPN & Remote Access", "Networking"],
+    "remote": ["VPN & Remote Access"],
+    "wifi": ["Networking"],
+    "wi-fi": ["Networking"],
+    "network": ["Networking"],
+    "printer": ["Printer & Peripherals", "Hardware Support"],
+    "print": ["Printer & Peripherals"],
+    "email": ["Email & Communication"],
+    "outlook": ["Email & Communication"],
+    "phone": ["Email & Communication", "Mobile Device Support"],
+    "mobile": ["Mobile Device Support"],
+    "software": ["Software Support"],
+    "installation": ["Software Support"],
+    "application": ["Software Support", "Application Development"],
+    "file share": ["System Administration"],
+    "access": ["System Administration"],
+    "hardware": ["Hardware Support"],
+    "laptop": ["Hardware Support"],
+    "performance": ["System Administration"],
+    "server": ["System Administration"],
+    "database": ["Database Administration"],
+    "cloud": ["Cloud Services"],
+    "web": ["Web Technologies"],
+    "backup": ["Backup & Recovery"],
+    "restore": ["Backup & Recovery"]
+}
+FALLBACK_SKILL = "General ICT Support"
+
+# Score weights: skill match dominates, spare capacity breaks ties towards lighter queues
+SKILL_WEIGHT = 0.7
+LOAD_WEIGHT = 0.3
+# Assignments scoring below this (e.g. no matching skill and a busy agent) are left for a human
+MIN_ASSIGNMENT_SCORE = 0.2
+# Largest incidents x agent-slots matrix solved optimally; beyond it the greedy solver is used
+HUNGARIAN_MAX_CELLS = 5_000_000
+# Agents offered to the LLM for a final choice, so prompt size does not grow with the roster
+ASSIGNMENT_CANDIDATES = 8
+
+OPEN_UNASSIGNED_FILTER = {
+    "status": {"$in": ["Open", "In Progress", "Assigned"]},
+    "$or": [{"assigned_to": {"$exists": False}}, {"assigned_to": None}, {"assigned_to": ""}]
+}
+ENGINE_INCIDENT_PROJECTION = {"_id": 0, "incident_id": 1, "title": 1, "category": 1, "priority": 1}
+
+
+def _agent_skills(agent: Dict) -> List[str]:
+    """An agent's skills as a list, however they were stored"""
+    skills = agent.get("skills", [])
+    if isinstance(skills, str):
+        return [skill.strip() for skill in skills.split(",") if skill.strip()]
+    if isinstance(skills, (list, tuple, np.ndarray)):
+        return [str(skill) for skill in skills]
+    return []
+
+
+def _queue_length(agent: Dict) -> float:
+    """An agent's current queue length (0 when unknown)"""
+    try:
+        value = float(agent.get("current_queue") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if np.isnan(value) else value
+
+
+def describe_workload(agent: Dict, capacity: int = AGENT_CAPACITY) -> str:
+    """An agent's queue load and status as the assignment prompt describes it"""
+    queue_load = int(_queue_length(agent))
+    if queue_load >= capacity:
+        availability = f"FULL ({queue_load}/{capacity} - Cannot take new assignments)"
+    elif queue_load >= capacity - 1:
+        availability = f"BUSY ({queue_load}/{capacity} - Limited capacity)"
+    elif queue_load >= 2:
+        availability = f"MODERATE ({queue_load}/{capacity} - Available)"
+    else:
+        availability = f"AVAILABLE ({queue_load}/{capacity} - Good capacity)"
+
+    status = agent.get("status", "Unknown")
+    if status != "Available":
+        availability += f" - Status: {status}"
+    return availability
+
+
+def required_skills(incident: Dict) -> List[str]:
+    """Agent skills an incident needs, from keywords in its category (falling back to its title)"""
+    category = str(incident.get("category") or "").lower()
+    skills = []
+    for text in (category, str(incident.get("title") or "").lower()):
+        for keyword, keyword_skills in CATEGORY_SKILL_KEYWORDS.items():
+            if keyword in text:
+                skills.extend(skill for skill in keyword_skills if skill not in skills)
+        if skills:
+            break
+    return skills or [FALLBACK_SKILL]
+
+
+class AssignmentEngine:
+    """Deterministic incident-to-agent scoring and batch assignment"""
+
+    def __init__(self, capacity: int = AGENT_CAPACITY, min_score: float = MIN_ASSIGNMENT_SCORE):
+        """Initialize the engine"""
+        self.capacity = capacity
+        self.min_score = min_score
+
+    def _agent_arrays(self, agents: List[Dict], vocabulary: Dict[str, int]):
+        """Agent skill matrix (agents x skills), queue lengths and status availability"""
+        skills = np.zeros((len(agents), len(vocabulary)), dtype=np.float32)
+        for row, agent in enumerate(agents):
+            for skill in _agent_skills(agent):
+                if skill in vocabulary:
+                    skills[row, vocabulary[skill]] = 1.0
+        queue = np.array([_queue_length(agent) for agent in agents], dtype=np.float32)
+        availability = np.array([STATUS_AVAILABILITY.get(agent.get("status"), 0.0) for agent in agents], dtype=np.float32)
+        return skills, queue, availability
+
+    def score_matrix(self, incidents: List[Dict], agents: List[Dict]) -> Dict[str, np.ndarray]:
+        """
+        Score every incident against every agent
+
+        Returns:
+            Dict of arrays: score and skill_match (incidents x agents), free_slots and availability (agents),
+            priority_weight (incidents)
+        """
+        needs = [required_skills(incident) for incident in incidents]
+        vocabulary = {}
+        for skill in [skill for agent in agents for skill in _agent_skills(agent)] + [skill for need in needs for skill in need]:
+            vocabulary.setdefault(skill, len(vocabulary))
+
+        incident_skills = np.zeros((len(incidents), len(vocabulary)), dtype=np.float32)
+        for row, need in enumerate(needs):
+            incident_skills[row, [vocabulary[skill] for skill in need]] = 1.0
+        agent_skills, queue, availability = self._agent_arrays(agents, vocabulary)
+
+        # Fraction of each incident's required skills the agent has
+        skill_match = (incident_skills @ agent_skills.T) / np.maximum(incident_skills.sum(axis=1, keepdims=True), 1.0)
+        spare = np.clip(1.0 - queue / self.capacity, 0.0, 1.0) * availability
+        score = SKILL_WEIGHT * skill_match + LOAD_WEIGHT * spare[np.newaxis, :]
+
+        free_slots = np.where(availability > 0, np.clip(self.capacity - queue, 0, None), 0).astype(int)
+        score[:, free_slots == 0] = -np.inf
+
+        priority_weight = np.array([
+            PRIORITY_WEIGHTS.get(incident.get("priority"), DEFAULT_PRIORITY_WEIGHT)
+            for incident in incidents
+        ], dtype=np.float32)
+        return {"score": score, "skill_match": skill_match, "free_slots": free_slots,
+                "availability": availability, "priority_weight": priority_weight}
+
+    def rank_agents(self, incident: Dict, agents: List[Dict], k: int = 5) -> List[Dict]:
+        """Top-k agents for one incident with their scores (agents without capacity excluded)"""
+        if not agents:
+            return []
+        arrays = self.score_matrix([incident], agents)
+        scores = arrays["score"][0]
+        order = np.argsort(-scores)[:k]
+        return [{
+            "agent": agents[j],
+            "score": float(scores[j]),
+            "skill_match": float(arrays["skill_match"][0, j]),
+            "free_slots": int(arrays["free_slots"][j])
+        } for j in order if np.isfinite(scores[j])]
+
+    def candidate_roster(self, incident: Dict, agents: List[Dict], k: int = ASSIGNMENT_CANDIDATES) -> List[str]:
+        """Prompt lines for the top-k locally ranked agents, with their match scores"""
+        return self.roster_lines(self.rank_agents(incident, agents, k))
+
+    def roster_lines(self, candidates: List[Dict]) -> List[str]:
+        """Prompt lines for agents already ranked by rank_agents"""
+        roster = []
+        for candidate in candidates:
+            agent = candidate["agent"]
+            skills_str = ', '.join(_agent_skills(agent)) or 'No specific skills listed'
+            roster.append(f"- {agent.get('name', 'Unknown')}: Skills: [{skills_str}], "
+                          f"Workload: {describe_workload(agent, self.capacity)}, "
+                          f"Match score: {candidate['score']:.2f} (skill match {candidate['skill_match']:.0%})")
+        return roster
+
+    def _solve_hungarian(self, arrays: Dict[str, np.ndarray]) -> List[tuple]:
+        """Optimal assignment over agent capacity slots; each later slot of an agent scores as if its queue were longer"""
+        score, free_slots = arrays["score"], arrays["free_slots"]
+        slot_agents = np.repeat(np.arange(len(free_slots)), free_slots)
+        slot_index = np.concatenate([np.arange(slots) for slots in free_slots]) if len(slot_agents) else np.zeros(0, dtype=int)
+        if not len(slot_agents):
+            return []
+
+        # Filling a slot lowers that agent's spare capacity for the next one
+        slot_penalty = LOAD_WEIGHT * arrays["availability"][slot_agents] * slot_index / self.capacity
+        slot_score = score[:, slot_agents] - slot_penalty[np.newaxis, :]
+        weighted = slot_score * arrays["priority_weight"][:, np.newaxis]
+        weighted[~np.isfinite(weighted)] = -1e9
+
+        rows, columns = linear_sum_assignment(weighted, maximize=True)
+        return [(i, slot_agents[c], slot_score[i, c]) for i, c in zip(rows, columns)]
+
+    def _solve_greedy(self, arrays: Dict[str, np.ndarray]) -> List[tuple]:
+        """Highest-priority incidents first, each to its best agent with capacity left"""
+        score, priority_weight = arrays["score"].copy(), arrays["priority_weight"]
+        free_slots = arrays["free_slots"].copy()
+        best = score.max(axis=1) if score.shape[1] else np.zeros(len(score))
+        order = np.lexsort((-best, -priority_weight))
+
+        assignments = []
+        for i in order:
+            j = int(np.argmax(score[i]))
+            if not np.isfinite(score[i, j]):
+                continue
+            assignments.append((i, j, score[i, j]))
+            free_slots[j] -= 1
+            if free_slots[j] == 0:
+                score[:, j] = -np.inf
+            else:
+                score[:, j] -= LOAD_WEIGHT * arrays["availability"][j] / self.capacity
+        return assignments
+
+    def solve(self, incidents: List[Dict], agents: List[Dict], method: str = "auto") -> Dict:
+        """
+        Assign a batch of incidents to agents within each agent's free capacity
+
+        Args:
+            incidents: Incidents to assign
+            agents: Agent roster (skills, current_queue, status)
+            method: "hungarian", "greedy" or "auto" (Hungarian unless the problem is too large)
+
+        Returns:
+            Dict with assignments (incident_id, agent_id, agent_name, score, skill_match),
+            unassigned incident ids, the method used and elapsed_ms
+        """
+        started = time.perf_counter()
+        if not incidents or not agents:
+            return {"assignments": [], "unassigned": [incident.get("incident_id") for incident in incidents],
+                    "method": method, "elapsed_ms": 0.0}
+
+        arrays = self.score_matrix(incidents, agents)
+        if method == "auto":
+            cells = len(incidents) * int(arrays["free_slots"].sum())
+            method = "hungarian" if cells <= HUNGARIAN_MAX_CELLS else "greedy"
+        pairs = self._solve_hungarian(arrays) if method == "hungarian" else self._solve_greedy(arrays)
+
+        assignments = []
+        assigned_rows = set()
+        for i, j, pair_score in pairs:
+            if pair_score < self.min_score:
+                continue
+            assigned_rows.add(i)
+            assignments.append({
+                "incident_id": incidents[i].get("incident_id"),
+                "agent_id": agents[j].get("agent_id") or agents[j].get("user_id"),
+                "agent_name": agents[j].get("name", "Unknown"),
+                "score": round(float(pair_score), 4),
+                "skill_match": round(float(arrays["skill_match"][i, j]), 4)
+            })
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Assigned {len(assignments)}/{len(incidents)} incidents to {len(agents)} agents "
+                    f"({method}) in {elapsed_ms:.0f}ms")
+        return {
+            "assignments": assignments,
+            "unassigned": [incident.get("incident_id") for i, incident in enumerate(incidents) if i not in assigned_rows],
+            "method": method,
+            "elapsed_ms": elapsed_ms
+        }
+
+    def solve_open_queue(self, method: str = "auto") -> Dict:
+        """Solve the assignment for every open, unassigned incident against the full agent roster"""
+        if not data_ingest_manager.is_available():
+            return {"assignments": [], "unassigned": [], "method": method, "elapsed_ms": 0.0}
+        try:
+            incidents = list(data_ingest_manager.incidents_collection.find(OPEN_UNASSIGNED_FILTER, ENGINE_INCIDENT_PROJECTION))
+            agents = list(data_ingest_manager.agents_collection.find({}, {"_id": 0}))
+            return self.solve(incidents, agents, method)
+        except Exception as e:
+            logger.error(f"Failed to solve open queue assignment: {str(e)}")
+            return {"assignments": [], "unassigned": [], "method": method, "elapsed_ms": 0.0, "error": str(e)}
+
+
+# Global instance
+assignment_engine = AssignmentEngine()
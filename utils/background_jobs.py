@@ -0,0 +1,204 @@
+"""
+Background job runner for long AI workloads
+Runs jobs in daemon threads outside the Streamlit rerun cycle, with job state and
+progress persisted in MongoDB so the UI can poll it and interrupted jobs can resume
+"""
+import os
+import uuid
+import socket
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+
+from utils.data_ingest import data_ingest_manager
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ["queued", "running"]
+
+
+class JobContext:
+    """Handle given to a job handler for reporting progress and checking for cancellation"""
+
+    def __init__(self, manager: "BackgroundJobManager", job: Dict):
+        self.manager = manager
+        self.job = job
+        self.job_id = job["_id"]
+        self.params = job.get("params", {})
+
+    def update(self, inc: Optional[Dict] = None, set_fields: Optional[Dict] = None):
+        """Increment counters and/or set fields on the job document (also heartbeats)"""
+        update = {"$set": {"heartbeat_at": datetime.utcnow(), "updated_at": datetime.utcnow()}}
+        if set_fields:
+            update["$set"].update(set_fields)
+        if inc:
+            update["$inc"] = inc
+        self.manager.collection.update_one({"_id": self.job_id}, update)
+
+    def is_cancelled(self) -> bool:
+        """Check if a cancel was requested for this job"""
+        job = self.manager.collection.find_one({"_id": self.job_id}, {"cancel_requested": 1})
+        return bool(job and job.get("cancel_requested"))
+
+
+class BackgroundJobManager:
+    """Starts, tracks and resumes background jobs"""
+
+    HEARTBEAT_STALE_SECONDS = 120
+
+    def __init__(self):
+        """Initialize the job manager"""
+        self.handlers: Dict[str, Callable[[JobContext], None]] = {}
+        self.threads: Dict[str, threading.Thread] = {}
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+
+        if data_ingest_manager.is_available():
+            self.collection = data_ingest_manager.db.background_jobs
+            try:
+                self.collection.create_index([("job_type", 1), ("created_at", -1)])
+            except Exception as e:
+                logger.warning(f"Could not create background job index: {str(e)}")
+        else:
+            self.collection = None
+
+    def is_available(self) -> bool:
+        """Check if jobs can be persisted"""
+        return self.collection is not None
+
+    def register(self, job_type: str, handler: Callable[[JobContext], None]):
+        """Register the handler that runs jobs of a given type"""
+        self.handlers[job_type] = handler
+
+    def start_job(self, job_type: str, params: Optional[Dict] = None, total: int = 0) -> Optional[str]:
+        """Create and start a job, or return the id of the job of this type already running"""
+        if not self.is_available() or job_type not in self.handlers:
+            return None
+
+        try:
+            # A job left behind by a dead process is resumed rather than duplicated
+            self.resume_interrupted_jobs(job_type)
+            active = self.get_active_job(job_type)
+            if active:
+                logger.info(f"{job_type} job {active['_id']} is already active")
+                return active["_id"]
+
+            now = datetime.utcnow()
+            job_id = f"{job_type}_{now.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+            self.collection.insert_one({
+                "_id": job_id,
+                "job_type": job_type,
+                "status": "queued",
+                "params": params or {},
+                "total": total,
+                "processed": 0,
+                "succeeded": 0,
+                "failed": 0,
+                "cost": {"requests": 0, "input_tokens": 0, "output_tokens": 0},
+                "created_at": now,
+                "updated_at": now,
+                "heartbeat_at": now,
+                "cancel_requested": False
+            })
+            self._launch(job_id)
+            return job_id
+
+        except Exception as e:
+            logger.error(f"Failed to start {job_type} job: {str(e)}")
+            return None
+
+    def _launch(self, job_id: str):
+        """Run a job in a daemon thread"""
+        with self._lock:
+            thread = threading.Thread(target=self._run, args=(job_id,), name=f"job-{job_id}", daemon=True)
+            self.threads[job_id] = thread
+            thread.start()
+
+    def _run(self, job_id: str):
+        """Claim the job, run its handler and record the outcome"""
+        now = datetime.utcnow()
+        job = self.collection.find_one_and_update(
+            {"_id": job_id},
+            {"$set": {"status": "running", "owner": self.owner, "heartbeat_at": now, "updated_at": now},
+             "$min": {"started_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return
+
+        context = JobContext(self, job)
+        try:
+            self.handlers[job["job_type"]](context)
+            final_status = "cancelled" if context.is_cancelled() else "completed"
+            self.collection.update_one({"_id": job_id}, {"$set": {
+                "status": final_status, "finished_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+            }})
+            logger.info(f"Background job {job_id} {final_status}")
+        except Exception as e:
+            logger.error(f"Background job {job_id} failed: {str(e)}")
+            self.collection.update_one({"_id": job_id}, {"$set": {
+                "status": "failed", "error": str(e), "finished_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+            }})
+        finally:
+            with self._lock:
+                self.threads.pop(job_id, None)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Get a job document"""
+        if not self.is_available():
+            return None
+        return self.collection.find_one({"_id": job_id})
+
+    def get_active_job(self, job_type: str) -> Optional[Dict]:
+        """Get the queued or running job of a type, if any"""
+        if not self.is_available():
+            return None
+        return self.collection.find_one({"job_type": job_type, "status": {"$in": ACTIVE_STATUSES}})
+
+    def get_recent_jobs(self, job_type: str, limit: int = 5) -> List[Dict]:
+        """Get the most recent jobs of a type"""
+        if not self.is_available():
+            return []
+        return list(self.collection.find({"job_type": job_type}).sort("created_at", -1).limit(limit))
+
+    def request_cancel(self, job_id: str) -> bool:
+        """Ask a running job to stop at its next checkpoint"""
+        if not self.is_available():
+            return False
+        result = self.collection.update_one(
+            {"_id": job_id, "status": {"$in": ACTIVE_STATUSES}},
+            {"$set": {"cancel_requested": True, "updated_at": datetime.utcnow()}}
+        )
+        return result.modified_count > 0
+
+    def resume_interrupted_jobs(self, job_type: str) -> List[str]:
+        """Restart jobs of a type whose owning process stopped heartbeating"""
+        if not self.is_available() or job_type not in self.handlers:
+            return []
+
+        resumed = []
+        stale_before = datetime.utcnow() - timedelta(seconds=self.HEARTBEAT_STALE_SECONDS)
+        try:
+            while True:
+                # Atomically claim one stale job so only one process resumes it
+                job = self.collection.find_one_and_update(
+                    {"job_type": job_type, "status": {"$in": ACTIVE_STATUSES},
+                     "cancel_requested": {"$ne": True}, "heartbeat_at": {"$lt": stale_before}},
+                    {"$set": {"owner": self.owner, "heartbeat_at": datetime.utcnow()},
+                     "$inc": {"resume_count": 1}}
+                )
+                if not job:
+                    break
+                logger.info(f"Resuming interrupted background job {job['_id']}")
+                self._launch(job["_id"])
+                resumed.append(job["_id"])
+        except Exception as e:
+            logger.error(f"Failed to resume {job_type} jobs: {str(e)}")
+
+        return resumed
+
+
+# Global instance
+background_job_manager = BackgroundJobManager()
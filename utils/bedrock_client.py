@@ -1,12 +1,18 @@
 import boto3
 import json
 import os
+import re
+import time
+import hashlib
 import logging
-from typing import Dict, List, Optional
+import threading
+from typing import Dict, List, Optional, Tuple
 import streamlit as st
 from dotenv import load_dotenv
 from botocore.exceptions import ClientError
 
+from utils.assignment_engine import assignment_engine, required_skills
+
 # Load environment variables
 load_dotenv()
 
@@ -14,11 +20,155 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Shared UC-02 priority rubric - sent once per request, not once per incident
+PRIORITY_RUBRIC = """Priority Levels:
+- P1: Critical - System down, major business impact
+- P2: High - Significant impact, workaround available
+- P3: Medium - Moderate impact, standard response
+- P4: Low - Minor impact, can be scheduled"""
+
+VALID_PRIORITIES = ["P1", "P2", "P3", "P4"]
+
+# Converse tool used to force a JSON-schema shaped triage response
+TRIAGE_TOOL_NAME = "record_incident_priorities"
+TRIAGE_TOOL_SPEC = {
+    "toolSpec": {
+        "name": TRIAGE_TOOL_NAME,
+        "description": "Record the priority classification for every incident in the request.",
+        "inputSchema": {
+            "json": {
+                "type": "object",
+                "properties": {
+                    "results": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "incident_id": {"type": "string"},
+                                "priority": {"type": "string", "enum": VALID_PRIORITIES},
+                                "reasoning": {"type": "string"},
+                                "confidence": {"type": "number", "minimum": 0, "maximum": 1}
+                            },
+                            "required": ["incident_id", "priority", "reasoning"]
+                        }
+                    }
+                },
+                "required": ["results"]
+            }
+        }
+    }
+}
+
+# Token budgeting for batched triage (rough 4 characters per token estimate)
+TRIAGE_CHARS_PER_TOKEN = 4
+TRIAGE_OUTPUT_TOKENS_PER_INCIDENT = 80
+TRIAGE_MAX_DESCRIPTION_CHARS = 1000
+
+# Admission control for concurrent callers (background jobs share one client)
+MAX_CONCURRENT_REQUESTS = int(os.getenv('BEDROCK_MAX_CONCURRENCY', '4'))
+THROTTLE_RETRIES = 3
+
+
+def normalize_priority(value) -> Optional[str]:
+    """Extract P1-P4 from a model supplied priority string"""
+    match = re.search(r'P[1-4]', str(value or '').upper())
+    return match.group() if match else None
+
+
+def triage_prompt_fingerprint(system_prompt: Optional[str]) -> str:
+    """Short hash identifying the triage instructions a result was produced with"""
+    payload = json.dumps([system_prompt or "", PRIORITY_RUBRIC, TRIAGE_TOOL_SPEC], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+# UC-31 dashboard assignment prompt (agent lines are rendered by the caller)
+ASSIGNMENT_PROMPT_TEMPLATE = """Analyze this incident and recommend the best agent for assignment.
+
+Incident Details:
+Title: {title}
+Description: {description}
+Category: {category}
+
+Candidate Agents (pre-selected from the full roster, best local match first):
+{agents}
+
+Assignment Rules:
+1. Match agent skills to incident requirements
+2. Consider current workload - do NOT assign to agents marked as FULL
+3. Prefer agents with AVAILABLE or MODERATE workload
+4. If no suitable agent is available due to workload, recommend leaving unassigned
+5. Consider agent status (Available vs Away/Busy)
+6. The match score combines skill match and spare capacity - use it as a guide, but choose on the incident details
+
+Respond with:
+Recommended Agent: [Agent name or "UNASSIGNED"]
+Reasoning: [Brief explanation of why this agent was chosen or why leaving unassigned]
+Confidence: [High/Medium/Low]
+"""
+
+
+def assignment_prompt_fingerprint(system_prompt: Optional[str]) -> str:
+    """Short hash identifying the assignment instructions a result was produced with"""
+    payload = json.dumps([system_prompt or "", ASSIGNMENT_PROMPT_TEMPLATE])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def parse_assignment_response(response: str) -> Dict[str, str]:
+    """Parse a 'Recommended Agent / Reasoning / Confidence' response"""
+    recommended_agent = "UNASSIGNED"
+    reasoning = "Unable to determine"
+    confidence = "Low"
+    sections = ('Recommended Agent:', 'Confidence:', 'Summary:')
+
+    lines = [line.strip() for line in response.split('\n')]
+
+    for line in lines:
+        if line.startswith('Recommended Agent:'):
+            recommended_agent = line.split(':', 1)[1].strip()
+            break
+
+    # Reasoning may span several lines until the next section
+    reasoning_found = False
+    reasoning_lines = []
+    for line in lines:
+        if line.startswith('Reasoning:'):
+            reasoning_found = True
+            after_colon = line.split(':', 1)[1].strip()
+            if after_colon:
+                reasoning_lines.append(after_colon)
+        elif reasoning_found and line:
+            if line.startswith(sections):
+                break
+            reasoning_lines.append(line)
+
+    if reasoning_lines:
+        reasoning = '\n'.join(reasoning_lines).strip()
+    elif 'Reasoning:' in response:
+        # Reasoning label not at the start of a line (e.g. markdown bold)
+        after_reasoning = response.split('Reasoning:', 1)[1]
+        cut = min([after_reasoning.find(section) for section in sections if section in after_reasoning],
+                  default=len(after_reasoning))
+        reasoning = after_reasoning[:cut].strip(' *\n') or reasoning
+    elif 'Recommended Agent:' in response:
+        # Fall back to everything after the recommended agent line
+        agent_lines = response.split('Recommended Agent:', 1)[1].split('\n')
+        if len(agent_lines) > 1:
+            reasoning = '\n'.join(agent_lines[1:]).strip() or reasoning
+
+    for line in lines:
+        if line.startswith('Confidence:'):
+            confidence = line.split(':', 1)[1].strip()
+            break
+
+    return {"agent": recommended_agent, "reasoning": reasoning, "confidence": confidence}
+
+
 class BedrockClient:
     """AWS Bedrock client for ITSM AI inference capabilities"""
 
     def __init__(self):
         """Initialize Bedrock client following AWS best practices"""
+        self._admission = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
         self._initialize_client()
 
     def _initialize_client(self):
@@ -363,7 +513,7 @@ class BedrockClient:
             if system_prompt:
                 converse_params["system"] = [{"text": system_prompt}]
 
-            response = self.bedrock_runtime.converse(**converse_params)
+            response = self._converse_with_admission(converse_params)
 
             # Extract response text
             response_text = response["output"]["message"]["content"][0]["text"]
@@ -376,6 +526,117 @@ class BedrockClient:
             logger.error(f"Unexpected error in Converse API: {str(e)}")
             raise
 
+    def invoke_model_with_usage(self, prompt: str, model_id: str, max_tokens: int = 1000, temperature: float = 0.7,
+                                system_prompt: Optional[str] = None) -> Tuple[Optional[str], Dict]:
+        """
+        Same as invoke_model through the Converse API only, but also returns the request usage
+        (requests, input_tokens, output_tokens, latency_ms). Never writes to the page, so it is
+        safe to call from background jobs.
+        """
+        usage = {"requests": 0, "input_tokens": 0, "output_tokens": 0, "latency_ms": 0}
+        if not self.is_available():
+            return None, usage
+
+        for attempt_model_id in dict.fromkeys([model_id, self._get_inference_profile_id(model_id)]):
+            converse_params = {
+                "modelId": attempt_model_id,
+                "messages": [{"role": "user", "content": [{"text": prompt}]}],
+                "inferenceConfig": {
+                    "maxTokens": max_tokens,
+                    "temperature": temperature,
+                    "topP": 0.9
+                }
+            }
+            if system_prompt:
+                converse_params["system"] = [{"text": system_prompt}]
+
+            usage["requests"] += 1
+            try:
+                response = self._converse_with_admission(converse_params)
+                usage["input_tokens"] += response.get("usage", {}).get("inputTokens", 0)
+                usage["output_tokens"] += response.get("usage", {}).get("outputTokens", 0)
+                usage["latency_ms"] += response.get("metrics", {}).get("latencyMs", 0)
+                return response["output"]["message"]["content"][0]["text"].strip(), usage
+            except Exception as e:
+                logger.warning(f"Converse API failed for {attempt_model_id}: {str(e)}")
+
+        return None, usage
+
+    def _converse_with_admission(self, converse_params: Dict) -> Dict:
+        """
+        Call Converse while holding an admission slot, so concurrent callers never
+        exceed MAX_CONCURRENT_REQUESTS, retrying throttled requests with backoff
+        """
+        for attempt in range(THROTTLE_RETRIES + 1):
+            with self._admission:
+                try:
+                    return self.bedrock_runtime.converse(**converse_params)
+                except ClientError as e:
+                    error_code = e.response.get("Error", {}).get("Code", "")
+                    if error_code not in ("ThrottlingException", "TooManyRequestsException") or attempt == THROTTLE_RETRIES:
+                        raise
+            delay = 2 ** attempt
+            logger.warning(f"Bedrock throttled request, retrying in {delay}s")
+            time.sleep(delay)
+
+    def _converse_with_tool(self, prompt: str, model_id: str, tool_spec: Dict, max_tokens: int, temperature: float, system_prompt: Optional[str] = None) -> Optional[Dict]:
+        """
+        Use the Converse API with a forced tool call to get structured JSON output.
+
+        Returns:
+            Dictionary with the tool "input" and the request "usage", or None if
+            no attempt produced a tool call
+        """
+        if not self.is_available():
+            return None
+
+        tool_name = tool_spec["toolSpec"]["name"]
+
+        for attempt_model_id in dict.fromkeys([model_id, self._get_inference_profile_id(model_id)]):
+            converse_params = {
+                "modelId": attempt_model_id,
+                "messages": [{"role": "user", "content": [{"text": prompt}]}],
+                "inferenceConfig": {
+                    "maxTokens": max_tokens,
+                    "temperature": temperature
+                },
+                "toolConfig": {
+                    "tools": [tool_spec],
+                    "toolChoice": {"tool": {"name": tool_name}}
+                }
+            }
+            if system_prompt:
+                converse_params["system"] = [{"text": system_prompt}]
+
+            try:
+                try:
+                    response = self._converse_with_admission(converse_params)
+                except ClientError as e:
+                    # Not every model supports forcing a specific tool
+                    if "toolChoice" not in str(e):
+                        raise
+                    converse_params["toolConfig"]["toolChoice"] = {"any": {}}
+                    response = self._converse_with_admission(converse_params)
+
+                for block in response["output"]["message"]["content"]:
+                    tool_use = block.get("toolUse")
+                    if tool_use and tool_use.get("name") == tool_name:
+                        return {
+                            "input": tool_use.get("input", {}),
+                            "usage": {
+                                "input_tokens": response.get("usage", {}).get("inputTokens", 0),
+                                "output_tokens": response.get("usage", {}).get("outputTokens", 0),
+                                "latency_ms": response.get("metrics", {}).get("latencyMs", 0)
+                            }
+                        }
+
+                logger.warning(f"Model {attempt_model_id} did not return a {tool_name} tool call")
+
+            except Exception as e:
+                logger.warning(f"Converse tool use failed for {attempt_model_id}: {str(e)}")
+
+        return None
+
     def _invoke_with_native_api(self, prompt: str, model_id: str, max_tokens: int, temperature: float) -> Optional[str]:
         """
         Use the native InvokeModel API (fallback method)
@@ -550,46 +811,204 @@ class BedrockClient:
         Returns:
             Dictionary with priority and reasoning
         """
-        prompt = f"""
-        You are an ITSM expert. Analyze this incident and determine its priority level.
-
-        Incident Title: {title}
-        Incident Description: {description}
+        results = self.classify_incidents_batch([
+            {"incident_id": "ADHOC", "title": title, "description": description}
+        ])
+        result = results.get("ADHOC", {"priority": "P3", "reasoning": "AI classification failed"})
+        return {"priority": result["priority"], "reasoning": result["reasoning"]}
+
+    def classify_incidents_batch(self, incidents: List[Dict], model_id: Optional[str] = None,
+                                 system_prompt: Optional[str] = None, temperature: float = 0.3,
+                                 token_budget: int = 6000, max_output_tokens: int = 4000) -> Dict[str, Dict]:
+        """
+        UC-02: Classify many incidents with as few model requests as possible
 
-        Priority Levels:
-        - P1: Critical - System down, major business impact
-        - P2: High - Significant impact, workaround available
-        - P3: Medium - Moderate impact, standard response
-        - P4: Low - Minor impact, can be scheduled
+        Args:
+            incidents: Incident dicts (or rows) with incident_id, title and description
+            model_id: Model to use (defaults to the configured model)
+            system_prompt: Optional triage system prompt (the rubric is always appended)
+            temperature: Sampling temperature
+            token_budget: Approximate input token budget per request for incident text
+            max_output_tokens: Upper bound on output tokens per request
 
-        Respond with:
-        Priority: [P1/P2/P3/P4]
-        Reasoning: [Brief explanation]
+        Returns:
+            Dictionary keyed by incident_id with priority, reasoning and confidence
+        """
+        results, _ = self.classify_incidents_batch_with_usage(
+            incidents, model_id, system_prompt, temperature, token_budget, max_output_tokens
+        )
+        return results
+
+    def classify_incidents_batch_with_usage(self, incidents: List[Dict], model_id: Optional[str] = None,
+                                            system_prompt: Optional[str] = None, temperature: float = 0.3,
+                                            token_budget: int = 6000, max_output_tokens: int = 4000) -> Tuple[Dict[str, Dict], Dict]:
+        """
+        Same as classify_incidents_batch, but also returns aggregated request usage
+        (requests, input_tokens, output_tokens, latency_ms)
         """
+        usage = {"requests": 0, "input_tokens": 0, "output_tokens": 0, "latency_ms": 0}
+
+        items = []
+        for incident in incidents:
+            item = self._build_triage_item(incident)
+            if item:
+                items.append(item)
+            else:
+                logger.warning("Skipping incident without incident_id in batched triage")
+
+        if not items:
+            return {}, usage
+
+        model_id = model_id or self._get_default_model_id()
+        if not model_id:
+            return {item["incident_id"]: self._triage_fallback("No models available") for item in items}, usage
+
+        results = {}
+        pending = items
+
+        # Second pass retries anything the model dropped from its answer
+        for _ in range(2):
+            missing = []
+            for chunk in self._chunk_triage_items(pending, token_budget, max_output_tokens):
+                chunk_results = self._classify_triage_chunk(chunk, model_id, system_prompt, temperature, max_output_tokens, usage)
+                for item in chunk:
+                    if item["incident_id"] in chunk_results:
+                        results[item["incident_id"]] = chunk_results[item["incident_id"]]
+                    else:
+                        missing.append(item)
+            pending = missing
+            if not pending:
+                break
+
+        for item in pending:
+            results[item["incident_id"]] = self._triage_fallback("AI classification failed")
+
+        logger.info(f"Batched triage classified {len(results)} incidents in {usage['requests']} requests")
+        return results, usage
+
+    def _get_default_model_id(self) -> Optional[str]:
+        """Get the globally configured model, falling back to the first available one"""
+        try:
+            from utils.settings_manager import settings_manager
+            model_id = settings_manager.get_setting("ai_model.selected_model_id")
+            if model_id:
+                return model_id
+        except Exception as e:
+            logger.warning(f"Could not read configured model: {str(e)}")
 
-        # Use first available model for classification
         available_models = self.get_available_models()
-        if not available_models:
-            return {"priority": "P3", "reasoning": "No models available"}
+        return list(available_models.keys())[0] if available_models else None
 
-        model_id = list(available_models.keys())[0]
-        response = self.invoke_model(prompt, model_id, max_tokens=200, temperature=0.3)
+    def _build_triage_item(self, incident: Dict) -> Optional[Dict]:
+        """Reduce an incident to the fields the triage prompt needs"""
+        incident_id = incident.get('incident_id')
+        if incident_id is None or str(incident_id) == '':
+            return None
 
-        if response:
-            lines = response.split('\n')
-            priority = "P3"  # Default
-            reasoning = "Unable to determine"
+        title = incident.get('title') or ''
+        description = str(incident.get('description') or '')[:TRIAGE_MAX_DESCRIPTION_CHARS]
+        return {"incident_id": str(incident_id), "title": str(title), "description": description}
+
+    def _chunk_triage_items(self, items: List[Dict], token_budget: int, max_output_tokens: int) -> List[List[Dict]]:
+        """Split triage items into requests that fit the input and output token budgets"""
+        max_per_request = max(1, (max_output_tokens - 100) // TRIAGE_OUTPUT_TOKENS_PER_INCIDENT)
+
+        chunks = []
+        current = []
+        current_tokens = 0
+        for item in items:
+            item_tokens = len(json.dumps(item)) // TRIAGE_CHARS_PER_TOKEN + 1
+            if current and (current_tokens + item_tokens > token_budget or len(current) >= max_per_request):
+                chunks.append(current)
+                current = []
+                current_tokens = 0
+            current.append(item)
+            current_tokens += item_tokens
+
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _classify_triage_chunk(self, chunk: List[Dict], model_id: str, system_prompt: Optional[str],
+                               temperature: float, max_output_tokens: int, usage: Dict) -> Dict[str, Dict]:
+        """Classify one chunk of incidents in a single request"""
+        triage_system_prompt = f"""{system_prompt or "You are an ITSM expert."}
+
+{PRIORITY_RUBRIC}
+
+For every incident return its priority, a one or two sentence reasoning and a confidence between 0 and 1."""
+
+        incidents_text = '\n'.join(json.dumps(item) for item in chunk)
+        prompt = f"""Classify the priority of each of the {len(chunk)} incidents below.
+Call the {TRIAGE_TOOL_NAME} tool once with exactly one result per incident, copying each incident_id unchanged.
+
+Incidents (one JSON object per line):
+{incidents_text}"""
+
+        max_tokens = min(max_output_tokens, 100 + TRIAGE_OUTPUT_TOKENS_PER_INCIDENT * len(chunk))
+
+        tool_response = self._converse_with_tool(
+            prompt, model_id, TRIAGE_TOOL_SPEC, max_tokens, temperature, system_prompt=triage_system_prompt
+        )
+        usage["requests"] += 1
+
+        if tool_response:
+            for key in ("input_tokens", "output_tokens", "latency_ms"):
+                usage[key] += tool_response["usage"].get(key, 0)
+            raw_results = tool_response["input"].get("results", [])
+        else:
+            # Models without tool use support get the same request as plain JSON
+            response = self.invoke_model(
+                prompt.replace(f"Call the {TRIAGE_TOOL_NAME} tool once with", "Respond with ONLY a JSON array containing")
+                + '\n\nEach element must be {"incident_id": ..., "priority": "P1-P4", "reasoning": ..., "confidence": 0-1}.',
+                model_id, max_tokens, temperature, system_prompt=triage_system_prompt
+            )
+            raw_results = self._parse_json_array(response)
+
+        chunk_ids = {item["incident_id"] for item in chunk}
+        results = {}
+        for raw in raw_results:
+            if not isinstance(raw, dict) or str(raw.get("incident_id")) not in chunk_ids:
+                continue
+            results[str(raw["incident_id"])] = {
+                "priority": normalize_priority(raw.get("priority")) or "P3",
+                "reasoning": str(raw.get("reasoning", "")).strip() or "No reasoning provided",
+                "confidence": self._clamp_confidence(raw.get("confidence"))
+            }
+        return results
 
-            for line in lines:
-                if line.startswith('Priority:'):
-                    priority = line.split(':')[1].strip()
-                elif line.startswith('Reasoning:'):
-                    reasoning = line.split(':', 1)[1].strip()
+    def _parse_json_array(self, response: Optional[str]) -> List[Dict]:
+        """Parse a JSON array from a text response, tolerating markdown fences"""
+        if not response:
+            return []
+
+        cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', response.strip())
+        try:
+            data = json.loads(cleaned)
+        except json.JSONDecodeError:
+            match = re.search(r'\[.*\]', cleaned, re.DOTALL)
+            if not match:
+                logger.error(f"Could not find JSON array in response: {cleaned[:200]}...")
+                return []
+            try:
+                data = json.loads(match.group())
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to parse JSON array: {str(e)}")
+                return []
 
-            return {"priority": priority, "reasoning": reasoning}
+        return data if isinstance(data, list) else []
+
+    def _clamp_confidence(self, value) -> float:
+        """Coerce a model supplied confidence into the 0-1 range"""
+        try:
+            return min(1.0, max(0.0, float(value)))
+        except (TypeError, ValueError):
+            return 0.5
+
+    def _triage_fallback(self, reason: str) -> Dict:
+        """Default triage result used when the model gives no answer"""
+        return {"priority": "P3", "reasoning": reason, "confidence": 0.0, "failed": True}
 
-        return {"priority": "P3", "reasoning": "AI classification failed"}
-    
     def generate_kb_article(self, incident_cluster: List[Dict]) -> Dict[str, str]:
         """
         UC-21: Generate KB article from incident cluster
@@ -603,7 +1022,7 @@ class BedrockClient:
         # Prepare incident summaries
         incident_summaries = []
         for incident in incident_cluster[:5]:  # Limit to 5 incidents
-            summary = f"- {incident.get('short_description', 'No description')}"
+            summary = f"- {incident.get('title', 'No description')}"
             if incident.get('resolution_notes'):
                 summary += f" (Resolved: {incident['resolution_notes']})"
             incident_summaries.append(summary)
@@ -672,34 +1091,25 @@ class BedrockClient:
         Returns:
             Dictionary with recommended agent and reasoning
         """
-        # Prepare agent information
-        agent_info = []
-        for agent in available_agents[:10]:  # Limit to 10 agents
-            skills = agent.get('skills', [])
-            capacity = agent.get('current_capacity', 'Unknown')
-            performance = agent.get('performance_score', 'Unknown')
-            
-            agent_summary = f"- {agent.get('name', 'Unknown')}: Skills: {', '.join(skills)}, Capacity: {capacity}, Performance: {performance}"
-            agent_info.append(agent_summary)
-        
-        agents_text = '\n'.join(agent_info)
+        # Only the best locally ranked candidates go to the model, however large the roster
+        agents_text = '\n'.join(assignment_engine.candidate_roster(incident, available_agents)) or "No agents have free capacity"
         
         prompt = f"""
         You are an ITSM assignment specialist. Recommend the best agent for this incident.
         
         Incident Details:
-        - Title: {incident.get('short_description', 'No title')}
-        - Category: {incident.get('category_name', 'Unknown')}
+        - Title: {incident.get('title', 'No title')}
+        - Category: {incident.get('category', 'Unknown')}
         - Priority: {incident.get('priority', 'Unknown')}
-        - Required Skills: {incident.get('required_skills', 'None specified')}
+        - Required Skills: {', '.join(required_skills(incident))}
         
-        Available Agents:
+        Candidate Agents (best local match first):
         {agents_text}
         
         Consider:
         1. Skill match for the incident type
         2. Current capacity/workload
-        3. Performance history
+        3. Match score from local ranking
         4. Priority level urgency
         
         Respond with:
@@ -0,0 +1,138 @@
+"""
+Bulk UC-21 KB bootstrapping across incident clusters
+Walks every incident cluster that no existing article covers yet and generates a Draft
+article for each in the background, through the shared Bedrock admission path, with
+progress and cost recorded per cluster so an interrupted run resumes where it stopped
+"""
+import logging
+from typing import Dict, List, Optional
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.data_ingest import data_ingest_manager
+from utils.background_jobs import background_job_manager, JobContext
+from utils.incident_clustering import incident_clusterer, REPRESENTATIVES_PER_CLUSTER
+from utils.kb_generation import (kb_coverage_checker, build_generation_prompt, parse_article_response,
+                                 cluster_signature)
+
+logger = logging.getLogger(__name__)
+
+BULK_KB_JOB = "bulk_kb_generation"
+# Per-cluster outcomes that are final; anything else (failed, interrupted) is retried on resume
+FINISHED_CLUSTER_STATUSES = ["generated", "covered", "empty"]
+
+
+def start_bulk_kb_generation(model_id: str, system_prompt: Optional[str], max_tokens: int = 1500,
+                             temperature: float = 0.7, min_cluster_size: int = 3, concurrency: int = 4) -> Dict:
+    """Start (or attach to) the background job generating Draft articles for uncovered clusters"""
+    job_id = background_job_manager.start_job(
+        BULK_KB_JOB,
+        params={
+            "model_id": model_id,
+            "system_prompt": system_prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "min_cluster_size": min_cluster_size,
+            "concurrency": concurrency
+        },
+        total=len(incident_clusterer.get_clusters(min_size=min_cluster_size))
+    )
+    return background_job_manager.get_job(job_id) if job_id else {}
+
+
+def _generate_cluster_article(cluster: Dict, params: Dict, job_id: str) -> Dict:
+    """Generate and save a Draft article for one cluster unless one already covers it"""
+    from utils.bedrock_client import bedrock_client
+
+    cost = {"requests": 0, "input_tokens": 0, "output_tokens": 0}
+    incidents = incident_clusterer.get_central_incidents(cluster["_id"], limit=REPRESENTATIVES_PER_CLUSTER)
+    if not incidents:
+        return {"status": "empty", "cost": cost}
+
+    coverage = kb_coverage_checker.find_existing_coverage(incidents, limit=1)
+    if coverage:
+        return {"status": "covered", "article_id": coverage[0]["article_id"], "cost": cost}
+
+    response, usage = bedrock_client.invoke_model_with_usage(
+        build_generation_prompt(incidents),
+        params.get("model_id"),
+        params.get("max_tokens", 1500),
+        params.get("temperature", 0.7),
+        system_prompt=params.get("system_prompt")
+    )
+    for key in cost:
+        cost[key] += usage.get(key, 0)
+
+    article = parse_article_response(response)
+    if not response or not article["title"] or not article["solution"]:
+        return {"status": "failed", "error": "No usable article in the model response", "cost": cost}
+
+    source_incident_ids = [str(incident["incident_id"]) for incident in incidents if incident.get("incident_id")]
+    kb_data = {
+        **article,
+        "source_incidents": len(incidents),
+        "source_incident_ids": source_incident_ids,
+        "cluster_signature": cluster_signature(source_incident_ids),
+        "cluster_id": cluster["_id"],
+        "ai_generated": True,
+        "publish_state": "Draft",
+        "model_id": params.get("model_id"),
+        "generation_job_id": job_id
+    }
+    if not data_ingest_manager.save_kb_article(kb_data):
+        return {"status": "failed", "error": "Failed to save article", "cost": cost}
+    return {"status": "generated", "article_id": kb_data["article_id"], "cost": cost}
+
+
+def _run_bulk_kb_generation(context: JobContext):
+    """Job handler: generate a Draft for every cluster not finished by this job or covered by an article"""
+    params = context.params
+    finished = {cluster_id for cluster_id, outcome in (context.job.get("clusters") or {}).items()
+                if outcome.get("status") in FINISHED_CLUSTER_STATUSES}
+    clusters: List[Dict] = [cluster for cluster in incident_clusterer.get_clusters(min_size=params.get("min_cluster_size", 3))
+                            if str(cluster["_id"]) not in finished]
+
+    # Recount on (re)start so progress reflects what is actually left; failed clusters are retried
+    context.update(set_fields={"total": len(finished) + len(clusters), "processed": len(finished), "failed": 0})
+
+    with ThreadPoolExecutor(max_workers=params.get("concurrency", 4)) as executor:
+        futures = {}
+        for cluster in clusters:
+            futures[executor.submit(_generate_cluster_article, cluster, params, context.job_id)] = cluster
+
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            cluster = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                logger.error(f"KB generation failed for cluster {cluster['_id']}: {str(e)}")
+                outcome = {"status": "failed", "error": str(e),
+                           "cost": {"requests": 0, "input_tokens": 0, "output_tokens": 0}}
+
+            outcome.update({"label": cluster.get("label", ""), "size": cluster.get("size", 0),
+                            "finished_at": datetime.utcnow()})
+            context.update(
+                inc={
+                    "processed": 1,
+                    "succeeded": 1 if outcome["status"] == "generated" else 0,
+                    "failed": 1 if outcome["status"] == "failed" else 0,
+                    "skipped": 1 if outcome["status"] in ("covered", "empty") else 0,
+                    "cost.requests": outcome["cost"]["requests"],
+                    "cost.input_tokens": outcome["cost"]["input_tokens"],
+                    "cost.output_tokens": outcome["cost"]["output_tokens"]
+                },
+                set_fields={f"clusters.{cluster['_id']}": outcome}
+            )
+
+            if context.is_cancelled():
+                # Clusters not yet started are dropped; in-flight ones still finish and are recorded
+                for pending in futures:
+                    pending.cancel()
+
+    logger.info(f"Bulk KB generation job {context.job_id} processed {len(clusters)} clusters")
+
+
+background_job_manager.register(BULK_KB_JOB, _run_bulk_kb_generation)
+background_job_manager.resume_interrupted_jobs(BULK_KB_JOB)
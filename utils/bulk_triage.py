@@ -0,0 +1,162 @@
+"""
+Bulk UC-02 auto-classification of the open incident queue
+Classifies every open incident without a priority in the background, through the
+batched Bedrock triage path, and writes results back with bulk updates
+"""
+import logging
+from typing import Dict, List
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import UpdateOne
+
+from utils.data_ingest import data_ingest_manager
+from utils.background_jobs import background_job_manager, JobContext
+from utils.bedrock_client import triage_prompt_fingerprint
+from utils.recommendation_store import incident_fingerprint
+from utils.incident_rollups import incident_rollups, ROLLUP_FIELDS_PROJECTION
+from utils.agent_load import agent_load_tracker, LOAD_FIELDS_PROJECTION
+from utils.facet_index import facet_index, FACET_FIELDS_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+BULK_TRIAGE_JOB = "bulk_triage"
+OPEN_STATUSES = ['Open', 'In Progress', 'Assigned']
+
+# Open incidents that still need a priority
+UNPRIORITISED_OPEN_FILTER = {
+    "status": {"$in": OPEN_STATUSES},
+    "$or": [{"priority": {"$exists": False}}, {"priority": None}, {"priority": ""}]
+}
+
+# Prompt fields, plus the fields needed to move the incident between priority rollups, facet counts and agent load counters
+TRIAGE_PROJECTION = {**LOAD_FIELDS_PROJECTION, "title": 1, "description": 1, **ROLLUP_FIELDS_PROJECTION,
+                     **FACET_FIELDS_PROJECTION}
+
+
+def count_unprioritised_incidents() -> int:
+    """Count open incidents without a priority"""
+    if not data_ingest_manager.is_available():
+        return 0
+    try:
+        return data_ingest_manager.incidents_collection.count_documents(UNPRIORITISED_OPEN_FILTER)
+    except Exception as e:
+        logger.error(f"Failed to count unprioritised incidents: {str(e)}")
+        return 0
+
+
+def start_bulk_triage(model_id: str, system_prompt: str, temperature: float = 0.3,
+                      chunk_size: int = 20, concurrency: int = 4) -> Dict:
+    """Start (or attach to) the background bulk triage job"""
+    job_id = background_job_manager.start_job(
+        BULK_TRIAGE_JOB,
+        params={
+            "model_id": model_id,
+            "system_prompt": system_prompt,
+            "temperature": temperature,
+            "chunk_size": chunk_size,
+            "concurrency": concurrency
+        },
+        total=count_unprioritised_incidents()
+    )
+    return background_job_manager.get_job(job_id) if job_id else {}
+
+
+def _run_bulk_triage(context: JobContext):
+    """Job handler: classify unprioritised open incidents page by page until none remain"""
+    from utils.bedrock_client import bedrock_client
+
+    params = context.params
+    chunk_size = params.get("chunk_size", 20)
+    concurrency = params.get("concurrency", 4)
+    prompt_hash = triage_prompt_fingerprint(params.get("system_prompt"))
+    page_size = chunk_size * concurrency
+    attempted = 0
+    last_id = None
+
+    # Recount on (re)start so progress reflects what is actually left
+    context.update(set_fields={"total": context.job.get("processed", 0) + count_unprioritised_incidents()})
+
+    def classify_chunk(chunk: List[Dict]):
+        return bedrock_client.classify_incidents_batch_with_usage(
+            chunk,
+            model_id=params.get("model_id"),
+            system_prompt=params.get("system_prompt"),
+            temperature=params.get("temperature", 0.3)
+        )
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while not context.is_cancelled():
+            # Page forward by incident_id so incidents that failed to classify are not picked up again
+            query = dict(UNPRIORITISED_OPEN_FILTER)
+            if last_id is not None:
+                query["incident_id"] = {"$gt": last_id}
+            page = list(data_ingest_manager.incidents_collection
+                        .find(query, TRIAGE_PROJECTION)
+                        .sort("incident_id", 1)
+                        .limit(page_size))
+            if not page:
+                break
+
+            attempted += len(page)
+            last_id = page[-1]["incident_id"]
+            chunks = [page[i:i + chunk_size] for i in range(0, len(page), chunk_size)]
+
+            for chunk, (results, usage) in zip(chunks, executor.map(classify_chunk, chunks)):
+                operations = []
+                changes = []
+                failed = 0
+                classified_at = datetime.utcnow()
+                for incident in chunk:
+                    result = results.get(str(incident["incident_id"]))
+                    if not result or result.get("failed"):
+                        failed += 1
+                        continue
+                    operations.append(UpdateOne(
+                        # Never overwrite a priority set by someone while the job ran
+                        {"incident_id": incident["incident_id"], **UNPRIORITISED_OPEN_FILTER},
+                        {"$set": {
+                            "priority": result["priority"],
+                            "ai_triage": {
+                                "priority": result["priority"],
+                                "reasoning": result["reasoning"],
+                                "confidence": result["confidence"],
+                                "model_id": params.get("model_id"),
+                                "prompt_hash": prompt_hash,
+                                "input_hash": incident_fingerprint(incident),
+                                "job_id": context.job_id,
+                                "classified_at": classified_at
+                            },
+                            "_updated_at": classified_at
+                        }}
+                    ))
+                    changes.append((incident, {**incident, "priority": result["priority"]}))
+
+                written = 0
+                if operations:
+                    written = data_ingest_manager.incidents_collection.bulk_write(operations, ordered=False).modified_count
+                    data_ingest_manager.bump_collection_version('incidents')
+                    if written < len(operations):
+                        # Some incidents were prioritised by someone else meanwhile; move only the ones this job wrote
+                        ours = {incident["incident_id"] for incident in data_ingest_manager.incidents_collection.find(
+                            {"incident_id": {"$in": [before["incident_id"] for before, _ in changes]},
+                             "ai_triage.job_id": context.job_id, "ai_triage.classified_at": classified_at},
+                            {"_id": 0, "incident_id": 1})}
+                        changes = [change for change in changes if change[0]["incident_id"] in ours]
+                    agent_load_tracker.apply_changes(changes)
+                    incident_rollups.apply_changes(changes)
+                    facet_index.apply_changes('incidents', changes)
+
+                context.update(inc={
+                    "processed": len(chunk),
+                    "succeeded": written,
+                    "failed": failed,
+                    "cost.requests": usage["requests"],
+                    "cost.input_tokens": usage["input_tokens"],
+                    "cost.output_tokens": usage["output_tokens"]
+                })
+
+    logger.info(f"Bulk triage job {context.job_id} processed {attempted} incidents")
+
+
+background_job_manager.register(BULK_TRIAGE_JOB, _run_bulk_triage)
+background_job_manager.resume_interrupted_jobs(BULK_TRIAGE_JOB)
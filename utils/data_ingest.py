@@ -4,8 +4,9 @@ Pulls cleaned data from CSVs and seeds MongoDB collections
 """
 import pymongo
 import pandas as pd
+from bson import ObjectId
 import logging
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 import streamlit as st
 from datetime import datetime, timedelta
 import os
@@ -13,6 +14,90 @@ import random
 
 logger = logging.getLogger(__name__)
 
+# Incident timestamps stored as BSON dates so they can be range-queried
+SLA_DATE_FIELDS = ['created_on', 'sla_due', 'resolved_on']
+
+
+def parse_incident_datetime(value) -> Optional[datetime]:
+    """An incident timestamp as a naive UTC datetime (None when empty or unparseable)"""
+    if isinstance(value, datetime):
+        return None if pd.isna(value) else value
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        # The format the AI generator is asked for
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        parsed = pd.to_datetime(value, errors='coerce', utc=True)
+        return None if pd.isna(parsed) else parsed.tz_localize(None).to_pydatetime()
+
+
+# Canonical incident field -> the CSV-schema (or earlier app) field it replaces; incidents are stored
+# with the canonical field only, so every reader and index uses a single field
+LEGACY_INCIDENT_FIELDS = {
+    'title': 'short_description',
+    'priority': 'true_priority',
+    'category': 'category_name',
+    'service': 'service_name',
+    'resolved_on': 'resolved_at'
+}
+# Ground-truth priority, kept apart from `priority` (which triage and agents overwrite) so training and
+# evaluation never score a model against its own output
+PRIORITY_LABEL_FIELD = 'priority_label'
+# AI-generated incidents whose generated priority was never replaced by a triage recommendation
+UNLABELLED_GENERATED_FILTER = {
+    "_source": "ai_generated", PRIORITY_LABEL_FIELD: {"$exists": False},
+    "ai_triage": {"$exists": False}, "priority": {"$nin": ["", None]}
+}
+LEGACY_INCIDENTS_FILTER = {"$or": [{legacy: {"$exists": True}} for legacy in LEGACY_INCIDENT_FIELDS.values()]
+                                  + [UNLABELLED_GENERATED_FILTER]}
+CANONICAL_MIGRATION_STATE_ID = "canonical_incidents_migration"
+
+# Deletion tombstones are kept this long; delta readers older than that reload in full
+TOMBSTONE_TTL = timedelta(days=7)
+
+
+def _is_blank(value) -> bool:
+    """Check a field value is missing, null, NaN or an empty string"""
+    return value is None or (isinstance(value, float) and pd.isna(value)) or (isinstance(value, str) and not value.strip())
+
+
+def canonical_incident_changes(incident: Dict) -> tuple:
+    """
+    ($set, $unset) fields that fold an incident's legacy fields into the canonical ones (set canonical
+    values win); true_priority, or the priority an incident was generated with, becomes its label
+    """
+    set_fields, unset_fields = {}, {}
+    if not _is_blank(incident.get('true_priority')):
+        set_fields[PRIORITY_LABEL_FIELD] = incident['true_priority']
+    elif (incident.get('_source') == 'ai_generated' and PRIORITY_LABEL_FIELD not in incident
+          and 'ai_triage' not in incident and not _is_blank(incident.get('priority'))):
+        set_fields[PRIORITY_LABEL_FIELD] = incident['priority']
+    for field, legacy in LEGACY_INCIDENT_FIELDS.items():
+        if legacy not in incident:
+            continue
+        unset_fields[legacy] = ""
+        if _is_blank(incident.get(field)) and not _is_blank(incident[legacy]):
+            set_fields[field] = incident[legacy]
+    return set_fields, unset_fields
+
+
+def canonical_incidents_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Fold legacy CSV columns into the canonical incident columns, keeping true_priority as the label"""
+    if 'true_priority' in df.columns:
+        df[PRIORITY_LABEL_FIELD] = df['true_priority']
+    for field, legacy in LEGACY_INCIDENT_FIELDS.items():
+        if legacy not in df.columns:
+            continue
+        if field in df.columns:
+            blank = df[field].map(_is_blank)
+            df[field] = df[field].where(~blank, df[legacy])
+        else:
+            df[field] = df[legacy]
+        df = df.drop(columns=legacy)
+    return df
+
+
 class DataIngestManager:
     """Manages data ingestion from CSV files to MongoDB"""
     
@@ -33,6 +118,19 @@ class DataIngestManager:
             self.workload_collection = self.db.workload
             self.metadata_collection = self.db.data_metadata
             self.kb_articles_collection = self.db.kb_articles
+            self.counters_collection = self.db.counters
+            self.tombstones_collection = self.db.tombstones
+
+            # Per-incident updates (triage, assignment, clustering) look incidents up by id
+            self.incidents_collection.create_index("incident_id")
+            # Delta readers fetch the documents written since their watermark
+            self.incidents_collection.create_index("_updated_at")
+            self.incidents_collection.create_index("_ingested_at")
+            self.tombstones_collection.create_index("deleted_at", expireAfterSeconds=int(TOMBSTONE_TTL.total_seconds()))
+            # Articles created before ids were introduced lack one until migrated
+            self.kb_articles_collection.create_index(
+                "article_id", unique=True, partialFilterExpression={"article_id": {"$type": "string"}}
+            )
             
         except Exception as e:
             logger.error(f"Failed to connect to MongoDB: {str(e)}")
@@ -96,12 +194,23 @@ class DataIngestManager:
             
             # Clear existing data and insert new
             self.incidents_collection.delete_many({})
+            self.record_deletions('incidents')
             result = self.incidents_collection.insert_many(records)
             
             logger.info(f"Inserted {len(result.inserted_ids)} incidents into MongoDB")
             
             # Update metadata
             self._update_metadata('incidents', len(records), csv_path)
+
+            from utils.incident_rollups import incident_rollups
+            incident_rollups.backfill()
+            from utils.agent_load import agent_load_tracker
+            agent_load_tracker.reconcile(fix=True)
+            from utils.facet_index import facet_index
+            facet_index.rebuild('incidents')
+            # Clusters describe the replaced incidents
+            from utils.incident_clustering import incident_clusterer
+            incident_clusterer.reset()
             
             return True
             
@@ -138,6 +247,12 @@ class DataIngestManager:
             
             # Update metadata
             self._update_metadata('agents', len(records), csv_path)
+
+            # New agent documents start without load counters
+            from utils.agent_load import agent_load_tracker
+            agent_load_tracker.reconcile(fix=True)
+            from utils.facet_index import facet_index
+            facet_index.rebuild('agents')
             
             return True
             
@@ -183,21 +298,6 @@ class DataIngestManager:
     
     def _clean_incidents_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """Clean and standardize incidents data with category enrichment"""
-        # Convert datetime columns
-        datetime_cols = ['created_on', 'updated_on', 'resolved_on']
-        for col in datetime_cols:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-
-        # Fill NaN values
-        df = df.fillna('')
-
-        # Ensure required columns exist
-        required_cols = ['incident_id', 'short_description', 'description', 'true_priority']
-        for col in required_cols:
-            if col not in df.columns:
-                df[col] = ''
-
         # Try to enrich with category names if category_tree.csv exists
         try:
             csv_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -242,6 +342,27 @@ class DataIngestManager:
         except Exception as e:
             logger.warning(f"Could not enrich with services: {str(e)}")
 
+        # Store the canonical schema (title, priority, category and service names)
+        df = canonical_incidents_frame(df)
+
+        # Convert datetime columns (stored as BSON dates so SLA queries can compare them)
+        datetime_cols = ['created_on', 'updated_on', 'resolved_on', 'sla_due']
+        for col in datetime_cols:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col], errors='coerce', utc=True, format='mixed').dt.tz_localize(None)
+
+        # Fill NaN values (missing timestamps become null rather than empty strings)
+        df = df.fillna('')
+        for col in datetime_cols:
+            if col in df.columns:
+                df[col] = df[col].astype(object).where(df[col].notna(), None)
+
+        # Ensure required columns exist
+        required_cols = ['incident_id', 'title', 'description', 'priority']
+        for col in required_cols:
+            if col not in df.columns:
+                df[col] = ''
+
         return df
     
     def _clean_agents_data(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -273,24 +394,182 @@ class DataIngestManager:
     def _update_metadata(self, collection_name: str, record_count: int, source_file: str):
         """Update metadata about the ingestion"""
         try:
-            metadata = {
-                "_id": f"{collection_name}_metadata",
-                "collection": collection_name,
-                "record_count": record_count,
-                "source_file": source_file,
-                "last_ingested": datetime.utcnow(),
-                "status": "success"
-            }
-            
-            self.metadata_collection.replace_one(
+            # $inc keeps the collection version monotonic across re-ingestion
+            self.metadata_collection.update_one(
                 {"_id": f"{collection_name}_metadata"},
-                metadata,
+                {
+                    "$set": {
+                        "collection": collection_name,
+                        "record_count": record_count,
+                        "source_file": source_file,
+                        "last_ingested": datetime.utcnow(),
+                        "status": "success"
+                    },
+                    "$inc": {"version": 1},
+                    "$setOnInsert": {"epoch": ObjectId()}
+                },
                 upsert=True
             )
             
         except Exception as e:
             logger.error(f"Failed to update metadata: {str(e)}")
+
+    def bump_collection_version(self, collection_name: str):
+        """Mark a collection as changed so results cached against its version are recomputed"""
+        if not self.available:
+            return
+        try:
+            self.metadata_collection.update_one(
+                {"_id": f"{collection_name}_metadata"},
+                {"$inc": {"version": 1}, "$setOnInsert": {"collection": collection_name, "epoch": ObjectId()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to bump {collection_name} version: {str(e)}")
+
+    def clear_metadata(self):
+        """Forget ingestion metadata and derived state, keeping every collection version counting upwards"""
+        if not self.available:
+            return
+        try:
+            # Caches are keyed on the bare version, so a cleared collection must never reuse one they have seen
+            version_ids = {"$regex": "_metadata$"}
+            self.metadata_collection.delete_many({"_id": {"$not": version_ids}})
+            self.metadata_collection.update_many(
+                {"_id": version_ids},
+                {"$unset": {"record_count": "", "source_file": "", "last_ingested": "", "status": ""},
+                 "$inc": {"version": 1}}
+            )
+        except Exception as e:
+            logger.error(f"Failed to clear metadata: {str(e)}")
+
+    def get_collection_version(self, collection_name: str) -> Optional[int]:
+        """Current version of a collection (None when it has never been versioned)"""
+        if not self.available:
+            return None
+        try:
+            metadata = self.metadata_collection.find_one({"_id": f"{collection_name}_metadata"}, {"version": 1})
+            return metadata.get("version") if metadata else None
+        except Exception as e:
+            logger.error(f"Failed to get {collection_name} version: {str(e)}")
+            return None
     
+    def get_collection_epoch(self, collection_name: str) -> Optional[str]:
+        """Id minted with a collection's version document, so versions restarted by a metadata wipe never match"""
+        if not self.available:
+            return None
+        try:
+            metadata_id = f"{collection_name}_metadata"
+            metadata = self.metadata_collection.find_one({"_id": metadata_id}, {"epoch": 1})
+            if metadata and "epoch" not in metadata:
+                # Version documents written before epochs existed get one on first use
+                self.metadata_collection.update_one({"_id": metadata_id, "epoch": {"$exists": False}},
+                                                    {"$set": {"epoch": ObjectId()}})
+                metadata = self.metadata_collection.find_one({"_id": metadata_id}, {"epoch": 1})
+            return str(metadata["epoch"]) if metadata and metadata.get("epoch") else None
+        except Exception as e:
+            logger.error(f"Failed to get {collection_name} epoch: {str(e)}")
+            return None
+
+    def record_deletions(self, collection_name: str, keys: Optional[List] = None):
+        """Leave tombstones for deleted documents (keys=None when the whole collection was cleared)"""
+        if not self.available:
+            return
+        try:
+            now = datetime.utcnow()
+            key_list = [None] if keys is None else list(keys)
+            if key_list:
+                self.tombstones_collection.insert_many(
+                    [{"collection": collection_name, "key": key, "deleted_at": now} for key in key_list]
+                )
+        except Exception as e:
+            logger.error(f"Failed to record {collection_name} deletions: {str(e)}")
+
+    def get_deletions(self, collection_name: str, since: Optional[datetime] = None) -> Optional[Set]:
+        """Keys of documents deleted from a collection after a point in time (None when it was cleared since)"""
+        if not self.available:
+            return None
+        query = {"collection": collection_name}
+        if since is not None:
+            query["deleted_at"] = {"$gt": since}
+        try:
+            keys = set()
+            for tombstone in self.tombstones_collection.find(query, {"_id": 0, "key": 1}):
+                if tombstone.get("key") is None:
+                    return None
+                keys.add(tombstone["key"])
+            return keys
+        except Exception as e:
+            logger.error(f"Failed to get {collection_name} deletions: {str(e)}")
+            return None
+
+    def last_deletion_at(self, collection_name: str) -> Optional[datetime]:
+        """Time of the latest tombstone recorded for a collection"""
+        if not self.available:
+            return None
+        try:
+            latest = self.tombstones_collection.find_one(
+                {"collection": collection_name}, {"_id": 0, "deleted_at": 1}, sort=[("deleted_at", -1)]
+            )
+            return latest.get("deleted_at") if latest else None
+        except Exception as e:
+            logger.error(f"Failed to get {collection_name} deletions: {str(e)}")
+            return None
+
+    def count_legacy_incidents(self) -> int:
+        """Count incidents still carrying CSV-schema fields"""
+        if not self.available:
+            return 0
+        try:
+            return self.incidents_collection.count_documents(LEGACY_INCIDENTS_FILTER)
+        except Exception as e:
+            logger.error(f"Failed to count legacy incidents: {str(e)}")
+            return 0
+
+    def migrate_canonical_incidents(self, batch_size: int = 5000) -> Dict:
+        """One-off migration: fold the LEGACY_INCIDENT_FIELDS into the canonical fields"""
+        if not self.available:
+            return {"success": False, "error": "MongoDB not available"}
+
+        projection = {field: 1 for pair in LEGACY_INCIDENT_FIELDS.items() for field in pair}
+        projection.update({PRIORITY_LABEL_FIELD: 1, "_source": 1, "ai_triage.priority": 1})
+        try:
+            migrated = 0
+            last_id = None
+            while True:
+                # Page forward by _id so each batch resumes where the last one stopped instead of rescanning
+                query = {**LEGACY_INCIDENTS_FILTER, "_id": {"$gt": last_id}} if last_id is not None else LEGACY_INCIDENTS_FILTER
+                batch = list(self.incidents_collection.find(query, projection).sort("_id", 1).limit(batch_size))
+                if not batch:
+                    break
+                last_id = batch[-1]["_id"]
+                operations = []
+                for incident in batch:
+                    set_fields, unset_fields = canonical_incident_changes(incident)
+                    # Stamped so delta readers pick the rewritten documents up
+                    set_fields["_updated_at"] = datetime.utcnow()
+                    operations.append(pymongo.UpdateOne({"_id": incident["_id"]}, {"$set": set_fields, "$unset": unset_fields}))
+                self.incidents_collection.bulk_write(operations, ordered=False)
+                migrated += len(operations)
+
+            if migrated:
+                self.bump_collection_version('incidents')
+                # Category and service values moved to the canonical fields
+                from utils.facet_index import facet_index
+                facet_index.rebuild('incidents')
+            self.metadata_collection.update_one(
+                {"_id": CANONICAL_MIGRATION_STATE_ID},
+                {"$set": {"version": self.get_collection_version('incidents'), "migrated_at": datetime.utcnow()},
+                 "$inc": {"migrated": migrated}},
+                upsert=True
+            )
+            logger.info(f"Migrated {migrated} incidents to the canonical schema")
+            return {"success": True, "migrated": migrated}
+
+        except Exception as e:
+            logger.error(f"Failed to migrate incidents to the canonical schema: {str(e)}")
+            return {"success": False, "error": str(e)}
+
     def get_incidents(self, limit: Optional[int] = None) -> List[Dict]:
         """Get incidents from MongoDB"""
         if not self.available:
@@ -333,17 +612,33 @@ class DataIngestManager:
             logger.error(f"Failed to get workload: {str(e)}")
             return []
     
+    def next_sequence(self, name: str, count: int = 1) -> int:
+        """Atomically reserve count values of a named counter, returning the first"""
+        counter = self.counters_collection.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        return counter["seq"] - count + 1
+
+    def next_kb_article_id(self) -> str:
+        """Allocate a new KB article id (KB000001, KB000002, ...)"""
+        return f"KB{self.next_sequence('kb_article_id'):06d}"
+
     def save_kb_article(self, article: Dict) -> bool:
-        """Save KB article to MongoDB"""
+        """Save KB article to MongoDB, allocating its article_id (set on the passed dict)"""
         if not self.available:
             return False
         
         try:
             article['_created_at'] = datetime.utcnow()
-            article['_id'] = f"kb_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+            article['article_id'] = self.next_kb_article_id()
             
             self.kb_articles_collection.insert_one(article)
-            logger.info(f"Saved KB article: {article.get('title', 'Untitled')}")
+            from utils.similarity_index import similarity_index
+            similarity_index.upsert_kb_article(article)
+            logger.info(f"Saved KB article {article['article_id']}: {article.get('title', 'Untitled')}")
             return True
             
         except Exception as e:
@@ -409,6 +704,7 @@ class DataIngestManager:
 
             # Clear existing incidents and insert new ones
             self.incidents_collection.delete_many({})
+            self.record_deletions('incidents')
 
             # Also clear workload collection since we're consolidating
             self.workload_collection.delete_many({})
@@ -420,6 +716,16 @@ class DataIngestManager:
                 # Update metadata
                 self._update_metadata('incidents', len(all_incidents), 'ai_generated')
 
+                from utils.incident_rollups import incident_rollups
+                incident_rollups.backfill()
+                from utils.agent_load import agent_load_tracker
+                agent_load_tracker.reconcile(fix=True)
+                from utils.facet_index import facet_index
+                facet_index.rebuild('incidents')
+                # Clusters describe the replaced incidents
+                from utils.incident_clustering import incident_clusterer
+                incident_clusterer.reset()
+
                 return True
             else:
                 logger.error("No incidents were generated")
@@ -615,6 +921,7 @@ IMPORTANT: Return ONLY a JSON array with exactly {count} incident objects. Do no
                 'title': incident_data.get('title', 'IT Support Request'),
                 'description': incident_data.get('description', 'User requires technical assistance'),
                 'priority': incident_data.get('priority') if incident_data.get('priority') else None,
+                PRIORITY_LABEL_FIELD: incident_data.get('priority') if incident_data.get('priority') else None,
                 'status': incident_data.get('status', 'Open'),
                 'category': incident_data.get('category', 'Password Reset'),  # Now readable name
                 'service': incident_data.get('service', 'Workplace Technology'),  # Now readable name
@@ -657,6 +964,9 @@ IMPORTANT: Return ONLY a JSON array with exactly {count} incident objects. Do no
                 elif not record['assigned_to']:
                     record['assigned_to'] = f'AGT{random.randint(1, 10):03d}'
 
+            for field in SLA_DATE_FIELDS:
+                record[field] = parse_incident_datetime(record[field])
+
             return record
 
         except Exception as e:
@@ -688,6 +998,7 @@ IMPORTANT: Return ONLY a JSON array with exactly {count} incident objects. Do no
                 return True
 
             total_removed = 0
+            cleaned_ids = []
             for duplicate_group in duplicates:
                 incident_id = duplicate_group["_id"]
                 docs = duplicate_group["docs"]
@@ -701,9 +1012,19 @@ IMPORTANT: Return ONLY a JSON array with exactly {count} incident objects. Do no
                 for doc in docs_to_remove:
                     self.incidents_collection.delete_one({"_id": doc["_id"]})
                     total_removed += 1
+                cleaned_ids.append(incident_id)
 
                 logger.info(f"Cleaned up {len(docs_to_remove)} duplicates for incident {incident_id}")
 
+            if total_removed:
+                self.record_deletions('incidents', cleaned_ids)
+                self.bump_collection_version('incidents')
+                from utils.incident_rollups import incident_rollups
+                incident_rollups.backfill()
+                from utils.agent_load import agent_load_tracker
+                agent_load_tracker.reconcile(fix=True)
+                from utils.facet_index import facet_index
+                facet_index.rebuild('incidents')
             logger.info(f"Cleanup complete. Removed {total_removed} duplicate incidents")
             return True
 
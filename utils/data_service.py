@@ -7,7 +7,13 @@ import logging
 from typing import Dict, Optional, List
 from datetime import datetime
 import streamlit as st
+from pymongo import ReturnDocument
 from utils.data_ingest import data_ingest_manager
+from utils.agent_load import agent_load_tracker, LOAD_FIELDS_PROJECTION, OPEN_STATUSES
+from utils.incident_rollups import incident_rollups, ROLLUP_FIELDS_PROJECTION
+from utils.facet_index import facet_index, FACET_FIELDS_PROJECTION
+from utils.shared_snapshot import incidents_snapshot
+from utils.incident_schema import decode_incidents
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +61,8 @@ class DataService:
                     # Remove MongoDB _id field
                     if '_id' in df.columns:
                         df = df.drop('_id', axis=1)
+                    # Categorical / datetime64 / Arrow string columns instead of Python objects
+                    df = decode_incidents(df)
                     logger.info(f"Loaded {len(df)} incidents from MongoDB")
                     return df
                 else:
@@ -68,6 +76,37 @@ class DataService:
             logger.error(f"Error getting incidents: {str(e)}")
             return pd.DataFrame()
     
+    def get_shared_incidents(self) -> pd.DataFrame:
+        """
+        All incidents as a read-only view of the memory-mapped Arrow snapshot shared by every process
+
+        Columns use Arrow-backed dtypes; copy a frame before modifying values in place. Falls back to a
+        private DataFrame when the snapshot cannot be published.
+        """
+        self._refresh_mongodb_status()
+        if self.use_mongodb and self.mongodb_has_data:
+            df = incidents_snapshot.get_frame()
+            if df is not None:
+                return df
+        return self.get_incidents()
+
+    def sample_incidents(self, size: int, query: Optional[Dict] = None) -> pd.DataFrame:
+        """Random incidents drawn by MongoDB ($sample) rather than by loading the whole collection"""
+        try:
+            self._refresh_mongodb_status()
+            if self.use_mongodb and self.mongodb_has_data:
+                pipeline = [{"$match": query}] if query else []
+                pipeline += [{"$sample": {"size": int(size)}}, {"$project": {"_id": 0}}]
+                incidents = list(data_ingest_manager.incidents_collection.aggregate(pipeline))
+                return decode_incidents(pd.DataFrame(incidents)) if incidents else pd.DataFrame()
+
+            logger.error("MongoDB not available or has no data")
+            return pd.DataFrame()
+
+        except Exception as e:
+            logger.error(f"Error sampling incidents: {str(e)}")
+            return pd.DataFrame()
+
     def get_agents(self, limit: Optional[int] = None) -> pd.DataFrame:
         """Get agents data from MongoDB"""
         try:
@@ -172,7 +211,7 @@ class DataService:
                 return df
             
             # Search in title and description columns
-            search_cols = ['short_description', 'description']
+            search_cols = ['title', 'description']
             mask = pd.Series([False] * len(df))
             
             for col in search_cols:
@@ -214,19 +253,25 @@ class DataService:
         """Update the priority of a specific incident"""
         try:
             if self.use_mongodb and self.mongodb_has_data:
-                # Update in MongoDB
-                result = data_ingest_manager.incidents_collection.update_one(
+                # Update in MongoDB, keeping the previous state to move the assignee's per-priority load and the rollups
+                before = data_ingest_manager.incidents_collection.find_one_and_update(
                     {"incident_id": incident_id},
                     {
                         "$set": {
                             "priority": priority,
-                            "true_priority": priority,  # Update both fields for compatibility
                             "_updated_at": datetime.utcnow()
                         }
-                    }
+                    },
+                    projection={**LOAD_FIELDS_PROJECTION, **ROLLUP_FIELDS_PROJECTION, **FACET_FIELDS_PROJECTION},
+                    return_document=ReturnDocument.BEFORE
                 )
 
-                if result.modified_count > 0:
+                if before:
+                    data_ingest_manager.bump_collection_version('incidents')
+                    after = {**before, "priority": priority}
+                    agent_load_tracker.apply_changes([(before, after)])
+                    incident_rollups.apply_changes([(before, after)])
+                    facet_index.apply_changes('incidents', [(before, after)])
                     logger.info(f"Updated priority for incident {incident_id} to {priority}")
                     return True
                 else:
@@ -244,23 +289,25 @@ class DataService:
         """Update the assigned agent of a specific incident"""
         try:
             if self.use_mongodb and self.mongodb_has_data:
-                # Update in MongoDB
-                update_data = {
-                    "assigned_to": assigned_to,
-                    "_updated_at": datetime.utcnow()
-                }
-
-                # If assigning to someone, also update status to 'Assigned' if it's currently 'Open'
-                incident = self.get_incident_by_id(incident_id)
-                if incident and incident.get('status') == 'Open':
-                    update_data["status"] = "Assigned"
-
-                result = data_ingest_manager.incidents_collection.update_one(
+                # Update in MongoDB, keeping the previous state to move load between agents
+                before = data_ingest_manager.incidents_collection.find_one_and_update(
                     {"incident_id": incident_id},
-                    {"$set": update_data}
+                    {"$set": {"assigned_to": assigned_to, "_updated_at": datetime.utcnow()}},
+                    projection={**LOAD_FIELDS_PROJECTION, **FACET_FIELDS_PROJECTION},
+                    return_document=ReturnDocument.BEFORE
                 )
 
-                if result.modified_count > 0:
+                if before:
+                    after = {**before, "assigned_to": assigned_to}
+                    # If assigning to someone, also update status to 'Assigned' if it's currently 'Open'
+                    if assigned_to and before.get('status') == 'Open':
+                        data_ingest_manager.incidents_collection.update_one(
+                            {"incident_id": incident_id, "status": "Open"},
+                            {"$set": {"status": "Assigned", "_updated_at": datetime.utcnow()}})
+                        after["status"] = "Assigned"
+                    data_ingest_manager.bump_collection_version('incidents')
+                    agent_load_tracker.apply_changes([(before, after)])
+                    facet_index.apply_changes('incidents', [(before, after)])
                     logger.info(f"Updated assignment for incident {incident_id} to {assigned_to}")
                     return True
                 else:
@@ -273,16 +320,86 @@ class DataService:
         except Exception as e:
             logger.error(f"Error updating incident assignment: {str(e)}")
             return False
-    
+
+    def assign_incidents(self, assignments: Dict[str, str]) -> int:
+        """Assign many incidents at once ({incident_id: agent}), returning how many were updated"""
+        try:
+            if self.use_mongodb and self.mongodb_has_data and assignments:
+                now = datetime.utcnow()
+                collection = data_ingest_manager.incidents_collection
+                changes = []
+                for incident_id, assigned_to in assignments.items():
+                    # Each write returns the state it replaced, so load moves off the agent it was really taken from
+                    # Open incidents move to Assigned, as with a single assignment
+                    before = collection.find_one_and_update(
+                        {"incident_id": incident_id, "status": "Open"},
+                        {"$set": {"assigned_to": assigned_to, "status": "Assigned", "_updated_at": now}},
+                        projection={**LOAD_FIELDS_PROJECTION, **FACET_FIELDS_PROJECTION}, return_document=ReturnDocument.BEFORE
+                    ) or collection.find_one_and_update(
+                        {"incident_id": incident_id, "status": {"$ne": "Open"}},
+                        {"$set": {"assigned_to": assigned_to, "_updated_at": now}},
+                        projection={**LOAD_FIELDS_PROJECTION, **FACET_FIELDS_PROJECTION}, return_document=ReturnDocument.BEFORE
+                    )
+                    if before:
+                        changes.append((before, {**before, "assigned_to": assigned_to,
+                                                 "status": "Assigned" if before.get("status") == "Open" else before.get("status")}))
+                if changes:
+                    data_ingest_manager.bump_collection_version('incidents')
+                    agent_load_tracker.apply_changes(changes)
+                    facet_index.apply_changes('incidents', changes)
+                logger.info(f"Assigned {len(changes)} incidents in bulk")
+                return len(changes)
+            return 0
+
+        except Exception as e:
+            logger.error(f"Error assigning incidents in bulk: {str(e)}")
+            return 0
+
+    def resolve_incident(self, incident_id: str, resolution_notes: str) -> bool:
+        """Resolve an open incident, releasing its assignee's load and counting it in the rollups"""
+        try:
+            if self.use_mongodb and self.mongodb_has_data:
+                now = datetime.utcnow()
+                before = data_ingest_manager.incidents_collection.find_one_and_update(
+                    {"incident_id": incident_id, "status": {"$in": OPEN_STATUSES}},
+                    {"$set": {"status": "Resolved", "resolution_notes": resolution_notes,
+                              "resolved_on": now, "_updated_at": now}},
+                    projection={**LOAD_FIELDS_PROJECTION, **ROLLUP_FIELDS_PROJECTION, **FACET_FIELDS_PROJECTION},
+                    return_document=ReturnDocument.BEFORE
+                )
+
+                if before:
+                    data_ingest_manager.bump_collection_version('incidents')
+                    after = {**before, "status": "Resolved", "resolved_on": now}
+                    agent_load_tracker.apply_changes([(before, after)])
+                    incident_rollups.apply_changes([(before, after)])
+                    facet_index.apply_changes('incidents', [(before, after)])
+                    if resolution_notes:
+                        # Fold the resolution into the KB clusters without holding up the caller
+                        from utils.incident_clustering import incident_clusterer
+                        incident_clusterer.update_in_background()
+                    logger.info(f"Resolved incident {incident_id}")
+                    return True
+                else:
+                    logger.warning(f"No open incident found with ID {incident_id} to resolve")
+                    return False
+            else:
+                logger.error("MongoDB not available or has no data")
+                return False
+
+        except Exception as e:
+            logger.error(f"Error resolving incident: {str(e)}")
+            return False
+
     def get_incidents_by_priority(self, priority: str) -> pd.DataFrame:
         """Get incidents filtered by priority"""
         try:
             df = self.get_incidents()
             
-            if df.empty or 'true_priority' not in df.columns:
+            if df.empty or 'priority' not in df.columns:
                 return df
             
-            return df[df['true_priority'] == priority]
+            return df[df['priority'] == priority]
             
         except Exception as e:
             logger.error(f"Error filtering incidents by priority {priority}: {str(e)}")
@@ -293,10 +410,10 @@ class DataService:
         try:
             df = self.get_incidents()
             
-            if df.empty or 'category_name' not in df.columns:
+            if df.empty or 'category' not in df.columns:
                 return df
             
-            return df[df['category_name'] == category]
+            return df[df['category'] == category]
             
         except Exception as e:
             logger.error(f"Error filtering incidents by category {category}: {str(e)}")
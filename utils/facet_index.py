@@ -0,0 +1,317 @@
+"""
+Faceted filter index for incident and agent dropdowns
+Keeps one facets document per collection holding every facet's distinct values and display
+names, plus a document per joint value combination with its count. Both are built with a
+single aggregation on ingest and moved with $inc on writes, so filter widgets get options
+and narrowed counts without loading any rows
+"""
+import json
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime
+from collections import Counter
+
+import pandas as pd
+from pymongo import UpdateOne
+
+from utils.data_ingest import data_ingest_manager
+
+logger = logging.getLogger(__name__)
+
+ALL = "All"
+# Combination table over the single-valued facets; list-valued facets get a table named after them
+BASE_TABLE = "base"
+
+# Facet name -> label, fields holding the filter value and the display name (first non-empty wins),
+# and whether the field is a list
+FACET_DEFINITIONS = {
+    "incidents": {
+        "priority": {"label": "Priority", "value_fields": ["priority"], "display_fields": ["priority"]},
+        "category": {"label": "Category", "value_fields": ["category"], "display_fields": ["category"]},
+        "service": {"label": "Service", "value_fields": ["service"], "display_fields": ["service"]},
+        "assignment_group": {"label": "Assignment Group", "value_fields": ["true_assignment_group_id"],
+                             "display_fields": ["group_name"]},
+        "status": {"label": "Status", "value_fields": ["status"], "display_fields": ["status"]}
+    },
+    "agents": {
+        "status": {"label": "Status", "value_fields": ["status"], "display_fields": ["status"]},
+        # At most one list-valued facet per collection; its combinations are counted after $unwind
+        "skills": {"label": "Has Skill", "value_fields": ["skills"], "display_fields": ["skills"], "multi": True}
+    }
+}
+
+
+def facet_fields_projection(collection: str) -> Dict:
+    """Projection of the fields a collection's facets are read from"""
+    return {field: 1 for definition in FACET_DEFINITIONS[collection].values()
+            for field in definition["value_fields"] + definition["display_fields"]}
+
+
+# Incident fields needed to move an incident between facet combinations
+FACET_FIELDS_PROJECTION = facet_fields_projection("incidents")
+
+
+def _first_non_empty(fields: List[str]) -> Dict:
+    """Aggregation expression for the first of fields that is neither missing, null nor empty"""
+    expression = {"$ifNull": [f"${fields[-1]}", ""]}
+    for field in reversed(fields[:-1]):
+        expression = {"$cond": [{"$in": [{"$ifNull": [f"${field}", ""]}, ["", None]]}, expression, f"${field}"]}
+    return expression
+
+
+def _document_value(document: Dict, fields: List[str]):
+    """The first of fields that is neither missing, null nor empty in a document (as _first_non_empty)"""
+    for field in fields[:-1]:
+        if document.get(field) not in ("", None):
+            return document[field]
+    value = document.get(fields[-1])
+    return "" if value is None else value
+
+
+def _combination_id(collection: str, table: str, values: Dict[str, str]) -> str:
+    """Combination document id"""
+    return f"{collection}|{table}|{json.dumps(values, sort_keys=True)}"
+
+
+def facet_string(value) -> str:
+    """A facet value as stored in the facets document (integral floats, e.g. ids read back through pandas, lose the .0)"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def facet_series(df: pd.DataFrame, collection: str, facet: str) -> pd.Series:
+    """A facet's value for every row of a DataFrame, as the facets document stores it (strings)"""
+    result = pd.Series("", index=df.index, dtype=object)
+    for field in reversed(FACET_DEFINITIONS[collection][facet]["value_fields"]):
+        if field in df.columns:
+            values = df[field].map(facet_string)
+            present = df[field].notna() & (values != "")
+            result = result.where(~present, values)
+    return result
+
+
+class FacetIndex:
+    """Per-collection facet values and combination counts"""
+
+    def __init__(self):
+        """Initialize the in-process cache of loaded facet documents"""
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Dict] = {}
+        if data_ingest_manager.is_available():
+            self.combinations_collection = data_ingest_manager.db.facet_combinations
+            try:
+                self.combinations_collection.create_index([("collection", 1), ("table", 1)])
+            except Exception as e:
+                logger.warning(f"Could not create facet combination index: {str(e)}")
+        else:
+            self.combinations_collection = None
+
+    def _facet_id(self, collection: str) -> str:
+        """Metadata document id holding a collection's facets"""
+        return f"{collection}_facets"
+
+    def _combination_pipeline(self, collection: str, facets: List[str], unwind: Optional[str] = None) -> List[Dict]:
+        """Count documents per combination of facet values (one row per list element of the unwound facet)"""
+        definitions = FACET_DEFINITIONS[collection]
+        pipeline = []
+        if unwind:
+            field = definitions[unwind]["value_fields"][0]
+            pipeline.append({"$unwind": f"${field}"})
+        group = {"_id": {facet: _first_non_empty(definitions[facet]["value_fields"]) for facet in facets},
+                 "count": {"$sum": 1}}
+        for facet in facets:
+            group[f"display_{facet}"] = {"$first": _first_non_empty(definitions[facet]["display_fields"])}
+        pipeline.append({"$group": group})
+        return pipeline
+
+    def _document_rows(self, collection: str, document: Dict) -> List[tuple]:
+        """(table, facet values) combinations a document is counted under, as the rebuild aggregation counts it"""
+        definitions = FACET_DEFINITIONS[collection]
+        base = {facet: facet_string(_document_value(document, definition["value_fields"]))
+                for facet, definition in definitions.items() if not definition.get("multi")}
+        rows = [(BASE_TABLE, base)]
+        for facet, definition in definitions.items():
+            if definition.get("multi"):
+                # $unwind skips missing, null and empty lists and treats any other value as a list of one
+                items = document.get(definition["value_fields"][0])
+                items = items if isinstance(items, list) else [] if items is None else [items]
+                rows.extend((facet, {**base, facet: facet_string("" if item is None else item)}) for item in items)
+        return rows
+
+    def rebuild(self, collection: str) -> Optional[Dict]:
+        """Recompute a collection's facets and combination counts (after ingest or any bulk replacement)"""
+        if not data_ingest_manager.is_available():
+            return None
+
+        definitions = FACET_DEFINITIONS[collection]
+        single = [facet for facet, definition in definitions.items() if not definition.get("multi")]
+        multi = [facet for facet, definition in definitions.items() if definition.get("multi")]
+        try:
+            version = data_ingest_manager.get_collection_version(collection)
+            source = data_ingest_manager.db[collection]
+            tables = {BASE_TABLE: self._combination_pipeline(collection, single)}
+            tables.update({facet: self._combination_pipeline(collection, single + [facet], unwind=facet) for facet in multi})
+
+            combinations = []
+            displays = {facet: {} for facet in definitions}
+            for table, pipeline in tables.items():
+                for row in source.aggregate(pipeline):
+                    values = {facet: facet_string(value) for facet, value in row["_id"].items()}
+                    combinations.append({"_id": _combination_id(collection, table, values), "collection": collection,
+                                         "table": table, "values": values, "count": row["count"]})
+                    for facet, value in values.items():
+                        if value:
+                            displays[facet].setdefault(value, str(row.get(f"display_{facet}") or value))
+
+            document = {
+                "_id": self._facet_id(collection),
+                "collection": collection,
+                "version": version,
+                "built_at": datetime.utcnow(),
+                "facets": {facet: {"label": definition["label"], "multi": bool(definition.get("multi")),
+                                   "values": [{"value": value, "display": display}
+                                              for value, display in sorted(displays[facet].items(), key=lambda item: item[1])]}
+                           for facet, definition in definitions.items()}
+            }
+            self.combinations_collection.delete_many({"collection": collection})
+            if combinations:
+                self.combinations_collection.insert_many(combinations)
+            data_ingest_manager.metadata_collection.replace_one({"_id": document["_id"]}, document, upsert=True)
+            with self._lock:
+                self._cache.pop(collection, None)
+            logger.info(f"Rebuilt {collection} facets at version {version}")
+            return document
+
+        except Exception as e:
+            logger.error(f"Failed to rebuild {collection} facets: {str(e)}")
+            return None
+
+    def apply_changes(self, collection: str, changes: Iterable[tuple]):
+        """
+        Move combination counts for document writes, adding values not seen before to the facet options
+
+        Args:
+            collection: "incidents" or "agents"
+            changes: (before, after) documents with facet_fields_projection(collection) fields per write;
+                before is None for a new document and after is None for a deleted one
+        """
+        if not data_ingest_manager.is_available():
+            return
+        definitions = FACET_DEFINITIONS[collection]
+        deltas = Counter()
+        new_values = {facet: {} for facet in definitions}
+        for before, after in changes:
+            for sign, document in ((-1, before), (1, after)):
+                if not document:
+                    continue
+                for table, values in self._document_rows(collection, document):
+                    deltas[(table, json.dumps(values, sort_keys=True))] += sign
+                    if sign > 0:
+                        for facet, value in values.items():
+                            if value:
+                                display = _document_value(document, definitions[facet]["display_fields"])
+                                new_values[facet].setdefault(value, str(display or value))
+
+        operations = [UpdateOne({"_id": f"{collection}|{table}|{key}"},
+                                {"$inc": {"count": amount},
+                                 "$setOnInsert": {"collection": collection, "table": table, "values": json.loads(key)}},
+                                upsert=True)
+                      for (table, key), amount in deltas.items() if amount]
+        try:
+            if operations:
+                self.combinations_collection.bulk_write(operations, ordered=False)
+            with self._lock:
+                cached = self._cache.pop(collection, None)
+            known = {facet: {value["value"] for value in definition["values"]}
+                     for facet, definition in cached["document"]["facets"].items()} if cached else {}
+            for facet, values in new_values.items():
+                for value, display in values.items():
+                    if value in known.get(facet, ()):
+                        continue
+                    # Only pushed when missing; the list stays sorted by display name like a rebuilt one
+                    data_ingest_manager.metadata_collection.update_one(
+                        {"_id": self._facet_id(collection), f"facets.{facet}.values.value": {"$ne": value}},
+                        {"$push": {f"facets.{facet}.values": {"$each": [{"value": value, "display": display}],
+                                                              "$sort": {"display": 1}}}}
+                    )
+        except Exception as e:
+            # A rebuild recounts any combination a failed increment leaves behind
+            logger.error(f"Failed to update {collection} facets: {str(e)}")
+
+    def get_facets(self, collection: str) -> Optional[Dict]:
+        """A collection's facets document (built first if it does not exist yet)"""
+        if not data_ingest_manager.is_available():
+            return None
+
+        version = data_ingest_manager.get_collection_version(collection)
+        if version is None:
+            # Never versioned (e.g. after a metadata reset); start counting so the document can be cached
+            data_ingest_manager.bump_collection_version(collection)
+            version = data_ingest_manager.get_collection_version(collection)
+
+        with self._lock:
+            cached = self._cache.get(collection)
+            if cached and cached["version"] == version:
+                return cached["document"]
+
+        try:
+            document = data_ingest_manager.metadata_collection.find_one({"_id": self._facet_id(collection)})
+            if not document:
+                document = self.rebuild(collection)
+            if not document:
+                return None
+            rows = {}
+            for combination in self.combinations_collection.find({"collection": collection, "count": {"$gt": 0}}):
+                rows.setdefault(combination["table"], []).append({**combination["values"], "count": combination["count"]})
+        except Exception as e:
+            logger.error(f"Failed to load {collection} facets: {str(e)}")
+            return None
+
+        with self._lock:
+            self._cache[collection] = {
+                "version": version,
+                "document": document,
+                "tables": {table: pd.DataFrame(table_rows) for table, table_rows in rows.items()}
+            }
+        return document
+
+    def facet_counts(self, collection: str, selections: Dict[str, str]) -> Dict[str, Dict[str, int]]:
+        """
+        Counts for every facet value, narrowed by the selections on the other facets
+
+        Args:
+            collection: "incidents" or "agents"
+            selections: Facet name -> selected value ("All" or missing for no filter)
+
+        Returns:
+            Facet name -> {value: count}, counting documents that match every other selection
+        """
+        if not self.get_facets(collection):
+            return {}
+        with self._lock:
+            tables = self._cache.get(collection, {}).get("tables", {})
+
+        definitions = FACET_DEFINITIONS[collection]
+        active = {facet: value for facet, value in selections.items() if value not in (None, ALL) and facet in definitions}
+        counts = {}
+        for facet in definitions:
+            others = {other: value for other, value in active.items() if other != facet}
+            # A list-valued facet (being counted or filtered on) needs its unwound table; otherwise use the plain one
+            table_name = facet if definitions[facet].get("multi") else next(
+                (other for other in others if definitions[other].get("multi")), BASE_TABLE)
+            table = tables.get(table_name, pd.DataFrame())
+            if table.empty:
+                counts[facet] = {}
+                continue
+            mask = pd.Series(True, index=table.index)
+            for other, value in others.items():
+                mask &= table[other] == value
+            grouped = table[mask].groupby(facet)["count"].sum()
+            counts[facet] = {value: int(count) for value, count in grouped.items() if value}
+        return counts
+
+
+# Global instance
+facet_index = FacetIndex()
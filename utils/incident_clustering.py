@@ -0,0 +1,361 @@
+"""
+Incident clustering engine for UC-21 KB generation
+Groups resolved incidents with hashed text features and mini-batch k-means, streaming
+the corpus from MongoDB so memory stays bounded, and keeps clusters up to date as new
+resolutions arrive
+"""
+import os
+import re
+import heapq
+import logging
+from typing import Dict, List, Optional
+from collections import Counter
+from datetime import datetime
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from pymongo import UpdateOne
+from sklearn.cluster import MiniBatchKMeans
+
+from utils.data_ingest import data_ingest_manager
+from utils.background_jobs import background_job_manager, JobContext
+from utils.text_features import incident_text, build_hashing_vectorizer, INCIDENT_TEXT_FIELDS
+from utils.triage_model import MODELS_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLUSTER_MODEL_PATH = os.path.join(MODELS_DIR, "incident_clusters.joblib")
+UPDATE_JOB = "incident_clusters_update"
+
+# Incidents with a resolution are the raw material for KB articles
+RESOLVED_FILTER = {"resolution_notes": {"$nin": ["", None]}}
+UNCLUSTERED_RESOLVED_FILTER = {**RESOLVED_FILTER, "cluster_id": {"$exists": False}}
+
+CLUSTER_PROJECTION = {"_id": 0, "incident_id": 1, **{field: 1 for field in INCIDENT_TEXT_FIELDS}}
+
+# Smaller hash space than triage: centroids are dense and stored per cluster
+CLUSTER_N_FEATURES = 2 ** 16
+REPRESENTATIVES_PER_CLUSTER = 10
+LABEL_STOP_WORDS = {"the", "and", "for", "with", "not", "from", "unable", "issue", "error", "when", "after"}
+
+
+def _label_from_titles(titles: List[str], top_n: int = 3) -> str:
+    """Short human-readable cluster label from the most common words in its central titles"""
+    words = Counter()
+    for title in titles:
+        words.update(set(w for w in re.findall(r"[a-z0-9]{3,}", title.lower()) if w not in LABEL_STOP_WORDS))
+    return ", ".join(word for word, _ in words.most_common(top_n)) or "Unlabelled"
+
+
+class IncidentClusterer:
+    """Streaming mini-batch k-means over resolved incidents, with results stored in MongoDB"""
+
+    STATE_ID = "incident_clusters"
+
+    def __init__(self, model_path: str = DEFAULT_CLUSTER_MODEL_PATH):
+        """Initialize the clusterer, loading a previously fitted model if present"""
+        self.model_path = model_path
+        self.vectorizer = build_hashing_vectorizer(n_features=CLUSTER_N_FEATURES)
+        self.kmeans = None
+
+        if data_ingest_manager.is_available():
+            self.clusters_collection = data_ingest_manager.db.incident_clusters
+            try:
+                data_ingest_manager.incidents_collection.create_index([("cluster_id", 1), ("cluster_distance", 1)])
+            except Exception as e:
+                logger.warning(f"Could not create cluster index: {str(e)}")
+        else:
+            self.clusters_collection = None
+
+        self.load()
+
+    def is_available(self) -> bool:
+        """Check if clusters can be stored"""
+        return self.clusters_collection is not None
+
+    def is_fitted(self) -> bool:
+        """Check if a fitted model is available"""
+        return self.kmeans is not None
+
+    def load(self) -> bool:
+        """Load the persisted k-means model from disk"""
+        if not os.path.exists(self.model_path):
+            return False
+        try:
+            self.kmeans = joblib.load(self.model_path)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load incident cluster model: {str(e)}")
+            return False
+
+    def save(self) -> bool:
+        """Persist the k-means model to disk (atomically replaces the previous model)"""
+        try:
+            os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
+            tmp_path = f"{self.model_path}.tmp"
+            joblib.dump(self.kmeans, tmp_path)
+            os.replace(tmp_path, self.model_path)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save incident cluster model: {str(e)}")
+            return False
+
+    def reset(self) -> bool:
+        """Forget the model and stored clusters, e.g. after the incidents they were built from are replaced"""
+        self.kmeans = None
+        try:
+            if os.path.exists(self.model_path):
+                os.remove(self.model_path)
+            if self.is_available():
+                self.clusters_collection.delete_many({})
+                data_ingest_manager.metadata_collection.delete_one({"_id": self.STATE_ID})
+            return True
+        except Exception as e:
+            logger.error(f"Failed to reset incident clusters: {str(e)}")
+            return False
+
+    def _stream_batches(self, query: Dict, batch_size: int):
+        """Yield (incidents, feature matrix) batches streamed from MongoDB"""
+        batch = []
+        for incident in data_ingest_manager.incidents_collection.find(query, CLUSTER_PROJECTION, batch_size=batch_size):
+            batch.append(incident)
+            if len(batch) >= batch_size:
+                yield batch, self.vectorizer.transform([incident_text(i) for i in batch])
+                batch = []
+        if batch:
+            yield batch, self.vectorizer.transform([incident_text(i) for i in batch])
+
+    def fit(self, n_clusters: int = 50, batch_size: int = 2048, epochs: int = 2) -> Dict:
+        """
+        Cluster all resolved incidents from scratch
+
+        Args:
+            n_clusters: Number of clusters (capped at the number of resolved incidents)
+            batch_size: Incidents per mini-batch (bounds memory use)
+            epochs: Passes over the corpus when fitting centroids
+
+        Returns:
+            Summary with success flag, cluster and incident counts
+        """
+        if not self.is_available():
+            return {"success": False, "error": "MongoDB not available"}
+
+        try:
+            total = data_ingest_manager.incidents_collection.count_documents(RESOLVED_FILTER)
+            if total < 2:
+                return {"success": False, "error": "Need at least two resolved incidents to cluster"}
+
+            n_clusters = max(2, min(n_clusters, total))
+            # Every partial_fit call needs at least n_clusters samples
+            batch_size = max(batch_size, n_clusters)
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, n_init=3, random_state=42)
+
+            for _ in range(epochs):
+                carry = None
+                for incidents, features in self._stream_batches(RESOLVED_FILTER, batch_size):
+                    if carry is not None:
+                        # Fold a short trailing batch into the next one
+                        features = sp.vstack([carry, features]).tocsr()
+                        carry = None
+                    if features.shape[0] < n_clusters:
+                        carry = features
+                        continue
+                    kmeans.partial_fit(features)
+                if carry is not None and hasattr(kmeans, "cluster_centers_"):
+                    kmeans.partial_fit(carry)
+
+            self.kmeans = kmeans
+            self.save()
+
+            # Full fit replaces any previous assignment; clustered_at is kept, so a refit does not make
+            # incidents already folded into KB articles look newly clustered
+            data_ingest_manager.incidents_collection.update_many(
+                {"cluster_id": {"$exists": True}},
+                {"$unset": {"cluster_id": "", "cluster_distance": ""},
+                 "$set": {"_updated_at": datetime.utcnow()}}
+            )
+            self.clusters_collection.delete_many({})
+            assigned = self._assign(RESOLVED_FILTER, batch_size)
+
+            self._update_state({"fitted_at": datetime.utcnow(), "n_clusters": n_clusters,
+                                "incidents_clustered": assigned, "last_update_at": datetime.utcnow()})
+            logger.info(f"Clustered {assigned} resolved incidents into {n_clusters} clusters")
+            return {"success": True, "n_clusters": n_clusters, "incidents_clustered": assigned}
+
+        except Exception as e:
+            logger.error(f"Failed to cluster incidents: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def count_unclustered(self) -> int:
+        """Count resolved incidents not yet assigned to a cluster"""
+        if not self.is_available():
+            return 0
+        try:
+            return data_ingest_manager.incidents_collection.count_documents(UNCLUSTERED_RESOLVED_FILTER)
+        except Exception as e:
+            logger.error(f"Failed to count unclustered incidents: {str(e)}")
+            return 0
+
+    def update_incremental(self, batch_size: int = 2048) -> Dict:
+        """
+        Fold newly resolved incidents into the existing clusters
+
+        Centroids are nudged with partial_fit and the new incidents are assigned; earlier
+        assignments are kept, so run a full fit occasionally if the corpus shifts a lot.
+        """
+        if not self.is_available():
+            return {"success": False, "error": "MongoDB not available"}
+        if not self.is_fitted():
+            return self.fit()
+
+        try:
+            n_clusters = self.kmeans.n_clusters
+            for _, features in self._stream_batches(UNCLUSTERED_RESOLVED_FILTER, max(batch_size, n_clusters)):
+                if features.shape[0] >= n_clusters:
+                    self.kmeans.partial_fit(features)
+            self.save()
+
+            assigned = self._assign(UNCLUSTERED_RESOLVED_FILTER, batch_size)
+            self._update_state({"last_update_at": datetime.utcnow()}, inc={"incidents_clustered": assigned})
+            return {"success": True, "n_clusters": n_clusters, "incidents_clustered": assigned}
+
+        except Exception as e:
+            logger.error(f"Failed to update incident clusters: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def update_in_background(self) -> Optional[str]:
+        """Start the incremental update job once clusters exist (a first fit stays an explicit action)"""
+        if not self.is_available() or not self.is_fitted():
+            return None
+        return background_job_manager.start_job(UPDATE_JOB)
+
+    def _assign(self, query: Dict, batch_size: int) -> int:
+        """Assign matching incidents to their nearest centroid and refresh cluster documents"""
+        sizes = Counter()
+        # Per-cluster max-heap (negated distance) of the closest incidents seen in this pass
+        nearest: Dict[int, List] = {}
+        assigned = 0
+
+        for incidents, features in self._stream_batches(query, batch_size):
+            clustered_at = datetime.utcnow()
+            distances = self.kmeans.transform(features)
+            labels = distances.argmin(axis=1)
+            label_distances = distances[np.arange(len(labels)), labels]
+
+            operations = []
+            for incident, label, distance in zip(incidents, labels, label_distances):
+                cluster_id = int(label)
+                operations.append(UpdateOne(
+                    {"incident_id": incident["incident_id"]},
+                    {"$set": {"cluster_id": cluster_id, "cluster_distance": float(distance), "_updated_at": clustered_at},
+                     "$min": {"clustered_at": clustered_at}}
+                ))
+                sizes[cluster_id] += 1
+                title = incident.get("title") or ""
+                heap = nearest.setdefault(cluster_id, [])
+                entry = (-float(distance), str(incident["incident_id"]), str(title))
+                if len(heap) < REPRESENTATIVES_PER_CLUSTER:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+
+            if operations:
+                data_ingest_manager.incidents_collection.bulk_write(operations, ordered=False)
+            assigned += len(operations)
+
+        if assigned:
+            data_ingest_manager.bump_collection_version('incidents')
+        self._refresh_clusters(sizes, nearest)
+        return assigned
+
+    def _refresh_clusters(self, sizes: Counter, nearest: Dict[int, List]):
+        """Merge new sizes and representatives into the stored cluster documents"""
+        now = datetime.utcnow()
+        operations = []
+        existing = {doc["_id"]: doc.get("representatives", [])
+                    for doc in self.clusters_collection.find({}, {"representatives": 1})}
+        for cluster_id in range(self.kmeans.n_clusters):
+            candidates = {rep["incident_id"]: rep for rep in existing.get(cluster_id, [])}
+            for neg_distance, incident_id, title in nearest.get(cluster_id, []):
+                candidates[incident_id] = {"incident_id": incident_id, "title": title, "distance": -neg_distance}
+            representatives = sorted(candidates.values(), key=lambda rep: rep["distance"])[:REPRESENTATIVES_PER_CLUSTER]
+
+            centroid = self.kmeans.cluster_centers_[cluster_id]
+            nonzero = np.flatnonzero(centroid > 1e-6)
+            operations.append(UpdateOne(
+                {"_id": cluster_id},
+                {"$set": {
+                    "label": _label_from_titles([rep["title"] for rep in representatives]),
+                    "representatives": representatives,
+                    # Sparse centroid in the clustering hash space
+                    "centroid": {"n_features": CLUSTER_N_FEATURES,
+                                 "indices": nonzero.tolist(),
+                                 "values": centroid[nonzero].astype(float).tolist()},
+                    "updated_at": now
+                },
+                 "$inc": {"size": sizes.get(cluster_id, 0)}},
+                upsert=True
+            ))
+        if operations:
+            self.clusters_collection.bulk_write(operations, ordered=False)
+
+    def _update_state(self, fields: Dict, inc: Optional[Dict] = None):
+        """Record clustering state in the metadata collection"""
+        update = {"$set": fields}
+        if inc:
+            update["$inc"] = inc
+        data_ingest_manager.metadata_collection.update_one({"_id": self.STATE_ID}, update, upsert=True)
+
+    def get_state(self) -> Dict:
+        """Get when clusters were fitted/updated and how many incidents they cover"""
+        if not self.is_available():
+            return {}
+        try:
+            return data_ingest_manager.metadata_collection.find_one({"_id": self.STATE_ID}) or {}
+        except Exception as e:
+            logger.error(f"Failed to load cluster state: {str(e)}")
+            return {}
+
+    def get_clusters(self, min_size: int = 1) -> List[Dict]:
+        """Get stored clusters, largest first (without centroids)"""
+        if not self.is_available():
+            return []
+        try:
+            return list(self.clusters_collection.find({"size": {"$gte": min_size}}, {"centroid": 0}).sort("size", -1))
+        except Exception as e:
+            logger.error(f"Failed to load incident clusters: {str(e)}")
+            return []
+
+    def get_central_incidents(self, cluster_id: int, limit: int = 10) -> List[Dict]:
+        """Get the incidents closest to a cluster's centroid"""
+        if not self.is_available():
+            return []
+        try:
+            return list(data_ingest_manager.incidents_collection
+                        .find({"cluster_id": int(cluster_id)}, {"_id": 0})
+                        .sort("cluster_distance", 1)
+                        .limit(limit))
+        except Exception as e:
+            logger.error(f"Failed to load incidents for cluster {cluster_id}: {str(e)}")
+            return []
+
+
+def _run_update(context: JobContext):
+    """Job handler: fold new resolutions into the clusters until none are left, including any resolved mid-run"""
+    # A reset (re-ingest) while queued leaves nothing to update; the first fit stays an explicit action
+    while incident_clusterer.is_fitted() and not context.is_cancelled():
+        report = incident_clusterer.update_incremental()
+        if not report.get("success"):
+            context.update(inc={"failed": 1}, set_fields={"error": report.get("error")})
+            break
+        assigned = report.get("incidents_clustered", 0)
+        context.update(inc={"processed": assigned, "succeeded": assigned})
+        if not assigned:
+            break
+
+
+# Global instance
+incident_clusterer = IncidentClusterer()
+
+background_job_manager.register(UPDATE_JOB, _run_update)
@@ -0,0 +1,282 @@
+"""
+Time-bucketed incident rollups for trend analysis
+Maintains hourly and daily buckets of created / resolved counts, resolution time sums and a
+resolution time histogram - overall and per service, category and priority - updated with
+$inc on writes and rebuilt in one aggregation pass after ingest, so trend charts read bucket
+documents instead of incidents
+"""
+import time
+import logging
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime
+from collections import defaultdict
+
+import pandas as pd
+from pymongo import UpdateOne
+
+from utils.data_ingest import data_ingest_manager
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {"hourly": "%Y-%m-%dT%H:00:00", "daily": "%Y-%m-%dT00:00:00"}
+# Every event is counted once overall and once under each dimension
+DIMENSIONS = ["service", "category", "priority"]
+OVERALL = "all"
+UNSET = "unset"
+RESOLVED_STATUSES = ['Resolved', 'Closed']
+
+# Upper bounds (hours) of the resolution time histogram bins; slower resolutions fall in the last bin
+RESOLUTION_HISTOGRAM_HOURS = [1, 4, 8, 24, 72, 168]
+OVERFLOW_BIN = f"gt_{RESOLUTION_HISTOGRAM_HOURS[-1]}h"
+HISTOGRAM_BINS = [f"le_{hours}h" for hours in RESOLUTION_HISTOGRAM_HOURS] + [OVERFLOW_BIN]
+
+# Incident fields the rollups are keyed on
+ROLLUP_FIELDS_PROJECTION = {
+    "created_on": 1, "resolved_on": 1, "status": 1, "priority": 1, "service": 1, "category": 1
+}
+
+DIMENSION_EXPRESSIONS = {dimension: f"${dimension}" for dimension in DIMENSIONS}
+
+
+def _dimension_values(incident: Dict) -> Dict[str, str]:
+    """An incident's service, category and priority as the rollups key them"""
+    return {
+        dimension: str(incident.get(dimension) or UNSET) for dimension in DIMENSIONS
+    }
+
+
+def histogram_bin(seconds: float) -> str:
+    """Resolution time histogram bin for a duration"""
+    for hours, label in zip(RESOLUTION_HISTOGRAM_HOURS, HISTOGRAM_BINS):
+        if seconds <= hours * 3600:
+            return label
+    return OVERFLOW_BIN
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    """Start of the hourly or daily bucket containing a moment"""
+    if granularity == "daily":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _resolved_at(incident: Dict) -> Optional[datetime]:
+    """When an incident was resolved (None while it is open or when the time is unknown)"""
+    if incident.get("status") not in RESOLVED_STATUSES:
+        return None
+    resolved = incident.get("resolved_on")
+    return resolved if isinstance(resolved, datetime) else None
+
+
+def incident_events(incident: Optional[Dict]) -> List[tuple]:
+    """
+    (moment, dimension values, counters) an incident contributes to the rollups
+
+    Returns:
+        A created event when created_on is a date, plus a resolved event with its resolution
+        time and histogram bin once the incident is resolved
+    """
+    if not incident or not isinstance(incident.get("created_on"), datetime):
+        return []
+    created = incident["created_on"]
+    values = _dimension_values(incident)
+    events = [(created, values, {"created": 1})]
+    resolved = _resolved_at(incident)
+    if resolved:
+        seconds = max((resolved - created).total_seconds(), 0.0)
+        events.append((resolved, values, {"resolved": 1, "resolution_seconds_sum": seconds,
+                                          f"resolution_histogram.{histogram_bin(seconds)}": 1}))
+    return events
+
+
+def _bucket_key(bucket: datetime, dimension: str, value: str) -> str:
+    """Rollup document id"""
+    return f"{bucket:%Y-%m-%dT%H}|{dimension}|{value}"
+
+
+class IncidentRollups:
+    """Hourly and daily incident buckets, overall and per dimension"""
+
+    def __init__(self):
+        """Bind the rollup collections and their indexes"""
+        self.collections = {}
+        if data_ingest_manager.is_available():
+            for granularity in GRANULARITIES:
+                collection = data_ingest_manager.db[f"incident_rollups_{granularity}"]
+                collection.create_index([("dimension", 1), ("bucket", 1)])
+                self.collections[granularity] = collection
+
+    def is_available(self) -> bool:
+        """Check if rollups can be read and maintained"""
+        return data_ingest_manager.is_available() and bool(self.collections)
+
+    def _accumulate(self, deltas: Dict, moment: datetime, values: Dict[str, str], counters: Dict, sign: int):
+        """Add an event's counters to every bucket document it belongs to"""
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(moment, granularity)
+            for dimension, value in [(OVERALL, OVERALL)] + [(dimension, values[dimension]) for dimension in DIMENSIONS]:
+                document = deltas[granularity][(bucket, dimension, value)]
+                for field, amount in counters.items():
+                    document[field] += sign * amount
+
+    def _write(self, deltas: Dict):
+        """Apply accumulated counter deltas with one bulk $inc per granularity"""
+        for granularity, documents in deltas.items():
+            operations = [
+                UpdateOne({"_id": _bucket_key(bucket, dimension, value)},
+                          {"$inc": {field: amount for field, amount in counters.items() if amount},
+                           "$setOnInsert": {"bucket": bucket, "dimension": dimension, "value": value}},
+                          upsert=True)
+                for (bucket, dimension, value), counters in documents.items() if any(counters.values())
+            ]
+            if operations:
+                self.collections[granularity].bulk_write(operations, ordered=False)
+
+    def apply_changes(self, changes: Iterable[tuple]):
+        """
+        Move rollup counts for incident writes
+
+        Args:
+            changes: (before, after) incident documents (with ROLLUP_FIELDS_PROJECTION fields) per write;
+                before is None for a new incident
+        """
+        if not self.is_available():
+            return
+        deltas = {granularity: defaultdict(lambda: defaultdict(float)) for granularity in GRANULARITIES}
+        for before, after in changes:
+            for sign, incident in ((-1, before), (1, after)):
+                for moment, values, counters in incident_events(incident):
+                    self._accumulate(deltas, moment, values, counters, sign)
+        try:
+            self._write(deltas)
+        except Exception as e:
+            # A backfill rebuilds any bucket a failed increment leaves behind
+            logger.error(f"Failed to update incident rollups: {str(e)}")
+
+    def backfill(self) -> Dict:
+        """Rebuild every bucket from the incidents in one aggregation pass"""
+        if not self.is_available():
+            return {"success": False, "error": "MongoDB not available"}
+
+        started = time.perf_counter()
+        resolved_at = {"$cond": [{"$in": ["$status", RESOLVED_STATUSES]}, "$resolved_on", None]}
+        seconds = {"$max": [{"$divide": [{"$subtract": ["$$event.at", "$created_on"]}, 1000]}, 0]}
+        try:
+            rows = data_ingest_manager.incidents_collection.aggregate([
+                {"$match": {"created_on": {"$type": "date"}}},
+                {"$project": {
+                    "created_on": 1, **DIMENSION_EXPRESSIONS,
+                    "events": [{"kind": "created", "at": "$created_on"}, {"kind": "resolved", "at": resolved_at}]
+                }},
+                {"$unwind": "$events"},
+                {"$match": {"events.at": {"$type": "date"}}},
+                {"$project": {
+                    "service": 1, "category": 1, "priority": 1, "kind": "$events.kind",
+                    "hour": {"$dateToString": {"format": GRANULARITIES["hourly"], "date": "$events.at"}},
+                    "seconds": {"$cond": [{"$eq": ["$events.kind", "resolved"]},
+                                          {"$let": {"vars": {"event": "$events"}, "in": seconds}}, 0]}
+                }},
+                {"$project": {
+                    "service": 1, "category": 1, "priority": 1, "kind": 1, "hour": 1, "seconds": 1,
+                    "bin": {"$switch": {
+                        "branches": [{"case": {"$lte": ["$seconds", hours * 3600]}, "then": label}
+                                     for hours, label in zip(RESOLUTION_HISTOGRAM_HOURS, HISTOGRAM_BINS)],
+                        "default": OVERFLOW_BIN
+                    }}
+                }},
+                {"$group": {
+                    "_id": {"kind": "$kind", "hour": "$hour", "service": "$service", "category": "$category",
+                            "priority": "$priority", "bin": {"$cond": [{"$eq": ["$kind", "resolved"]}, "$bin", None]}},
+                    "count": {"$sum": 1},
+                    "seconds": {"$sum": "$seconds"}
+                }}
+            ], allowDiskUse=True)
+
+            deltas = {granularity: defaultdict(lambda: defaultdict(float)) for granularity in GRANULARITIES}
+            grouped_rows = 0
+            for row in rows:
+                key = row["_id"]
+                values = {dimension: str(key.get(dimension) or UNSET) for dimension in DIMENSIONS}
+                moment = datetime.strptime(key["hour"], GRANULARITIES["hourly"])
+                if key["kind"] == "created":
+                    counters = {"created": row["count"]}
+                else:
+                    counters = {"resolved": row["count"], "resolution_seconds_sum": row["seconds"],
+                                f"resolution_histogram.{key['bin']}": row["count"]}
+                self._accumulate(deltas, moment, values, counters, 1)
+                grouped_rows += 1
+
+            for collection in self.collections.values():
+                collection.delete_many({})
+            self._write(deltas)
+            buckets = {granularity: len(documents) for granularity, documents in deltas.items()}
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            logger.info(f"Backfilled incident rollups from {grouped_rows} grouped rows in {elapsed_ms:.0f}ms: {buckets}")
+            return {"success": True, "buckets": buckets, "elapsed_ms": elapsed_ms}
+
+        except Exception as e:
+            logger.error(f"Failed to backfill incident rollups: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def get_trend(self, granularity: str = "daily", dimension: str = OVERALL, start: Optional[datetime] = None,
+                  end: Optional[datetime] = None, values: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Trend rows for a period, read from bucket documents
+
+        Args:
+            granularity: "hourly" or "daily"
+            dimension: "all", "service", "category" or "priority"
+            start, end: Bucket range (inclusive start, exclusive end); defaults to everything
+            values: Restrict a dimension to these values
+
+        Returns:
+            DataFrame with bucket, value, created, resolved, mean_resolution_hours, the
+            resolution histogram bins and the open backlog at the end of each bucket
+        """
+        columns = ["bucket", "value", "created", "resolved", "mean_resolution_hours", "backlog"] + HISTOGRAM_BINS
+        if not self.is_available():
+            return pd.DataFrame(columns=columns)
+
+        try:
+            collection = self.collections[granularity]
+            query = {"dimension": dimension}
+            if values:
+                query["value"] = {"$in": values}
+            bucket_range = {}
+            if start:
+                bucket_range["$gte"] = start
+            if end:
+                bucket_range["$lt"] = end
+            if bucket_range:
+                query["bucket"] = bucket_range
+            documents = list(collection.find(query, {"_id": 0}).sort("bucket", 1))
+            if not documents:
+                return pd.DataFrame(columns=columns)
+
+            # The backlog carried into the period is everything created but not resolved before it
+            opening = {}
+            if start:
+                before = {key: condition for key, condition in query.items() if key != "bucket"}
+                before["bucket"] = {"$lt": start}
+                opening = {row["_id"]: row["created"] - row["resolved"] for row in collection.aggregate([
+                    {"$match": before},
+                    {"$group": {"_id": "$value", "created": {"$sum": "$created"}, "resolved": {"$sum": "$resolved"}}}
+                ])}
+
+            df = pd.json_normalize(documents)
+            df.columns = [column.replace("resolution_histogram.", "") for column in df.columns]
+            df = df.reindex(columns=["bucket", "value", "created", "resolved", "resolution_seconds_sum"] + HISTOGRAM_BINS)
+            numeric = ["created", "resolved", "resolution_seconds_sum"] + HISTOGRAM_BINS
+            df[numeric] = df[numeric].fillna(0)
+            df["mean_resolution_hours"] = (df["resolution_seconds_sum"] / df["resolved"].where(df["resolved"] > 0)) / 3600
+            df["backlog"] = (df.groupby("value")["created"].cumsum() - df.groupby("value")["resolved"].cumsum()
+                             + df["value"].map(opening).fillna(0))
+            return df[columns]
+
+        except Exception as e:
+            logger.error(f"Failed to load incident trend: {str(e)}")
+            return pd.DataFrame(columns=columns)
+
+
+# Global instance
+incident_rollups = IncidentRollups()
@@ -0,0 +1,107 @@
+"""
+Typed decoding schema for incident DataFrames
+Declares how each incident column is held in memory - low-cardinality fields as pandas
+categoricals over fixed category sets, timestamps as datetime64 and long text as
+Arrow-backed strings - and reports the memory saved against plain object columns
+"""
+import logging
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TEXT_DTYPE = "string[pyarrow]"
+
+# Column -> fixed category set (values seen outside it are appended, never dropped); None infers the
+# categories from the data for fields whose values depend on the loaded agents and reference data
+CATEGORICAL_FIELDS: Dict[str, Optional[List[str]]] = {
+    "status": ['Open', 'In Progress', 'Assigned', 'Resolved', 'Closed'],
+    "priority": ['P1', 'P2', 'P3', 'P4'],
+    "priority_label": ['P1', 'P2', 'P3', 'P4'],
+    "urgency": ['Low', 'Medium', 'High', 'Critical'],
+    "impact": ['Low', 'Medium', 'High', 'Critical'],
+    "category": ["Password Reset", "VPN Issues", "Multi-Factor Authentication", "Printer Support", "Email Problems",
+                 "WiFi Connectivity", "Software Installation", "File Share Access", "Phone System", "Hardware Failure",
+                 "Application Error", "Account Lockout", "Network Connectivity", "System Performance"],
+    "service": ["Workplace Technology", "Network Services", "Collaboration Tools", "Security Services", "Infrastructure"],
+    "location": ['Sydney', 'Melbourne', 'Brisbane', 'Perth', 'Adelaide'],
+    "channel": ['Phone', 'Email', 'Portal', 'Chat', 'Walk-in'],
+    "resolution_code": ['Fixed', 'Workaround', 'User Error', 'Duplicate'],
+    "assigned_to": None,
+    "group_name": None
+}
+
+DATETIME_FIELDS = ['created_on', 'updated_on', 'resolved_on', 'sla_due', '_ingested_at', '_updated_at']
+
+TEXT_FIELDS = ['incident_id', 'title', 'description', 'resolution_notes', 'customer_id']
+
+
+def _to_categorical(values: pd.Series, categories: Optional[List[str]]) -> pd.Series:
+    """Categorical over the declared categories plus any other values present (in sorted order)"""
+    present = values.dropna()
+    if not present.map(lambda value: isinstance(value, str)).all():
+        present = present.astype(str)
+        values = values.where(values.isna(), values.astype(str))
+    declared = list(categories or [])
+    extra = sorted(set(present.unique()) - set(declared))
+    if categories and extra:
+        logger.debug(f"Column {values.name} has values outside its declared categories: {extra[:10]}")
+    return pd.Series(pd.Categorical(values, categories=declared + extra), index=values.index, name=values.name)
+
+
+def _is_text(values: pd.Series) -> bool:
+    """Check an object column holds only strings (and missing values)"""
+    return values.dropna().map(lambda value: isinstance(value, str)).all()
+
+
+def decode_incidents(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert an incidents DataFrame to the declared in-memory types
+
+    Args:
+        df: Incidents as loaded from MongoDB (object columns); converted in place and returned
+
+    Returns:
+        The DataFrame with categorical, datetime64 and Arrow string columns; columns the schema does
+        not declare, and declared columns with unexpected value types, are left untouched
+    """
+    for column, categories in CATEGORICAL_FIELDS.items():
+        if column in df.columns and df[column].dtype == object:
+            df[column] = _to_categorical(df[column], categories)
+
+    for column in DATETIME_FIELDS:
+        if column in df.columns and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            parsed = pd.to_datetime(df[column].replace('', None), errors='coerce', utc=True, format='mixed')
+            df[column] = parsed.dt.tz_localize(None)
+
+    for column in TEXT_FIELDS:
+        if column in df.columns and df[column].dtype == object and _is_text(df[column]):
+            df[column] = df[column].astype(TEXT_DTYPE)
+
+    return df
+
+
+def memory_report(raw: pd.DataFrame, decoded: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-column memory footprint of an incidents DataFrame before and after decoding
+
+    Returns:
+        DataFrame with column, dtype_before, dtype_after, bytes_before, bytes_after and reduction
+        (before / after), plus a TOTAL row, largest savings first
+    """
+    before = raw.memory_usage(deep=True, index=False)
+    after = decoded.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        "column": before.index,
+        "dtype_before": [str(raw[column].dtype) for column in before.index],
+        "dtype_after": [str(decoded[column].dtype) if column in decoded.columns else "" for column in before.index],
+        "bytes_before": before.values,
+        "bytes_after": after.reindex(before.index).fillna(0).astype(int).values
+    })
+    report = report.sort_values("bytes_before", key=lambda sizes: sizes - report["bytes_after"], ascending=False)
+    total = pd.DataFrame([{"column": "TOTAL", "dtype_before": "", "dtype_after": "",
+                           "bytes_before": int(before.sum()), "bytes_after": int(after.sum())}])
+    report = pd.concat([report, total], ignore_index=True)
+    report["reduction"] = (report["bytes_before"] / report["bytes_after"].where(report["bytes_after"] > 0)).round(1)
+    return report
@@ -0,0 +1,403 @@
+"""
+UC-21 KB article generation
+Builds generation prompts from resolved incidents, parses the model's article, checks
+existing articles for coverage of the same incidents before any tokens are spent, and
+revises existing articles from only the incidents resolved since they were last written
+"""
+import json
+import hashlib
+import logging
+from typing import Dict, List, Optional
+from datetime import datetime
+
+from utils.data_ingest import data_ingest_manager
+from utils.text_features import incident_text
+
+logger = logging.getLogger(__name__)
+
+ARTICLE_SECTIONS = ["title", "problem", "root_cause", "solution", "prevention", "tags"]
+SECTION_LABELS = {
+    'Title:': 'title', 'Problem:': 'problem', 'Root Cause:': 'root_cause',
+    'Solution:': 'solution', 'Prevention:': 'prevention', 'Tags:': 'tags'
+}
+
+ARTICLE_FORMAT_INSTRUCTIONS = """Format your response exactly as:
+Title: [Clear, specific title]
+Problem: [What users experience]
+Root Cause: [Why this happens]
+Solution: [Step-by-step instructions]
+Prevention: [How to avoid this issue]
+Tags: [comma-separated keywords]"""
+
+RESOLVED_FILTER = {"resolution_notes": {"$nin": ["", None]}}
+DELTA_PROJECTION = {
+    "_id": 0, "incident_id": 1, "title": 1, "description": 1,
+    "resolution_notes": 1, "time_to_resolve_mins": 1, "clustered_at": 1
+}
+# Incidents join a cluster in (clustered_at, incident_id) order, which is also the order articles fold them in
+DELTA_SORT = [("clustered_at", 1), ("incident_id", 1)]
+# New incidents folded into one revision, keeping the update prompt roughly constant in size
+UPDATE_BATCH_SIZE = 10
+# Per-section cap on the existing article text quoted back to the model
+ARTICLE_SECTION_MAX_CHARS = 1500
+
+
+def cluster_signature(incident_ids: List[str]) -> str:
+    """Order-independent fingerprint of a set of source incidents"""
+    payload = json.dumps(sorted(str(incident_id) for incident_id in incident_ids))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def summarise_incidents(incidents: List[Dict]) -> str:
+    """Numbered issue/details/resolution summaries of resolved incidents for a prompt"""
+    summaries = []
+    for i, incident in enumerate(incidents, 1):
+        summary = f"{i}. **Issue:** {incident.get('title', 'No description')}"
+        if incident.get('description'):
+            summary += f"\n   **Details:** {str(incident.get('description', ''))[:100]}..."
+        if incident.get('resolution_notes'):
+            summary += f"\n   **Resolution:** {incident.get('resolution_notes', '')}"
+        if incident.get('time_to_resolve_mins'):
+            summary += f"\n   **Resolution Time:** {incident.get('time_to_resolve_mins')} minutes"
+        summaries.append(summary)
+    return '\n\n'.join(summaries)
+
+
+def build_generation_prompt(incidents: List[Dict]) -> str:
+    """Prompt for a new KB article from a cluster of resolved incidents"""
+    return f"""Analyze these {len(incidents)} resolved IT support tickets and create a comprehensive knowledge base article.
+
+RESOLVED TICKETS:
+{summarise_incidents(incidents)}
+
+Based on the common patterns in these resolved tickets, create a knowledge base article that would help users and support agents resolve similar issues quickly.
+
+Requirements:
+1. **Title**: Create a clear, searchable title that covers the main issue
+2. **Problem Description**: Describe what users typically experience
+3. **Root Cause**: Explain why this issue occurs
+4. **Solution Steps**: Provide step-by-step resolution instructions
+5. **Prevention**: Suggest how to prevent this issue
+6. **Tags**: List relevant keywords for searchability
+
+{ARTICLE_FORMAT_INSTRUCTIONS}
+"""
+
+
+def parse_article_response(response: Optional[str]) -> Dict[str, str]:
+    """Parse a 'Title / Problem / Root Cause / Solution / Prevention / Tags' response"""
+    sections = {section: "" for section in ARTICLE_SECTIONS}
+    if not response:
+        sections['title'] = "Generated Article"
+        return sections
+
+    current_section = None
+    for line in response.split('\n'):
+        line = line.strip()
+        label = next((label for label in SECTION_LABELS if line.startswith(label)), None)
+        if label:
+            current_section = SECTION_LABELS[label]
+            sections[current_section] = line.split(':', 1)[1].strip()
+            # Title and tags are single-line sections
+            if current_section in ('title', 'tags'):
+                current_section = None
+        elif current_section and line:
+            sections[current_section] += '\n' + line
+
+    return sections
+
+
+def build_update_prompt(article: Dict, new_incidents: List[Dict]) -> str:
+    """Prompt to revise an existing KB article with newly resolved incidents only"""
+    current = '\n'.join(
+        f"{label} {str(article.get(section) or '')[:ARTICLE_SECTION_MAX_CHARS]}"
+        for label, section in SECTION_LABELS.items()
+    )
+    return f"""Update this existing knowledge base article using {len(new_incidents)} newly resolved IT support tickets.
+
+CURRENT ARTICLE:
+{current}
+
+NEWLY RESOLVED TICKETS:
+{summarise_incidents(new_incidents)}
+
+Keep everything in the current article that is still accurate. Add any new symptoms, causes or
+resolution steps these tickets show, correct anything they contradict, and keep the article
+about the same length by tightening wording rather than appending. Return the complete revised article.
+
+{ARTICLE_FORMAT_INSTRUCTIONS}
+"""
+
+
+class KBCoverageChecker:
+    """Finds existing KB articles that already document a set of incidents"""
+
+    def __init__(self, overlap_threshold: float = 0.5, similarity_threshold: float = 0.6):
+        """Initialize the checker"""
+        self.overlap_threshold = overlap_threshold
+        self.similarity_threshold = similarity_threshold
+        if data_ingest_manager.is_available():
+            try:
+                data_ingest_manager.kb_articles_collection.create_index("source_incident_ids")
+                data_ingest_manager.kb_articles_collection.create_index("cluster_signature")
+            except Exception as e:
+                logger.warning(f"Could not create KB coverage indexes: {str(e)}")
+
+    def find_existing_coverage(self, incidents: List[Dict], limit: int = 3) -> List[Dict]:
+        """
+        Find articles covering the given incidents, best first
+
+        An article matches when it was generated from at least overlap_threshold of the same
+        incidents, or when its text embedding is at least similarity_threshold similar to theirs.
+
+        Returns:
+            List of dicts with article_id, title, overlap, similarity and reason
+        """
+        if not data_ingest_manager.is_available() or not incidents:
+            return []
+
+        incident_ids = [str(incident['incident_id']) for incident in incidents if incident.get('incident_id') is not None]
+        matches: Dict[str, Dict] = {}
+
+        try:
+            signature = cluster_signature(incident_ids)
+            for article in data_ingest_manager.kb_articles_collection.find(
+                {"$or": [{"cluster_signature": signature}, {"source_incident_ids": {"$in": incident_ids}}],
+                 "article_id": {"$type": "string"}},
+                {"_id": 0, "article_id": 1, "title": 1, "source_incident_ids": 1, "cluster_signature": 1}
+            ):
+                covered = len(set(article.get("source_incident_ids", [])) & set(incident_ids))
+                overlap = 1.0 if article.get("cluster_signature") == signature else covered / len(incident_ids)
+                if overlap >= self.overlap_threshold:
+                    matches[article["article_id"]] = {
+                        "article_id": article["article_id"], "title": article.get("title", ""),
+                        "overlap": overlap, "similarity": None,
+                        "reason": f"Generated from {overlap:.0%} of the same incidents"
+                    }
+        except Exception as e:
+            logger.error(f"Failed to check KB source overlap: {str(e)}")
+
+        try:
+            from utils.similarity_index import similarity_index
+            # Saved articles are embedded as they are written; the refresh only catches up edits made elsewhere
+            similarity_index.refresh_if_due()
+            query = similarity_index.embedder.embed([' '.join(incident_text(incident) for incident in incidents)])[0]
+            for hit in similarity_index.search_kb_articles(query, limit):
+                if hit["score"] < self.similarity_threshold:
+                    continue
+                if hit["id"] in matches:
+                    matches[hit["id"]]["similarity"] = hit["score"]
+                    continue
+                article = data_ingest_manager.kb_articles_collection.find_one(
+                    {"article_id": hit["id"]}, {"_id": 0, "article_id": 1, "title": 1})
+                if article:
+                    matches[hit["id"]] = {
+                        "article_id": hit["id"], "title": article.get("title", ""),
+                        "overlap": 0.0, "similarity": hit["score"],
+                        "reason": f"{hit['score']:.0%} similar to these incidents"
+                    }
+        except Exception as e:
+            logger.error(f"Failed to check KB embedding similarity: {str(e)}")
+
+        ranked = sorted(matches.values(), key=lambda match: (match["overlap"], match["similarity"] or 0.0), reverse=True)
+        return ranked[:limit]
+
+
+class KBArticleUpdater:
+    """Revises KB articles from the incidents resolved since each was last written, keeping every prior version"""
+
+    def __init__(self):
+        """Initialize the updater and its version history collection"""
+        if data_ingest_manager.is_available():
+            self.versions_collection = data_ingest_manager.db.kb_article_versions
+            try:
+                self.versions_collection.create_index([("article_id", 1), ("version", -1)], unique=True)
+                data_ingest_manager.incidents_collection.create_index([("cluster_id", 1), ("_id", 1)])
+            except Exception as e:
+                logger.warning(f"Could not create KB update indexes: {str(e)}")
+        else:
+            self.versions_collection = None
+
+    def is_available(self) -> bool:
+        """Check if articles can be updated"""
+        return self.versions_collection is not None
+
+    def _article_cluster_id(self, article: Dict) -> Optional[int]:
+        """The incident cluster an article documents: where most of its sources are now, else where it was generated from"""
+        source_ids = article.get("source_incident_ids") or []
+        if source_ids:
+            try:
+                top = list(data_ingest_manager.incidents_collection.aggregate([
+                    {"$match": {"incident_id": {"$in": source_ids}, "cluster_id": {"$exists": True}}},
+                    {"$group": {"_id": "$cluster_id", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}},
+                    {"$limit": 1}
+                ]))
+                if top:
+                    return top[0]["_id"]
+            except Exception as e:
+                logger.error(f"Failed to find cluster for KB article {article.get('article_id')}: {str(e)}")
+        return article.get("cluster_id")
+
+    def _watermark(self, article: Dict) -> Dict:
+        """(clustered_at, incident_id) of the last incident folded into the article (articles start at their creation time)"""
+        watermark = article.get("source_watermark")
+        if isinstance(watermark, dict) and isinstance(watermark.get("clustered_at"), datetime):
+            return watermark
+        created_at = article.get("_created_at")
+        return {"clustered_at": created_at if isinstance(created_at, datetime) else datetime(1970, 1, 1), "incident_id": ""}
+
+    def _delta_query(self, article: Dict) -> Optional[Dict]:
+        """Resolved incidents that joined the article's cluster after its watermark, other than its own sources"""
+        cluster_id = self._article_cluster_id(article)
+        if cluster_id is None:
+            return None
+        watermark = self._watermark(article)
+        return {
+            **RESOLVED_FILTER, "cluster_id": cluster_id,
+            # Sources come back after a re-ingest; skipping them keeps a batch from being all known
+            "incident_id": {"$nin": article.get("source_incident_ids") or []},
+            "$or": [{"clustered_at": {"$gt": watermark["clustered_at"]}},
+                    {"clustered_at": watermark["clustered_at"], "incident_id": {"$gt": watermark["incident_id"]}}]
+        }
+
+    def count_new_incidents(self, article: Dict) -> int:
+        """Number of incidents resolved since the article was last written"""
+        if not self.is_available():
+            return 0
+        query = self._delta_query(article)
+        if query is None:
+            return 0
+        try:
+            return data_ingest_manager.incidents_collection.count_documents(query)
+        except Exception as e:
+            logger.error(f"Failed to count new incidents for KB article {article.get('article_id')}: {str(e)}")
+            return 0
+
+    def get_new_incidents(self, article: Dict, limit: int = UPDATE_BATCH_SIZE) -> List[Dict]:
+        """The oldest incidents resolved since the article was last written, up to limit"""
+        if not self.is_available():
+            return []
+        query = self._delta_query(article)
+        if query is None:
+            return []
+        try:
+            return list(data_ingest_manager.incidents_collection.find(query, DELTA_PROJECTION).sort(DELTA_SORT).limit(limit))
+        except Exception as e:
+            logger.error(f"Failed to load new incidents for KB article {article.get('article_id')}: {str(e)}")
+            return []
+
+    def get_articles_with_new_incidents(self, limit: int = 50) -> List[Dict]:
+        """Incident-generated articles that have new resolved incidents waiting, with their counts"""
+        if not self.is_available():
+            return []
+        try:
+            articles = data_ingest_manager.kb_articles_collection.find(
+                {"article_id": {"$type": "string"}, "source_incident_ids": {"$exists": True}},
+                {"_id": 0, "article_id": 1, "title": 1, "version": 1, "cluster_id": 1,
+                 "source_incident_ids": 1, "source_watermark": 1, "_created_at": 1}
+            ).sort("_created_at", -1).limit(limit)
+            pending = []
+            for article in articles:
+                new_count = self.count_new_incidents(article)
+                if new_count:
+                    pending.append({"article_id": article["article_id"], "title": article.get("title", ""),
+                                    "version": article.get("version", 1), "new_incidents": new_count})
+            return pending
+        except Exception as e:
+            logger.error(f"Failed to find KB articles with new incidents: {str(e)}")
+            return []
+
+    def update_article(self, article_id: str, model_id: str, max_tokens: int = 1500, temperature: float = 0.7,
+                       system_prompt: Optional[str] = None, incidents: Optional[List[Dict]] = None) -> Dict:
+        """
+        Revise an article with newly resolved incidents and store it as a new version
+
+        Args:
+            article_id: Article to update
+            model_id: Bedrock model to use
+            max_tokens: Maximum tokens for the revised article
+            temperature: Sampling temperature
+            system_prompt: KB generation system prompt
+            incidents: Specific incidents to fold in; by default the next batch beyond the article's watermark
+
+        Returns:
+            Dict with success, version, incorporated and remaining (or error)
+        """
+        from utils.bedrock_client import bedrock_client
+
+        if not self.is_available():
+            return {"success": False, "error": "MongoDB not available"}
+
+        try:
+            article = data_ingest_manager.kb_articles_collection.find_one({"article_id": article_id})
+            if not article:
+                return {"success": False, "error": f"Article {article_id} not found"}
+
+            known_ids = set(article.get("source_incident_ids") or [])
+            from_watermark = incidents is None
+            if from_watermark:
+                incidents = self.get_new_incidents(article)
+            new_incidents = [incident for incident in incidents
+                             if incident.get("incident_id") is not None and str(incident["incident_id"]) not in known_ids]
+            if not new_incidents:
+                return {"success": False, "error": "No new resolved incidents to add"}
+
+            response = bedrock_client.invoke_model(build_update_prompt(article, new_incidents), model_id,
+                                                   max_tokens, temperature, system_prompt=system_prompt)
+            if not response:
+                return {"success": False, "error": "No response from the model"}
+            revised = parse_article_response(response)
+            if not revised["title"] or not revised["solution"]:
+                return {"success": False, "error": "Model response was not a complete article"}
+
+            version = article.get("version", 1)
+            source_ids = list(known_ids.union(str(incident["incident_id"]) for incident in new_incidents))
+            fields = {
+                **revised,
+                "source_incidents": len(source_ids),
+                "source_incident_ids": source_ids,
+                "cluster_signature": cluster_signature(source_ids),
+                "_updated_at": datetime.utcnow()
+            }
+            if from_watermark:
+                last = new_incidents[-1]
+                fields["source_watermark"] = {"clustered_at": last["clustered_at"], "incident_id": last["incident_id"]}
+
+            # Archive the current text, then swap in the revision only if nobody else revised it meanwhile
+            previous = {key: value for key, value in article.items() if key != "_id"}
+            self.versions_collection.insert_one({**previous, "version": version, "archived_at": datetime.utcnow()})
+            current_version = {"version": version} if "version" in article else {"version": {"$exists": False}}
+            result = data_ingest_manager.kb_articles_collection.update_one(
+                {"article_id": article_id, **current_version},
+                {"$set": {**fields, "version": version + 1}}
+            )
+            if result.modified_count == 0:
+                self.versions_collection.delete_one({"article_id": article_id, "version": version})
+                return {"success": False, "error": "Article was changed by someone else - try again"}
+
+            from utils.similarity_index import similarity_index
+            similarity_index.upsert_kb_article({**article, **fields})
+
+            remaining = self.count_new_incidents({**article, **fields}) if from_watermark else 0
+            logger.info(f"Updated KB article {article_id} to version {version + 1} with {len(new_incidents)} new incidents")
+            return {"success": True, "version": version + 1, "incorporated": len(new_incidents), "remaining": remaining}
+
+        except Exception as e:
+            logger.error(f"Failed to update KB article {article_id}: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def get_versions(self, article_id: str) -> List[Dict]:
+        """Prior versions of an article, newest first"""
+        if not self.is_available():
+            return []
+        try:
+            return list(self.versions_collection.find({"article_id": article_id}, {"_id": 0}).sort("version", -1))
+        except Exception as e:
+            logger.error(f"Failed to load versions of KB article {article_id}: {str(e)}")
+            return []
+
+
+# Global instances
+kb_coverage_checker = KBCoverageChecker()
+kb_article_updater = KBArticleUpdater()
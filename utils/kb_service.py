@@ -0,0 +1,198 @@
+"""
+Knowledge Base query layer
+Ranked full-text search, server-side filters and paginated title-only listings over
+kb_articles, with full article bodies loaded one at a time on demand
+"""
+import math
+import logging
+from typing import Dict, List, Optional
+from datetime import datetime
+
+import pymongo
+from pymongo import UpdateOne
+
+from utils.data_ingest import data_ingest_manager
+from utils.similarity_index import similarity_index
+
+logger = logging.getLogger(__name__)
+
+# Only what a listing row needs - bodies are fetched per article when opened
+LISTING_PROJECTION = {
+    "_id": 0, "article_id": 1, "title": 1, "service_id": 1, "category_id": 1, "publish_state": 1,
+    "ai_generated": 1, "tags": 1, "_created_at": 1
+}
+
+TEXT_INDEX_WEIGHTS = {"title": 10, "tags": 5, "problem": 2, "solution": 2, "body": 1}
+FILTER_FIELDS = ["service_id", "category_id", "publish_state"]
+
+
+class KnowledgeBaseService:
+    """Searches, lists and edits KB articles in MongoDB"""
+
+    def __init__(self):
+        """Initialize the service and its indexes"""
+        self.available = data_ingest_manager.is_available()
+        if self.available:
+            self.collection = data_ingest_manager.kb_articles_collection
+            self._ensure_indexes()
+        else:
+            self.collection = None
+
+    def _ensure_indexes(self):
+        """Create the text index and the filter/sort indexes"""
+        try:
+            self.collection.create_index(
+                [(field, pymongo.TEXT) for field in TEXT_INDEX_WEIGHTS],
+                weights=TEXT_INDEX_WEIGHTS,
+                name="kb_text_search",
+                default_language="english"
+            )
+            for field in FILTER_FIELDS:
+                self.collection.create_index([(field, 1), ("_created_at", -1)])
+            self.collection.create_index([("_created_at", -1)])
+        except Exception as e:
+            logger.warning(f"Could not create KB indexes: {str(e)}")
+
+    def build_query(self, search: Optional[str] = None, service_id: Optional[str] = None,
+                    category_id: Optional[str] = None, publish_state: Optional[str] = None) -> Dict:
+        """Build the MongoDB filter for a search term and optional field filters"""
+        query = {}
+        if search and search.strip():
+            query["$text"] = {"$search": search.strip()}
+        for field, value in (("service_id", service_id), ("category_id", category_id), ("publish_state", publish_state)):
+            if value not in (None, "", "All"):
+                query[field] = value
+        return query
+
+    def search_articles(self, search: Optional[str] = None, service_id: Optional[str] = None,
+                        category_id: Optional[str] = None, publish_state: Optional[str] = None,
+                        page: int = 1, page_size: int = 20) -> Dict:
+        """
+        Get one page of article listings
+
+        Results are ranked by text score when searching, otherwise newest first.
+
+        Returns:
+            Dict with articles (listing fields), total, ai_count, page and pages
+        """
+        empty = {"articles": [], "total": 0, "ai_count": 0, "page": 1, "pages": 1}
+        if not self.available:
+            return empty
+
+        try:
+            query = self.build_query(search, service_id, category_id, publish_state)
+            total = self.collection.count_documents(query)
+            ai_count = self.collection.count_documents({**query, "ai_generated": True})
+            pages = max(1, math.ceil(total / page_size))
+            page = min(max(1, page), pages)
+
+            projection = dict(LISTING_PROJECTION)
+            if "$text" in query:
+                projection["score"] = {"$meta": "textScore"}
+                sort = [("score", {"$meta": "textScore"})]
+            else:
+                sort = [("_created_at", -1)]
+
+            cursor = self.collection.find(query, projection).sort(sort).skip((page - 1) * page_size).limit(page_size)
+            articles = list(cursor)
+            return {"articles": articles, "total": total, "ai_count": ai_count, "page": page, "pages": pages}
+
+        except Exception as e:
+            logger.error(f"Failed to search KB articles: {str(e)}")
+            return empty
+
+    def get_filter_options(self) -> Dict[str, List]:
+        """Distinct values for each filter field"""
+        if not self.available:
+            return {field: [] for field in FILTER_FIELDS}
+        options = {}
+        for field in FILTER_FIELDS:
+            try:
+                options[field] = sorted(str(value) for value in self.collection.distinct(field) if value not in (None, ""))
+            except Exception as e:
+                logger.error(f"Failed to load KB filter values for {field}: {str(e)}")
+                options[field] = []
+        return options
+
+    def get_article(self, article_id: str) -> Optional[Dict]:
+        """Get a full article, including its body"""
+        if not self.available:
+            return None
+        try:
+            return self.collection.find_one({"article_id": article_id}, {"_id": 0})
+        except Exception as e:
+            logger.error(f"Failed to load KB article {article_id}: {str(e)}")
+            return None
+
+    def create_article(self, article: Dict) -> Optional[str]:
+        """Create an article, returning its newly allocated article_id"""
+        if data_ingest_manager.save_kb_article(article):
+            return article["article_id"]
+        return None
+
+    def update_article(self, article_id: str, fields: Dict) -> bool:
+        """Update an article's fields"""
+        if not self.available:
+            return False
+        try:
+            fields = {**fields, "_updated_at": datetime.utcnow()}
+            result = self.collection.update_one({"article_id": article_id}, {"$set": fields})
+            if result.modified_count > 0:
+                similarity_index.upsert_kb_article(self.collection.find_one({"article_id": article_id}, {"_id": 0}) or {})
+            return result.modified_count > 0
+        except Exception as e:
+            logger.error(f"Failed to update KB article {article_id}: {str(e)}")
+            return False
+
+    def delete_article(self, article_id: str) -> bool:
+        """Delete an article"""
+        if not self.available:
+            return False
+        try:
+            if self.collection.delete_one({"article_id": article_id}).deleted_count > 0:
+                similarity_index.remove_kb_article(article_id)
+                return True
+            return False
+        except Exception as e:
+            logger.error(f"Failed to delete KB article {article_id}: {str(e)}")
+            return False
+
+    def count_articles_without_id(self) -> int:
+        """Count articles created before article ids existed"""
+        if not self.available:
+            return 0
+        try:
+            return self.collection.count_documents({"article_id": {"$not": {"$type": "string"}}})
+        except Exception as e:
+            logger.error(f"Failed to count KB articles without ids: {str(e)}")
+            return 0
+
+    def migrate_article_ids(self) -> Dict:
+        """One-off migration: give every article without an article_id a newly allocated one, oldest first"""
+        if not self.available:
+            return {"success": False, "error": "MongoDB not available"}
+
+        try:
+            missing = list(self.collection.find({"article_id": {"$not": {"$type": "string"}}}, {"_id": 1})
+                           .sort([("_created_at", 1), ("_id", 1)]))
+            if not missing:
+                return {"success": True, "migrated": 0}
+
+            # Reserve a contiguous block of ids in one counter update
+            first = data_ingest_manager.next_sequence("kb_article_id", len(missing))
+            operations = [
+                UpdateOne({"_id": doc["_id"], "article_id": {"$not": {"$type": "string"}}},
+                          {"$set": {"article_id": f"KB{first + offset:06d}"}})
+                for offset, doc in enumerate(missing)
+            ]
+            migrated = self.collection.bulk_write(operations, ordered=False).modified_count
+            logger.info(f"Assigned article ids to {migrated} KB articles")
+            return {"success": True, "migrated": migrated}
+
+        except Exception as e:
+            logger.error(f"Failed to migrate KB article ids: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+
+# Global instance
+kb_service = KnowledgeBaseService()
@@ -0,0 +1,118 @@
+"""
+Server-side incident KPIs
+Computes the dashboard tiles and breakdowns with a single $facet aggregation so no incident
+rows leave MongoDB, caching the result against the incidents collection version
+"""
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+
+from utils.data_ingest import data_ingest_manager
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ['Open', 'In Progress', 'Assigned']
+HIGH_PRIORITIES = ['P1', 'P2']
+DUE_SOON_HOURS = 24
+# "Due soon" moves with the clock, so an unchanged collection is still recounted this often
+MAX_CACHE_AGE_SECONDS = 300
+
+QUEUE_FILTER = {
+    "status": {"$in": OPEN_STATUSES},
+    "$or": [{"assigned_to": {"$exists": False}}, {"assigned_to": None}, {"assigned_to": ""}]
+}
+
+# Breakdown name -> field expression
+BREAKDOWN_FIELDS = {
+    "by_status": "$status",
+    "by_priority": "$priority",
+    "by_category": "$category",
+    "by_service": "$service",
+    "by_location": "$location",
+    "by_channel": "$channel"
+}
+
+
+def build_kpi_pipeline(now: Optional[datetime] = None) -> List[Dict]:
+    """The $facet pipeline returning every dashboard KPI in one document"""
+    due_by = (now or datetime.utcnow()) + timedelta(hours=DUE_SOON_HOURS)
+    facets = {
+        "total": [{"$count": "count"}],
+        "queue_total": [{"$match": QUEUE_FILTER}, {"$count": "count"}],
+        "queue_high_priority": [
+            {"$match": QUEUE_FILTER},
+            {"$match": {"priority": {"$in": HIGH_PRIORITIES}}},
+            {"$count": "count"}
+        ],
+        # sla_due is a "YYYY-MM-DD HH:MM:SS" string (which sorts chronologically) or a BSON date
+        "queue_due_soon": [
+            {"$match": QUEUE_FILTER},
+            {"$match": {"$or": [
+                {"sla_due": {"$type": "string", "$lte": due_by.strftime('%Y-%m-%d %H:%M:%S'), "$gt": ""}},
+                {"sla_due": {"$type": "date", "$lte": due_by}}
+            ]}},
+            {"$count": "count"}
+        ]
+    }
+    for name, field in BREAKDOWN_FIELDS.items():
+        facets[name] = [
+            {"$group": {"_id": field, "count": {"$sum": 1}}},
+            {"$match": {"_id": {"$nin": ["", None]}}},
+            {"$sort": {"count": -1}}
+        ]
+    return [{"$facet": facets}]
+
+
+class MetricsService:
+    """Incident KPIs computed in MongoDB and cached per collection version"""
+
+    def __init__(self):
+        """Initialize an empty cache"""
+        self._lock = threading.Lock()
+        self._cache: Dict = {}
+
+    def empty_kpis(self) -> Dict:
+        """KPIs for an empty or unavailable collection"""
+        return {"total": 0, "queue_total": 0, "queue_high_priority": 0, "queue_due_soon": 0,
+                **{name: {} for name in BREAKDOWN_FIELDS}, "version": None, "computed_at": None}
+
+    def get_incident_kpis(self, force: bool = False) -> Dict:
+        """
+        Every incident KPI in one round trip
+
+        Returns:
+            Dict with total, queue_total, queue_high_priority and queue_due_soon counts, and
+            by_status / by_priority / by_category / by_service / by_location / by_channel value counts
+        """
+        if not data_ingest_manager.is_available():
+            return self.empty_kpis()
+
+        version = data_ingest_manager.get_collection_version('incidents')
+        with self._lock:
+            cached = self._cache.get('incidents')
+            if (not force and cached and version is not None and cached["version"] == version
+                    and time.monotonic() - cached["cached_at"] < MAX_CACHE_AGE_SECONDS):
+                return cached["kpis"]
+
+        try:
+            started = time.perf_counter()
+            result = next(data_ingest_manager.incidents_collection.aggregate(build_kpi_pipeline()), {})
+            kpis = {name: (result.get(name) or [{}])[0].get("count", 0)
+                    for name in ("total", "queue_total", "queue_high_priority", "queue_due_soon")}
+            for name in BREAKDOWN_FIELDS:
+                kpis[name] = {str(row["_id"]): row["count"] for row in result.get(name, [])}
+            kpis.update({"version": version, "computed_at": datetime.utcnow()})
+            logger.info(f"Computed incident KPIs in {(time.perf_counter() - started) * 1000:.0f}ms (version {version})")
+        except Exception as e:
+            logger.error(f"Failed to compute incident KPIs: {str(e)}")
+            return self.empty_kpis()
+
+        with self._lock:
+            self._cache['incidents'] = {"version": version, "cached_at": time.monotonic(), "kpis": kpis}
+        return kpis
+
+
+# Global instance
+metrics_service = MetricsService()
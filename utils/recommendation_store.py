@@ -0,0 +1,112 @@
+"""
+Persisted AI recommendations on incident documents
+Stores UC-02 triage and UC-31 assignment results on the incident itself, together with
+fingerprints of everything that went into the prompt, so results are reused until the
+incident text, agent roster or prompt changes
+"""
+import json
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime
+
+from utils.data_ingest import data_ingest_manager
+
+logger = logging.getLogger(__name__)
+
+# Incident fields that feed each prompt
+TRIAGE_INPUT_FIELDS = ['title', 'description']
+ASSIGNMENT_INPUT_FIELDS = ['title', 'description', 'category']
+
+
+def _fingerprint(payload) -> str:
+    """Stable short hash of any JSON-serialisable payload"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def _field_text(value) -> str:
+    """Normalise a field value so documents and DataFrame rows (NaN) hash the same"""
+    if value is None or value != value:
+        return ''
+    return str(value)
+
+
+def incident_fingerprint(incident: Dict, fields: Iterable[str] = TRIAGE_INPUT_FIELDS) -> str:
+    """Fingerprint of the incident text used in a prompt (accepts dicts or DataFrame rows)"""
+    return _fingerprint([_field_text(incident.get(field)) for field in fields])
+
+
+def roster_fingerprint(agent_lines: List[str]) -> str:
+    """Fingerprint of the rendered agent roster (skills, workload, status)"""
+    return _fingerprint(sorted(agent_lines))
+
+
+class RecommendationStore:
+    """Reads and writes ai_triage / ai_assignment sub-documents on incidents"""
+
+    def save_triage(self, incident_id: str, result: Dict, model_id: str, prompt_hash: str, input_hash: str) -> bool:
+        """Persist a triage recommendation on the incident"""
+        return self._save(incident_id, "ai_triage", {
+            "priority": result.get("priority"),
+            "reasoning": result.get("reasoning"),
+            "confidence": result.get("confidence"),
+            "model_id": model_id,
+            "prompt_hash": prompt_hash,
+            "input_hash": input_hash,
+            "classified_at": datetime.utcnow()
+        })
+
+    def save_assignment(self, incident_id: str, result: Dict, model_id: str, prompt_hash: str,
+                        input_hash: str, roster_hash: str) -> bool:
+        """Persist an agent assignment recommendation on the incident"""
+        return self._save(incident_id, "ai_assignment", {
+            "agent": result.get("agent"),
+            "reasoning": result.get("reasoning"),
+            "confidence": result.get("confidence"),
+            "model_id": model_id,
+            "prompt_hash": prompt_hash,
+            "input_hash": input_hash,
+            "roster_hash": roster_hash,
+            "recommended_at": datetime.utcnow()
+        })
+
+    def _save(self, incident_id: str, field: str, recommendation: Dict) -> bool:
+        """Write a recommendation sub-document"""
+        if not data_ingest_manager.is_available():
+            return False
+
+        try:
+            result = data_ingest_manager.incidents_collection.update_one(
+                {"incident_id": incident_id},
+                {"$set": {field: recommendation, "_updated_at": datetime.utcnow()}}
+            )
+            if result.matched_count:
+                data_ingest_manager.bump_collection_version('incidents')
+            return result.matched_count > 0
+        except Exception as e:
+            logger.error(f"Failed to save {field} for incident {incident_id}: {str(e)}")
+            return False
+
+    def get(self, incident_id: str) -> Dict[str, Optional[Dict]]:
+        """Get the stored triage and assignment recommendations for an incident"""
+        if not data_ingest_manager.is_available():
+            return {"ai_triage": None, "ai_assignment": None}
+
+        try:
+            doc = data_ingest_manager.incidents_collection.find_one(
+                {"incident_id": incident_id}, {"_id": 0, "ai_triage": 1, "ai_assignment": 1}
+            ) or {}
+            return {"ai_triage": doc.get("ai_triage"), "ai_assignment": doc.get("ai_assignment")}
+        except Exception as e:
+            logger.error(f"Failed to load recommendations for incident {incident_id}: {str(e)}")
+            return {"ai_triage": None, "ai_assignment": None}
+
+    def is_fresh(self, recommendation: Optional[Dict], **fingerprints) -> bool:
+        """Check a stored recommendation was produced from the same inputs"""
+        if not recommendation:
+            return False
+        return all(recommendation.get(key) == value for key, value in fingerprints.items())
+
+
+# Global instance
+recommendation_store = RecommendationStore()
@@ -0,0 +1,255 @@
+"""
+Memory-mapped Arrow snapshots shared across processes
+Publishes a collection as an Arrow IPC file tagged with the collection epoch and version; every
+Streamlit process memory-maps the same file read-only and hands out Arrow-backed DataFrame
+views of it, so N sessions share one physical copy of the data instead of N DataFrames.
+The file also records the highest _updated_at / _ingested_at it holds, so a refresh reads
+only the documents written (or deleted) since then and merges them in by key
+"""
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utils.data_ingest import data_ingest_manager, TOMBSTONE_TTL
+from utils.triage_model import MODELS_DIR
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.path.join(MODELS_DIR, "arrow")
+VERSION_KEY = b"collection_version"
+# Changes when the version counter was reset (e.g. metadata cleared), so a restarted version never matches
+EPOCH_KEY = b"collection_epoch"
+# Highest _updated_at / _ingested_at held, latest tombstone applied and when the file was last synced
+WATERMARK_KEY = b"watermark"
+DELETIONS_KEY = b"deletions_watermark"
+SYNCED_KEY = b"synced_at"
+
+# Write timestamps a delta refresh compares against the snapshot's watermark
+WATERMARK_FIELDS = ('_updated_at', '_ingested_at')
+# Re-read writes this close to the watermark, in case one committed after a later-stamped one was read
+WATERMARK_OVERLAP = timedelta(seconds=5)
+# Rebuild the whole file instead of merging when more than this share of the rows changed
+FULL_REFRESH_RATIO = 0.5
+
+
+def _to_arrow_column(values: pd.Series) -> pa.Array:
+    """Arrow array for a document field, falling back to text when its values have mixed types"""
+    try:
+        return pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return pa.array([None if value is None or (isinstance(value, float) and value != value)
+                         else value if isinstance(value, str) else json.dumps(value, default=str)
+                         for value in values], type=pa.string())
+
+
+def documents_watermark(documents: List[Dict]) -> Optional[datetime]:
+    """Latest write timestamp among a list of documents (None when none is stamped)"""
+    stamps = [document[field] for document in documents for field in WATERMARK_FIELDS
+              if isinstance(document.get(field), datetime)]
+    return max(stamps, default=None)
+
+
+def _write_stamps(document: Dict) -> tuple:
+    """A document's write timestamps, comparable between MongoDB documents and Arrow rows"""
+    return tuple(pd.Timestamp(value) if isinstance(value, datetime) else None if value is pd.NaT else value
+                 for value in (document.get(field) for field in WATERMARK_FIELDS))
+
+
+def tag_table(table: pa.Table, version: int, epoch: Optional[str], marks: Dict[bytes, Optional[datetime]]) -> pa.Table:
+    """Record the collection epoch, version and sync timestamps a table was built from in its schema metadata"""
+    metadata = {VERSION_KEY: str(version).encode(), EPOCH_KEY: (epoch or "").encode()}
+    metadata.update({key: mark.isoformat().encode() for key, mark in marks.items() if mark is not None})
+    return table.replace_schema_metadata(metadata)
+
+
+def table_marks(table: pa.Table) -> Dict[bytes, Optional[datetime]]:
+    """Sync timestamps recorded in a table's schema metadata"""
+    metadata = table.schema.metadata or {}
+    return {key: datetime.fromisoformat(metadata[key].decode()) if metadata.get(key) else None
+            for key in (WATERMARK_KEY, DELETIONS_KEY, SYNCED_KEY)}
+
+
+def documents_to_table(documents: List[Dict], version: int) -> pa.Table:
+    """Arrow table for a list of MongoDB documents, tagged with the collection version"""
+    df = pd.DataFrame(documents)
+    if '_id' in df.columns:
+        df = df.drop('_id', axis=1)
+    table = pa.Table.from_arrays([_to_arrow_column(df[column]) for column in df.columns], names=[str(c) for c in df.columns])
+    return table.replace_schema_metadata({VERSION_KEY: str(version).encode()})
+
+
+class SharedSnapshot:
+    """One collection's Arrow IPC snapshot, published once and memory-mapped by every process"""
+
+    def __init__(self, collection: str, key: str = 'incident_id', snapshot_dir: str = SNAPSHOT_DIR):
+        """Initialize the snapshot for a collection whose documents are identified by key"""
+        self.collection = collection
+        self.key = key
+        self.path = os.path.join(snapshot_dir, f"{collection}.arrow")
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._frame: Optional[pd.DataFrame] = None
+
+    def _file_version(self) -> Optional[tuple]:
+        """(epoch, version) the published file was built from (None when there is no readable file)"""
+        try:
+            with pa.memory_map(self.path, 'r') as source:
+                metadata = pa.ipc.open_file(source).schema.metadata or {}
+            if not metadata.get(VERSION_KEY):
+                return None
+            return metadata.get(EPOCH_KEY, b"").decode() or None, metadata[VERSION_KEY].decode()
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+    def _write(self, table: pa.Table):
+        """Write a table to the snapshot file, replacing any previous one atomically"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Per-process temporary name so concurrent publishers never interleave writes; processes still
+        # mapping the old file keep reading it until they remap
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, self.path)
+
+    def publish(self, version: int, epoch: Optional[str] = None) -> int:
+        """Export the whole collection to the snapshot file"""
+        started = time.perf_counter()
+        synced_at = datetime.utcnow()
+        deleted_through = data_ingest_manager.last_deletion_at(self.collection)
+        documents = list(data_ingest_manager.db[self.collection].find({}, {'_id': 0}))
+        table = documents_to_table(documents, version)
+        self._write(tag_table(table, version, epoch, {WATERMARK_KEY: documents_watermark(documents),
+                                               DELETIONS_KEY: deleted_through, SYNCED_KEY: synced_at}))
+        logger.info(f"Published {self.collection} Arrow snapshot ({table.num_rows} rows, version {version}) "
+                    f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return table.num_rows
+
+    def _changed_keys(self, watermark: datetime, table: pa.Table) -> Set:
+        """
+        Keys of documents written after the watermark (served by the _updated_at / _ingested_at indexes)
+
+        Documents in the overlap window whose write timestamps match their row in the table are
+        already held, so a batch stamped together is not re-read on every merge.
+        """
+        since = watermark - WATERMARK_OVERLAP
+        query = {"$or": [{"_updated_at": {"$gte": since}}, {"_ingested_at": {"$gte": since}}]}
+        projection = {'_id': 0, self.key: 1, **{field: 1 for field in WATERMARK_FIELDS}}
+        written = {document.get(self.key): _write_stamps(document)
+                   for document in data_ingest_manager.db[self.collection].find(query, projection)}
+
+        stamp_columns = [field for field in WATERMARK_FIELDS if field in table.column_names]
+        candidates = [str(key) for key, stamps in written.items() if key is not None and any(
+            stamp is not None and stamp <= watermark for stamp in stamps)]
+        if not candidates or not stamp_columns:
+            return set(written)
+        held_rows = table.filter(pc.is_in(table[self.key].cast(pa.string()), value_set=pa.array(candidates, pa.string())))
+        held = {str(row[self.key]): _write_stamps(row) for row in held_rows.select([self.key, *stamp_columns]).to_pylist()}
+        return {key for key, stamps in written.items() if held.get(str(key)) != stamps}
+
+    def merge_changes(self, version: int, epoch: Optional[str] = None) -> Optional[int]:
+        """
+        Bring the published file up to a collection version by merging in only what changed
+
+        Every row whose key was written or tombstoned since the file was synced is replaced by the
+        documents currently stored under that key (none, for a deletion).
+
+        Returns:
+            Number of documents read from MongoDB, or None when the file has to be rebuilt in full
+            (no readable file or watermark, a different epoch, the collection was cleared, tombstones
+            may have expired, or more than FULL_REFRESH_RATIO of the rows changed)
+        """
+        started = time.perf_counter()
+        try:
+            with pa.memory_map(self.path, 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (OSError, pa.ArrowInvalid):
+            return None
+        marks = table_marks(table)
+        synced_at = datetime.utcnow()
+        file_epoch = (table.schema.metadata or {}).get(EPOCH_KEY, b"").decode() or None
+        if (marks[WATERMARK_KEY] is None or self.key not in table.column_names or file_epoch != epoch
+                or marks[SYNCED_KEY] is None or marks[SYNCED_KEY] < synced_at - TOMBSTONE_TTL):
+            return None
+
+        # Read the latest tombstone first: one recorded in between is merged again next time, never missed
+        deleted_through = data_ingest_manager.last_deletion_at(self.collection) or marks[DELETIONS_KEY]
+        deleted = data_ingest_manager.get_deletions(self.collection, marks[DELETIONS_KEY])
+        if deleted is None:
+            return None
+        keys = self._changed_keys(marks[WATERMARK_KEY], table) | deleted
+        if None in keys or len(keys) > table.num_rows * FULL_REFRESH_RATIO:
+            return None
+
+        documents = list(data_ingest_manager.db[self.collection].find({self.key: {"$in": list(keys)}}, {'_id': 0}))
+        replaced = pc.is_in(table[self.key].cast(pa.string()), value_set=pa.array([str(key) for key in keys], pa.string()))
+        merged = table.filter(pc.invert(replaced))
+        if documents:
+            merged = pa.concat_tables([merged, documents_to_table(documents, version)], promote_options="permissive")
+        watermark = max(filter(None, [marks[WATERMARK_KEY], documents_watermark(documents)]))
+        self._write(tag_table(merged, version, epoch, {WATERMARK_KEY: watermark, DELETIONS_KEY: deleted_through,
+                                                SYNCED_KEY: synced_at}))
+        logger.info(f"Merged {len(documents)} changed {self.collection} documents into the Arrow snapshot "
+                    f"({merged.num_rows} rows, version {version}) in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return len(documents)
+
+    def refresh(self, version: int, epoch: Optional[str] = None) -> int:
+        """Update the snapshot file to a collection version, merging changes when possible"""
+        try:
+            merged = self.merge_changes(version, epoch)
+            if merged is not None:
+                return merged
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            # e.g. a field changed type; rebuilding derives one type from all the documents
+            logger.warning(f"Could not merge {self.collection} changes into the Arrow snapshot: {str(e)}")
+        return self.publish(version, epoch)
+
+    def _map(self) -> pd.DataFrame:
+        """Memory-map the published file and wrap it in a zero-copy Arrow-backed DataFrame"""
+        source = pa.memory_map(self.path, 'r')
+        table = pa.ipc.open_file(source).read_all()
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    def get_frame(self) -> Optional[pd.DataFrame]:
+        """
+        The current snapshot as a read-only DataFrame view
+
+        Returns:
+            Arrow-backed DataFrame sharing the memory-mapped buffers (a shallow copy, so adding
+            columns is private to the caller; values must not be modified in place), or None
+            when MongoDB is unavailable or the snapshot could not be published
+        """
+        if not data_ingest_manager.is_available():
+            return None
+
+        version = data_ingest_manager.get_collection_version(self.collection)
+        if version is None:
+            # Never versioned (e.g. after a metadata reset); start counting so the file can be validated
+            data_ingest_manager.bump_collection_version(self.collection)
+            version = data_ingest_manager.get_collection_version(self.collection)
+        # The version alone is not enough: it restarts at 1 when the metadata is cleared
+        epoch = data_ingest_manager.get_collection_epoch(self.collection)
+        stamp = (epoch, str(version))
+
+        with self._lock:
+            if self._frame is None or self._stamp != stamp:
+                try:
+                    if self._file_version() != stamp:
+                        self.refresh(version, epoch)
+                    self._frame, self._stamp = self._map(), stamp
+                except Exception as e:
+                    logger.error(f"Failed to load {self.collection} Arrow snapshot: {str(e)}")
+                    return None
+            return self._frame.copy(deep=False)
+
+
+# Global instance
+incidents_snapshot = SharedSnapshot('incidents')
@@ -0,0 +1,349 @@
+"""
+Vector similarity index for "similar incidents" and KB suggestions
+Embeds incidents and KB articles locally (hashed bag-of-words reduced with a fixed sparse
+random projection - no network, no fitted vocabulary) and answers top-k cosine queries
+with a brute-force scan over a contiguous float32 matrix persisted to disk
+"""
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import scipy.sparse as sp
+from bson import ObjectId
+from sklearn.random_projection import SparseRandomProjection
+
+from utils.data_ingest import data_ingest_manager
+from utils.background_jobs import background_job_manager, JobContext
+from utils.text_features import incident_text, build_hashing_vectorizer, INCIDENT_TEXT_FIELDS
+from utils.triage_model import MODELS_DIR
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = os.path.join(MODELS_DIR, "similarity")
+EMBEDDING_DIM = 384
+EMBEDDING_N_FEATURES = 2 ** 18
+
+RESOLVED_FILTER = {"resolution_notes": {"$nin": ["", None]}}
+KB_TEXT_FIELDS = ['title', 'problem', 'root_cause', 'solution', 'tags', 'body', 'summary']
+SIMILARITY_REFRESH_JOB = "similarity_refresh"
+# Edits stamped just before a refresh's read may commit after it
+KB_WATERMARK_OVERLAP = timedelta(seconds=5)
+
+
+def _document_ids(keys: List[str]) -> List:
+    """Turn index keys back into MongoDB _id values"""
+    return [ObjectId(key) if ObjectId.is_valid(key) else key for key in keys]
+
+
+def kb_article_text(article: Dict) -> str:
+    """Build a single text string from a KB article's searchable fields"""
+    return ' '.join(str(article[field]) for field in KB_TEXT_FIELDS if article.get(field))
+
+
+class TextEmbedder:
+    """Stateless local text embedding: hashed unigrams/bigrams projected to a dense unit vector"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, n_features: int = EMBEDDING_N_FEATURES):
+        """Initialize the embedder (the projection is fixed by its random seed)"""
+        self.vectorizer = build_hashing_vectorizer(n_features=n_features)
+        # ~4 non-zeros per input feature, so every hashed term reaches a few output dimensions
+        self.projection = SparseRandomProjection(n_components=dim, density=4 / dim, random_state=42, dense_output=True)
+        # Fitting only needs the input width to draw the projection matrix
+        self.projection.fit(sp.csr_matrix((1, n_features)))
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into L2-normalised float32 rows"""
+        vectors = np.ascontiguousarray(self.projection.transform(self.vectorizer.transform(texts)), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class VectorIndex:
+    """Append-friendly contiguous float32 matrix of unit vectors keyed by string id"""
+
+    def __init__(self, name: str, dim: int = EMBEDDING_DIM, index_dir: str = INDEX_DIR):
+        """Initialize an empty index, loading it from disk if present"""
+        self.name = name
+        self.dim = dim
+        self.matrix_path = os.path.join(index_dir, f"{name}.npy")
+        self.ids_path = os.path.join(index_dir, f"{name}_ids.json")
+        self._clear()
+        self.load()
+
+    def _clear(self):
+        """Reset to an empty index"""
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        # Rows beyond len(ids) are spare capacity so appends stay amortised O(1)
+        self._buffer = np.zeros((0, self.dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        """Number of indexed vectors"""
+        return len(self.ids)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The populated rows (a view, not a copy)"""
+        return self._buffer[:len(self.ids)]
+
+    def upsert(self, ids: List[str], vectors: np.ndarray):
+        """Insert new vectors or overwrite the vectors of existing ids"""
+        new_rows = [i for i, item_id in enumerate(ids) if item_id not in self.positions]
+        needed = len(self.ids) + len(new_rows)
+        if needed > len(self._buffer):
+            grown = np.zeros((max(needed, 2 * len(self._buffer), 1024), self.dim), dtype=np.float32)
+            grown[:len(self.ids)] = self.matrix
+            self._buffer = grown
+
+        for item_id, vector in zip(ids, vectors):
+            position = self.positions.get(item_id)
+            if position is None:
+                position = len(self.ids)
+                self.positions[item_id] = position
+                self.ids.append(item_id)
+            self._buffer[position] = vector
+
+    def remove(self, ids: Iterable[str]):
+        """Drop ids, compacting the matrix"""
+        remove = set(ids) & self.positions.keys()
+        if not remove:
+            return
+        keep = [position for position, item_id in enumerate(self.ids) if item_id not in remove]
+        self._buffer = np.ascontiguousarray(self.matrix[keep])
+        self.ids = [self.ids[position] for position in keep]
+        self.positions = {item_id: position for position, item_id in enumerate(self.ids)}
+
+    def search(self, query: np.ndarray, k: int = 5, exclude: Optional[Iterable[str]] = None) -> List[Dict]:
+        """Top-k ids by cosine similarity to a unit query vector"""
+        if not self.ids:
+            return []
+        exclude = set(exclude or [])
+        scores = self.matrix @ query.astype(np.float32)
+        take = min(k + len(exclude), len(scores))
+        top = np.argpartition(-scores, take - 1)[:take]
+        top = top[np.argsort(-scores[top])]
+        return [{"id": self.ids[i], "score": float(scores[i])} for i in top if self.ids[i] not in exclude][:k]
+
+    def load(self) -> bool:
+        """Load the index from disk"""
+        if not (os.path.exists(self.matrix_path) and os.path.exists(self.ids_path)):
+            return False
+        try:
+            matrix = np.load(self.matrix_path)
+            with open(self.ids_path) as f:
+                ids = json.load(f)
+            if matrix.shape != (len(ids), self.dim):
+                logger.warning(f"Discarding {self.name} similarity index with mismatched shape {matrix.shape}")
+                return False
+            self._buffer = np.ascontiguousarray(matrix, dtype=np.float32)
+            self.ids = ids
+            self.positions = {item_id: position for position, item_id in enumerate(ids)}
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load {self.name} similarity index: {str(e)}")
+            return False
+
+    def save(self) -> bool:
+        """Persist the index to disk (files are atomically replaced)"""
+        try:
+            os.makedirs(os.path.dirname(self.matrix_path), exist_ok=True)
+            with open(f"{self.matrix_path}.tmp", "wb") as f:
+                np.save(f, self.matrix)
+            with open(f"{self.ids_path}.tmp", "w") as f:
+                json.dump(self.ids, f)
+            os.replace(f"{self.matrix_path}.tmp", self.matrix_path)
+            os.replace(f"{self.ids_path}.tmp", self.ids_path)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save {self.name} similarity index: {str(e)}")
+            return False
+
+
+class SimilarityIndex:
+    """Similar resolved incidents and related KB articles for a given incident"""
+
+    REFRESH_INTERVAL_SECONDS = 300
+
+    def __init__(self):
+        """Initialize the embedder and load the persisted indexes"""
+        self.embedder = TextEmbedder()
+        self.incidents = VectorIndex("incidents")
+        self.kb_articles = VectorIndex("kb_articles")
+        # Guards the in-memory indexes; never held while reading MongoDB or embedding
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0.0
+        self._incidents_stamp = None
+        self._kb_synced_at: Optional[datetime] = None
+
+    def refresh(self, batch_size: int = 5000) -> Dict[str, int]:
+        """
+        Bring both indexes up to date with MongoDB
+
+        Resolved incidents are diffed by document _id, so only new ones are embedded (a
+        regenerated dataset gets fresh _ids even when incident ids repeat), and the diff is
+        skipped while the incidents collection version is unchanged. KB articles are diffed by
+        article_id, and only new articles or ones edited since the last refresh (by _updated_at)
+        are re-embedded.
+        """
+        if not data_ingest_manager.is_available():
+            return {"incidents_added": 0, "incidents_removed": 0, "kb_articles": 0}
+
+        with self._refresh_lock:
+            try:
+                added, removed = self._refresh_incidents(batch_size)
+                embedded = self._refresh_kb_articles()
+                self._last_refresh = time.monotonic()
+                logger.info(f"Similarity index refreshed: +{added} / -{removed} incidents, "
+                            f"{embedded} KB articles embedded")
+                return {"incidents_added": added, "incidents_removed": removed, "kb_articles": embedded}
+
+            except Exception as e:
+                logger.error(f"Failed to refresh similarity index: {str(e)}")
+                return {"incidents_added": 0, "incidents_removed": 0, "kb_articles": 0}
+
+    def _refresh_incidents(self, batch_size: int):
+        """Embed new resolved incidents and drop deleted ones, returning (added, removed)"""
+        # Read before scanning, so a write landing mid-scan bumps the version past this stamp
+        stamp = (data_ingest_manager.get_collection_epoch('incidents'),
+                 data_ingest_manager.get_collection_version('incidents'))
+        if stamp[1] is not None and stamp == self._incidents_stamp:
+            return 0, 0
+
+        collection = data_ingest_manager.incidents_collection
+        current_ids = {str(doc["_id"]) for doc in collection.find(RESOLVED_FILTER, {"_id": 1})}
+        with self._lock:
+            removed = set(self.incidents.ids) - current_ids
+            self.incidents.remove(removed)
+            missing = [key for key in current_ids if key not in self.incidents.positions]
+
+        projection = {field: 1 for field in INCIDENT_TEXT_FIELDS}
+        for start in range(0, len(missing), batch_size):
+            batch = list(collection.find({"_id": {"$in": _document_ids(missing[start:start + batch_size])}}, projection))
+            vectors = self.embedder.embed([incident_text(doc) for doc in batch])
+            with self._lock:
+                self.incidents.upsert([str(doc["_id"]) for doc in batch], vectors)
+        if missing or removed:
+            with self._lock:
+                self.incidents.save()
+
+        self._incidents_stamp = stamp
+        return len(missing), len(removed)
+
+    def _refresh_kb_articles(self) -> int:
+        """Embed new and recently edited KB articles and drop deleted ones, returning how many were embedded"""
+        collection = data_ingest_manager.kb_articles_collection
+        synced_at = datetime.utcnow()
+        current_ids = {doc["article_id"] for doc in collection.find({"article_id": {"$type": "string"}}, {"article_id": 1})}
+        with self._lock:
+            removed = set(self.kb_articles.ids) - current_ids
+            self.kb_articles.remove(removed)
+            stale = [article_id for article_id in current_ids if article_id not in self.kb_articles.positions]
+
+        query = {"article_id": {"$in": stale}}
+        if self._kb_synced_at is not None:
+            query = {"$or": [query, {"article_id": {"$type": "string"},
+                                     "_updated_at": {"$gte": self._kb_synced_at - KB_WATERMARK_OVERLAP}}]}
+        articles = list(collection.find(query, {"article_id": 1, **{field: 1 for field in KB_TEXT_FIELDS}}))
+        if articles:
+            vectors = self.embedder.embed([kb_article_text(article) for article in articles])
+            with self._lock:
+                self.kb_articles.upsert([article["article_id"] for article in articles], vectors)
+        if articles or removed:
+            with self._lock:
+                self.kb_articles.save()
+
+        self._kb_synced_at = synced_at
+        return len(articles)
+
+    def refresh_if_due(self) -> Optional[str]:
+        """Start a background refresh when the last one is older than REFRESH_INTERVAL_SECONDS"""
+        if time.monotonic() - self._last_refresh < self.REFRESH_INTERVAL_SECONDS:
+            return None
+        # Counted from the start, so callers in the meantime don't keep re-starting the job
+        self._last_refresh = time.monotonic()
+        return background_job_manager.start_job(SIMILARITY_REFRESH_JOB, total=1)
+
+    def upsert_kb_article(self, article: Dict):
+        """Embed a saved or edited KB article so it is searchable straight away"""
+        if not isinstance(article.get("article_id"), str):
+            return
+        try:
+            vector = self.embedder.embed([kb_article_text(article)])
+            with self._lock:
+                self.kb_articles.upsert([article["article_id"]], vector)
+                self.kb_articles.save()
+        except Exception as e:
+            logger.error(f"Failed to index KB article {article['article_id']}: {str(e)}")
+
+    def remove_kb_article(self, article_id: str):
+        """Drop a deleted KB article from the index"""
+        with self._lock:
+            if article_id in self.kb_articles.positions:
+                self.kb_articles.remove([article_id])
+                self.kb_articles.save()
+
+    def search_incidents(self, query: np.ndarray, k: int = 5) -> List[Dict]:
+        """Top-k resolved incident ids by cosine similarity to a unit query vector"""
+        with self._lock:
+            return self.incidents.search(query, k)
+
+    def search_kb_articles(self, query: np.ndarray, k: int = 5) -> List[Dict]:
+        """Top-k KB article ids by cosine similarity to a unit query vector"""
+        with self._lock:
+            return self.kb_articles.search(query, k)
+
+    def similar_incidents(self, incident: Dict, k: int = 5) -> List[Dict]:
+        """Top-k most similar resolved incidents, with similarity scores"""
+        if not data_ingest_manager.is_available():
+            return []
+        query = self.embedder.embed([incident_text(incident)])[0]
+        # One extra hit in case the incident itself is indexed
+        hits = self.search_incidents(query, k + 1)
+        if not hits:
+            return []
+
+        try:
+            docs = {str(doc.pop("_id")): doc for doc in data_ingest_manager.incidents_collection.find(
+                {"_id": {"$in": _document_ids([hit["id"] for hit in hits])}})}
+        except Exception as e:
+            logger.error(f"Failed to load similar incidents: {str(e)}")
+            return []
+        similar = [{**docs[hit["id"]], "similarity": hit["score"]} for hit in hits
+                   if hit["id"] in docs and docs[hit["id"]].get("incident_id") != incident.get("incident_id")]
+        return similar[:k]
+
+    def related_kb_articles(self, incident: Dict, k: int = 5, min_similarity: float = 0.05) -> List[Dict]:
+        """Top-k KB articles most similar to an incident"""
+        if not data_ingest_manager.is_available():
+            return []
+        query = self.embedder.embed([incident_text(incident)])[0]
+        hits = [hit for hit in self.search_kb_articles(query, k) if hit["score"] >= min_similarity]
+        if not hits:
+            return []
+
+        try:
+            docs = {doc["article_id"]: doc for doc in data_ingest_manager.kb_articles_collection.find(
+                {"article_id": {"$in": [hit["id"] for hit in hits]}}, {"_id": 0})}
+        except Exception as e:
+            logger.error(f"Failed to load related KB articles: {str(e)}")
+            return []
+        return [{**docs[hit["id"]], "similarity": hit["score"]} for hit in hits if hit["id"] in docs]
+
+
+def _run_refresh(context: JobContext):
+    """Job handler: bring the similarity indexes up to date"""
+    counts = similarity_index.refresh()
+    context.update(inc={"processed": 1, "succeeded": 1}, set_fields=counts)
+
+
+# Global instance
+similarity_index = SimilarityIndex()
+
+background_job_manager.register(SIMILARITY_REFRESH_JOB, _run_refresh)
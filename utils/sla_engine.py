@@ -0,0 +1,165 @@
+"""
+SLA tracking for open incidents
+Migrates incident timestamps to BSON dates, counts breached / due-soon / at-risk incidents
+in one aggregation and finds the next breaches by walking the (status, sla_due) index, so
+the next one is found in O(log n) without any state to rebuild after writes
+"""
+import logging
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+
+import pandas as pd
+from pymongo import UpdateOne
+
+from utils.data_ingest import data_ingest_manager, SLA_DATE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ['Open', 'In Progress', 'Assigned']
+DUE_SOON_HOURS = 24
+# Share of the SLA window used up at which an incident counts as at risk
+AT_RISK_FRACTION = 0.75
+MIGRATION_STATE_ID = "sla_dates_migration"
+
+STRING_DATES_FILTER = {"$or": [{field: {"$type": "string"}} for field in SLA_DATE_FIELDS]}
+OPEN_WITH_SLA_FILTER = {"status": {"$in": OPEN_STATUSES}, "sla_due": {"$type": "date"}}
+
+
+def to_bson_dates(values: pd.Series) -> List[Optional[datetime]]:
+    """Parse a column of timestamp strings in one pass into naive UTC datetimes (None when unparseable)"""
+    parsed = pd.to_datetime(values.replace('', None), errors='coerce', utc=True, format='mixed').dt.tz_localize(None)
+    return [None if pd.isna(value) else value.to_pydatetime() for value in parsed]
+
+
+def format_countdown(seconds: float) -> str:
+    """Time to (or since) an SLA deadline, e.g. '3h 20m' or 'Breached 1d 2h ago'"""
+    if pd.isna(seconds):
+        return ""
+    remaining = abs(int(seconds)) // 60
+    days, hours, minutes = remaining // 1440, remaining % 1440 // 60, remaining % 60
+    text = f"{days}d {hours}h" if days else f"{hours}h {minutes}m" if hours else f"{minutes}m"
+    return text if seconds > 0 else f"Breached {text} ago"
+
+
+def countdowns(sla_due: pd.Series, now: Optional[datetime] = None) -> pd.Series:
+    """Seconds until each SLA deadline (negative once breached), computed for the whole column at once"""
+    due = pd.to_datetime(sla_due.replace('', None), errors='coerce', utc=True, format='mixed').dt.tz_localize(None)
+    return (due - pd.Timestamp(now or datetime.utcnow())).dt.total_seconds()
+
+
+class SLAEngine:
+    """SLA counts and upcoming breaches, answered by MongoDB"""
+
+    def __init__(self):
+        """Ensure the index that serves the SLA queries"""
+        if data_ingest_manager.is_available():
+            try:
+                data_ingest_manager.incidents_collection.create_index([("status", 1), ("sla_due", 1)])
+            except Exception as e:
+                logger.warning(f"Could not create SLA index: {str(e)}")
+
+    def migrate_dates(self, batch_size: int = 5000) -> Dict:
+        """Convert string created_on / sla_due / resolved_on values to BSON dates (empty strings become null)"""
+        if not data_ingest_manager.is_available():
+            return {"success": False, "error": "MongoDB not available"}
+
+        try:
+            collection = data_ingest_manager.incidents_collection
+            migrated = 0
+            last_id = None
+            while True:
+                # Page forward by _id so each batch resumes where the last one stopped instead of rescanning
+                query = {**STRING_DATES_FILTER, "_id": {"$gt": last_id}} if last_id is not None else STRING_DATES_FILTER
+                batch = list(collection.find(query, {field: 1 for field in SLA_DATE_FIELDS})
+                             .sort("_id", 1).limit(batch_size))
+                if not batch:
+                    break
+                last_id = batch[-1]["_id"]
+                frame = pd.DataFrame(batch).reindex(columns=['_id'] + SLA_DATE_FIELDS)
+                updates = {}
+                for field in SLA_DATE_FIELDS:
+                    is_string = frame[field].map(lambda value: isinstance(value, str))
+                    if is_string.any():
+                        for row, value in zip(frame.index[is_string], to_bson_dates(frame.loc[is_string, field])):
+                            updates.setdefault(row, {})[field] = value
+                if not updates:
+                    continue
+                now = datetime.utcnow()
+                collection.bulk_write([UpdateOne({"_id": frame.at[row, '_id']}, {"$set": {**fields, "_updated_at": now}})
+                                       for row, fields in updates.items()], ordered=False)
+                migrated += len(updates)
+
+            collection.create_index([("status", 1), ("sla_due", 1)])
+            if migrated:
+                data_ingest_manager.bump_collection_version('incidents')
+            data_ingest_manager.metadata_collection.update_one(
+                {"_id": MIGRATION_STATE_ID},
+                {"$set": {"version": data_ingest_manager.get_collection_version('incidents'),
+                          "migrated_at": datetime.utcnow()}, "$inc": {"migrated": migrated}},
+                upsert=True
+            )
+            logger.info(f"Migrated SLA timestamps of {migrated} incidents to BSON dates")
+            return {"success": True, "migrated": migrated}
+
+        except Exception as e:
+            logger.error(f"Failed to migrate SLA timestamps: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def count_string_dates(self) -> int:
+        """Count incidents whose SLA timestamps are still stored as strings"""
+        if not data_ingest_manager.is_available():
+            return 0
+        try:
+            return data_ingest_manager.incidents_collection.count_documents(STRING_DATES_FILTER)
+        except Exception as e:
+            logger.error(f"Failed to count incidents with string timestamps: {str(e)}")
+            return 0
+
+    def get_sla_counts(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Breached, due-soon and at-risk open incidents in one aggregation"""
+        empty = {"open_with_sla": 0, "breached": 0, "due_soon": 0, "at_risk": 0}
+        if not data_ingest_manager.is_available():
+            return empty
+
+        now = now or datetime.utcnow()
+        not_breached = {"$gt": ["$sla_due", now]}
+        # created_on + AT_RISK_FRACTION of the SLA window has passed (date arithmetic is in milliseconds)
+        risk_point = {"$add": ["$created_on", {"$multiply": [{"$subtract": ["$sla_due", "$created_on"]}, AT_RISK_FRACTION]}]}
+        try:
+            result = next(data_ingest_manager.incidents_collection.aggregate([
+                {"$match": OPEN_WITH_SLA_FILTER},
+                {"$group": {
+                    "_id": None,
+                    "open_with_sla": {"$sum": 1},
+                    "breached": {"$sum": {"$cond": [not_breached, 0, 1]}},
+                    "due_soon": {"$sum": {"$cond": [
+                        {"$and": [not_breached, {"$lte": ["$sla_due", now + timedelta(hours=DUE_SOON_HOURS)]}]}, 1, 0]}},
+                    "at_risk": {"$sum": {"$cond": [
+                        {"$and": [not_breached, {"$eq": [{"$type": "$created_on"}, "date"]}, {"$gte": [now, risk_point]}]}, 1, 0]}}
+                }}
+            ]), None)
+            return {key: (result or {}).get(key, 0) for key in empty}
+        except Exception as e:
+            logger.error(f"Failed to count SLA states: {str(e)}")
+            return empty
+
+    def next_breaches(self, k: int = 5, now: Optional[datetime] = None) -> List[Dict]:
+        """The k open incidents whose SLA breaches next, with seconds remaining"""
+        if not data_ingest_manager.is_available():
+            return []
+        now = now or datetime.utcnow()
+        try:
+            # Served by the (status, sla_due) index: one short range scan per open status, merged in order
+            upcoming = data_ingest_manager.incidents_collection.find(
+                {"status": {"$in": OPEN_STATUSES}, "sla_due": {"$gt": now}},
+                {"_id": 0, "incident_id": 1, "sla_due": 1}
+            ).sort("sla_due", 1).limit(k)
+            return [{"incident_id": str(doc["incident_id"]), "sla_due": doc["sla_due"],
+                     "seconds_remaining": (doc["sla_due"] - now).total_seconds()} for doc in upcoming]
+        except Exception as e:
+            logger.error(f"Failed to load upcoming SLA breaches: {str(e)}")
+            return []
+
+
+# Global instance
+sla_engine = SLAEngine()
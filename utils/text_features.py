@@ -0,0 +1,30 @@
+"""
+Text feature helpers shared by the local ML components
+Turns incident documents into text and hashed feature vectors without any fitted vocabulary
+"""
+from typing import Dict
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# Fields that describe what went wrong
+INCIDENT_TEXT_FIELDS = ['title', 'description', 'category']
+
+
+def incident_text(incident: Dict) -> str:
+    """Build a single text string from an incident's descriptive fields"""
+    parts = []
+    for field in INCIDENT_TEXT_FIELDS:
+        value = incident.get(field)
+        if value is not None and str(value).strip() and str(value) != 'nan':
+            parts.append(str(value))
+    return ' '.join(parts)
+
+
+def build_hashing_vectorizer(n_features: int = 2 ** 18) -> HashingVectorizer:
+    """Stateless word unigram/bigram vectorizer - safe to use across processes and batches"""
+    return HashingVectorizer(
+        n_features=n_features,
+        ngram_range=(1, 2),
+        stop_words='english',
+        alternate_sign=False,
+        norm='l2'
+    )
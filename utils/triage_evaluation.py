@@ -0,0 +1,227 @@
+"""
+UC-02 triage evaluation harness
+Runs triage over a stratified sample of resolved incidents in parallel, scores it
+against the known priority and stores each run so models and prompts can be compared
+"""
+import time
+import uuid
+import logging
+from typing import Callable, Dict, List, Optional
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from sklearn.metrics import confusion_matrix, precision_recall_fscore_support
+
+from utils.data_ingest import data_ingest_manager, PRIORITY_LABEL_FIELD
+from utils.bedrock_client import VALID_PRIORITIES, triage_prompt_fingerprint
+from utils.triage_model import RESOLVED_LABELLED_FILTER, incident_label
+
+logger = logging.getLogger(__name__)
+
+EVALUATION_PROJECTION = {"_id": 0, "incident_id": 1, "title": 1, "description": 1, PRIORITY_LABEL_FIELD: 1}
+
+
+def _label_filter(priority: str) -> Dict:
+    """Resolved incidents whose ground truth label is the given priority"""
+    return {"$and": [RESOLVED_LABELLED_FILTER, {PRIORITY_LABEL_FIELD: priority}]}
+
+
+class TriageEvaluator:
+    """Scores triage runs against ground truth and keeps their results"""
+
+    def __init__(self):
+        """Initialize the evaluator"""
+        if data_ingest_manager.is_available():
+            self.collection = data_ingest_manager.db.triage_evaluations
+            try:
+                self.collection.create_index([("created_at", -1)])
+            except Exception as e:
+                logger.warning(f"Could not create triage evaluation index: {str(e)}")
+        else:
+            self.collection = None
+
+    def is_available(self) -> bool:
+        """Check if evaluation runs can be stored"""
+        return self.collection is not None
+
+    def sample_resolved_incidents(self, sample_size: int, min_per_class: int = 5) -> List[Dict]:
+        """
+        Draw a stratified random sample of resolved, labelled incidents
+
+        Each priority gets a share proportional to its frequency, but never fewer than
+        min_per_class (when available) so rare classes like P1 still get a recall figure.
+        """
+        if not data_ingest_manager.is_available() or sample_size <= 0:
+            return []
+
+        collection = data_ingest_manager.incidents_collection
+        class_counts = {priority: collection.count_documents(_label_filter(priority)) for priority in VALID_PRIORITIES}
+        total = sum(class_counts.values())
+        if total == 0:
+            return []
+
+        allocation = {
+            priority: min(count, max(min_per_class, round(sample_size * count / total)))
+            for priority, count in class_counts.items()
+        }
+        # Trim the largest classes back down if the floors pushed us over the requested size
+        while sum(allocation.values()) > min(sample_size, total):
+            largest = max(allocation, key=allocation.get)
+            allocation[largest] -= 1
+
+        sample = []
+        for priority, size in allocation.items():
+            if size > 0:
+                sample.extend(collection.aggregate([
+                    {"$match": _label_filter(priority)},
+                    {"$sample": {"size": size}},
+                    {"$project": EVALUATION_PROJECTION}
+                ]))
+        return sample
+
+    def run(self, sample_size: int, model_id: str, system_prompt: Optional[str] = None,
+            temperature: float = 0.3, chunk_size: int = 10, concurrency: int = 4,
+            label: str = "", progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict:
+        """
+        Classify a stratified sample in parallel and score it against ground truth
+
+        Args:
+            sample_size: Number of resolved incidents to evaluate
+            model_id: Bedrock model to evaluate
+            system_prompt: Triage system prompt to evaluate
+            temperature: Sampling temperature
+            chunk_size: Incidents per Bedrock request (1 = one request per incident)
+            concurrency: Parallel requests
+            label: Optional name for the run
+            progress_callback: Called with (incidents done, total) as chunks complete
+
+        Returns:
+            The stored run document (or {"success": False, "error": ...})
+        """
+        from utils.bedrock_client import bedrock_client
+
+        incidents = self.sample_resolved_incidents(sample_size)
+        if not incidents:
+            return {"success": False, "error": "No resolved incidents with a priority label"}
+
+        chunks = [incidents[i:i + chunk_size] for i in range(0, len(incidents), chunk_size)]
+
+        def classify_chunk(chunk: List[Dict]):
+            started = time.perf_counter()
+            results, usage = bedrock_client.classify_incidents_batch_with_usage(
+                chunk, model_id=model_id, system_prompt=system_prompt, temperature=temperature
+            )
+            return chunk, results, usage, (time.perf_counter() - started) * 1000
+
+        predictions = {}
+        latencies_ms = []
+        totals = {"requests": 0, "input_tokens": 0, "output_tokens": 0}
+        done = 0
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(classify_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                chunk, results, usage, elapsed_ms = future.result()
+                predictions.update(results)
+                # Every incident in a request waits for the whole request
+                latencies_ms.extend([elapsed_ms] * len(chunk))
+                for key in totals:
+                    totals[key] += usage.get(key, 0)
+                done += len(chunk)
+                if progress_callback:
+                    progress_callback(done, len(incidents))
+        wall_seconds = time.perf_counter() - started
+
+        run = {
+            "_id": f"eval_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}",
+            "label": label,
+            "created_at": datetime.utcnow(),
+            "model_id": model_id,
+            "system_prompt": system_prompt,
+            "prompt_hash": triage_prompt_fingerprint(system_prompt),
+            "temperature": temperature,
+            "chunk_size": chunk_size,
+            "concurrency": concurrency,
+            **self.score(incidents, predictions),
+            "latency_ms": {
+                "p50": float(np.percentile(latencies_ms, 50)),
+                "p95": float(np.percentile(latencies_ms, 95))
+            },
+            "usage": totals,
+            "tokens_per_incident": (totals["input_tokens"] + totals["output_tokens"]) / len(incidents),
+            "incidents_per_minute": len(incidents) / wall_seconds * 60 if wall_seconds else 0.0,
+            "wall_seconds": round(wall_seconds, 2)
+        }
+
+        if self.is_available():
+            try:
+                self.collection.insert_one(run)
+            except Exception as e:
+                logger.error(f"Failed to store triage evaluation run: {str(e)}")
+
+        logger.info(f"Triage evaluation {run['_id']}: accuracy {run['accuracy']:.1%} on {run['sample_size']} incidents")
+        return {"success": True, **run}
+
+    def score(self, incidents: List[Dict], predictions: Dict[str, Dict]) -> Dict:
+        """Confusion matrix and per-class precision/recall of predictions against ground truth"""
+        y_true = []
+        y_pred = []
+        failed = 0
+        for incident in incidents:
+            prediction = predictions.get(str(incident["incident_id"]))
+            if not prediction or prediction.get("failed"):
+                failed += 1
+                continue
+            y_true.append(incident_label(incident))
+            y_pred.append(prediction["priority"])
+
+        matrix = confusion_matrix(y_true, y_pred, labels=VALID_PRIORITIES) if y_true else \
+            np.zeros((len(VALID_PRIORITIES), len(VALID_PRIORITIES)), dtype=int)
+        precision, recall, f1, support = precision_recall_fscore_support(
+            y_true, y_pred, labels=VALID_PRIORITIES, zero_division=0
+        ) if y_true else [np.zeros(len(VALID_PRIORITIES))] * 4
+
+        return {
+            "sample_size": len(incidents),
+            "scored": len(y_true),
+            "failed": failed,
+            "labels": VALID_PRIORITIES,
+            "confusion_matrix": matrix.tolist(),
+            "accuracy": float(np.trace(matrix) / len(y_true)) if y_true else 0.0,
+            "macro_recall": float(np.mean(recall)),
+            "per_class": {
+                priority: {
+                    "precision": float(precision[i]),
+                    "recall": float(recall[i]),
+                    "f1": float(f1[i]),
+                    "support": int(support[i])
+                }
+                for i, priority in enumerate(VALID_PRIORITIES)
+            }
+        }
+
+    def get_runs(self, limit: int = 20) -> List[Dict]:
+        """Get the most recent evaluation runs"""
+        if not self.is_available():
+            return []
+        try:
+            return list(self.collection.find().sort("created_at", -1).limit(limit))
+        except Exception as e:
+            logger.error(f"Failed to load triage evaluation runs: {str(e)}")
+            return []
+
+    def delete_run(self, run_id: str) -> bool:
+        """Delete a stored evaluation run"""
+        if not self.is_available():
+            return False
+        try:
+            return self.collection.delete_one({"_id": run_id}).deleted_count > 0
+        except Exception as e:
+            logger.error(f"Failed to delete triage evaluation run {run_id}: {str(e)}")
+            return False
+
+
+# Global instance
+triage_evaluator = TriageEvaluator()
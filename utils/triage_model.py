@@ -0,0 +1,296 @@
+"""
+Local ML triage model for UC-02 with an LLM fallback cascade
+Trains a hashed-feature linear classifier on resolved incidents and only escalates
+low-confidence predictions to AWS Bedrock
+"""
+import os
+import time
+import hashlib
+import logging
+from typing import Dict, List, Optional
+from datetime import datetime
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from sklearn.linear_model import SGDClassifier
+
+from utils.data_ingest import data_ingest_manager, PRIORITY_LABEL_FIELD
+from utils.bedrock_client import VALID_PRIORITIES
+from utils.text_features import incident_text, build_hashing_vectorizer, INCIDENT_TEXT_FIELDS
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+DEFAULT_MODEL_PATH = os.path.join(MODELS_DIR, "triage_model.joblib")
+# One in HOLDOUT_BUCKETS incidents is held out, so accuracy measured on them is never training accuracy
+HOLDOUT_BUCKETS = 10
+
+# Resolved incidents carrying a ground-truth priority label (never the priority triage wrote)
+RESOLVED_LABELLED_FILTER = {
+    "$and": [
+        {"$or": [
+            {"status": {"$in": ["Resolved", "Closed"]}},
+            {"resolved_on": {"$nin": ["", None]}}
+        ]},
+        {PRIORITY_LABEL_FIELD: {"$in": VALID_PRIORITIES}}
+    ]
+}
+
+
+def in_holdout(incident: Dict) -> bool:
+    """Whether an incident is in the fixed 10% the local model never trains on (by a stable hash of its id)"""
+    incident_id = incident.get('incident_id')
+    if incident_id is None:
+        return False
+    return int(hashlib.md5(str(incident_id).encode()).hexdigest(), 16) % HOLDOUT_BUCKETS == 0
+
+
+def incident_label(incident: Dict) -> Optional[str]:
+    """Get the ground truth priority of an incident"""
+    value = incident.get(PRIORITY_LABEL_FIELD)
+    return value if value in VALID_PRIORITIES else None
+
+
+class LocalTriageModel:
+    """Priority classifier trained on resolved incidents and persisted to disk"""
+
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH):
+        """Initialize the model, loading a previously trained one if present"""
+        self.model_path = model_path
+        self.vectorizer = build_hashing_vectorizer()
+        self.classifier = None
+        self.metadata = {}
+        self.load()
+
+    def is_trained(self) -> bool:
+        """Check if a trained classifier is available"""
+        return self.classifier is not None
+
+    def load(self) -> bool:
+        """Load the persisted classifier from disk"""
+        if not os.path.exists(self.model_path):
+            return False
+
+        try:
+            payload = joblib.load(self.model_path)
+            self.classifier = payload["classifier"]
+            self.metadata = payload.get("metadata", {})
+            logger.info(f"Loaded local triage model trained on {self.metadata.get('training_samples', 0)} incidents")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load local triage model: {str(e)}")
+            return False
+
+    def save(self) -> bool:
+        """Persist the classifier to disk (atomically replaces the previous model)"""
+        try:
+            os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
+            tmp_path = f"{self.model_path}.tmp"
+            joblib.dump({"classifier": self.classifier, "metadata": self.metadata}, tmp_path)
+            os.replace(tmp_path, self.model_path)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save local triage model: {str(e)}")
+            return False
+
+    def train_from_mongodb(self, limit: Optional[int] = None, batch_size: int = 20000) -> Dict:
+        """Retrain on resolved, labelled incidents streamed from MongoDB"""
+        if not data_ingest_manager.is_available():
+            return {"success": False, "error": "MongoDB not available"}
+
+        try:
+            projection = {"_id": 0, "incident_id": 1, PRIORITY_LABEL_FIELD: 1}
+            for field in INCIDENT_TEXT_FIELDS:
+                projection[field] = 1
+
+            cursor = data_ingest_manager.incidents_collection.find(
+                RESOLVED_LABELLED_FILTER, projection, batch_size=batch_size
+            )
+            if limit:
+                cursor = cursor.limit(limit)
+
+            # Hashing features are stateless, so each batch is vectorised as it streams in
+            matrices = []
+            labels = []
+            holdout = []
+            texts = []
+            for incident in cursor:
+                texts.append(incident_text(incident))
+                labels.append(incident_label(incident))
+                holdout.append(in_holdout(incident))
+                if len(texts) >= batch_size:
+                    matrices.append(self.vectorizer.transform(texts))
+                    texts = []
+            if texts:
+                matrices.append(self.vectorizer.transform(texts))
+
+            if not matrices:
+                return {"success": False, "error": "No resolved incidents with a priority label"}
+
+            return self.train(sp.vstack(matrices).tocsr(), np.array(labels), np.array(holdout))
+
+        except Exception as e:
+            logger.error(f"Failed to train local triage model: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def train(self, features, labels: np.ndarray, holdout: np.ndarray) -> Dict:
+        """Fit the classifier on a hashed feature matrix, evaluating on the held-out rows (see in_holdout)"""
+        classes, counts = np.unique(labels, return_counts=True)
+        if len(np.unique(labels[~holdout])) < 2:
+            return {"success": False, "error": "Need at least two priority classes outside the holdout to train"}
+
+        started = time.perf_counter()
+        X_train, y_train = features[~holdout], labels[~holdout]
+        if holdout.any():
+            X_test, y_test = features[holdout], labels[holdout]
+        else:
+            # Too few incidents to hold any out; the reported accuracy is training accuracy
+            X_test, y_test = X_train, y_train
+
+        classifier = SGDClassifier(loss='log_loss', alpha=1e-5, max_iter=20, tol=1e-4,
+                                   class_weight='balanced', random_state=42)
+        classifier.fit(X_train, y_train)
+        holdout_accuracy = float((classifier.predict(X_test) == y_test).mean())
+
+        self.classifier = classifier
+        self.metadata = {
+            "trained_at": datetime.utcnow().isoformat(),
+            "training_samples": int(len(y_train)),
+            "holdout_samples": int(len(y_test)),
+            "holdout_accuracy": holdout_accuracy,
+            "class_counts": {str(c): int(n) for c, n in zip(classes, counts)},
+            "training_seconds": round(time.perf_counter() - started, 2)
+        }
+        self.save()
+
+        logger.info(f"Trained local triage model on {len(y_train)} incidents "
+                    f"(holdout accuracy {holdout_accuracy:.1%})")
+        return {"success": True, **self.metadata}
+
+    def predict(self, incidents: List[Dict]) -> List[Dict]:
+        """Predict priority and confidence (top class probability) for each incident"""
+        if not self.is_trained() or not incidents:
+            return []
+
+        features = self.vectorizer.transform([incident_text(incident) for incident in incidents])
+        probabilities = self.classifier.predict_proba(features)
+        best = probabilities.argmax(axis=1)
+
+        return [
+            {"priority": str(self.classifier.classes_[idx]), "confidence": float(probabilities[row, idx])}
+            for row, idx in enumerate(best)
+        ]
+
+
+class TriageCascade:
+    """Classify locally first and escalate only low-confidence incidents to Bedrock"""
+
+    STATS_ID = "triage_cascade_stats"
+
+    def __init__(self, local_model: LocalTriageModel, confidence_threshold: float = 0.7):
+        """Initialize the cascade"""
+        self.local_model = local_model
+        self.confidence_threshold = confidence_threshold
+
+    def classify(self, incidents: List[Dict], model_id: Optional[str] = None,
+                 system_prompt: Optional[str] = None, temperature: float = 0.3,
+                 confidence_threshold: Optional[float] = None) -> Dict[str, Dict]:
+        """
+        Classify incidents, returning results keyed by incident_id with priority,
+        reasoning, confidence and source ("local" or "llm")
+        """
+        threshold = self.confidence_threshold if confidence_threshold is None else confidence_threshold
+        incidents = [incident for incident in incidents if incident.get('incident_id') not in (None, '')]
+
+        results = {}
+        escalate = []
+        predictions = self.local_model.predict(incidents)
+
+        if predictions:
+            for incident, prediction in zip(incidents, predictions):
+                if prediction["confidence"] >= threshold:
+                    results[str(incident['incident_id'])] = {
+                        "priority": prediction["priority"],
+                        "reasoning": f"Local model prediction ({prediction['confidence']:.0%} confidence)",
+                        "confidence": prediction["confidence"],
+                        "source": "local"
+                    }
+                else:
+                    escalate.append(incident)
+        else:
+            escalate = incidents
+
+        if escalate:
+            from utils.bedrock_client import bedrock_client
+            llm_results = bedrock_client.classify_incidents_batch(
+                escalate, model_id=model_id, system_prompt=system_prompt, temperature=temperature
+            )
+            for incident_id, result in llm_results.items():
+                results[incident_id] = {**result, "source": "llm"}
+
+        self._record_stats(incidents, results)
+        return results
+
+    def _record_stats(self, incidents: List[Dict], results: Dict[str, Dict]):
+        """Accumulate per-path volume and accuracy (on held-out incidents with known ground truth) in MongoDB"""
+        if not data_ingest_manager.is_available() or not results:
+            return
+
+        increments = {}
+        for incident in incidents:
+            result = results.get(str(incident['incident_id']))
+            if not result:
+                continue
+            source = result["source"]
+            increments[f"{source}.count"] = increments.get(f"{source}.count", 0) + 1
+
+            label = incident_label(incident) if in_holdout(incident) else None
+            if label:
+                increments[f"{source}.labelled"] = increments.get(f"{source}.labelled", 0) + 1
+                if result["priority"] == label:
+                    increments[f"{source}.correct"] = increments.get(f"{source}.correct", 0) + 1
+
+        try:
+            data_ingest_manager.metadata_collection.update_one(
+                {"_id": self.STATS_ID},
+                {"$inc": increments, "$set": {"last_updated": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to record triage cascade stats: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Get cumulative share and accuracy for the local and LLM paths"""
+        stats = {}
+        try:
+            doc = data_ingest_manager.metadata_collection.find_one({"_id": self.STATS_ID}) or {}
+        except Exception as e:
+            logger.error(f"Failed to load triage cascade stats: {str(e)}")
+            doc = {}
+
+        total = sum(doc.get(source, {}).get("count", 0) for source in ("local", "llm"))
+        for source in ("local", "llm"):
+            path = doc.get(source, {})
+            labelled = path.get("labelled", 0)
+            stats[source] = {
+                "count": path.get("count", 0),
+                "share": path.get("count", 0) / total if total else 0.0,
+                "labelled": labelled,
+                "accuracy": path.get("correct", 0) / labelled if labelled else None
+            }
+        return stats
+
+    def reset_stats(self) -> bool:
+        """Clear the cumulative cascade statistics"""
+        try:
+            data_ingest_manager.metadata_collection.delete_one({"_id": self.STATS_ID})
+            return True
+        except Exception as e:
+            logger.error(f"Failed to reset triage cascade stats: {str(e)}")
+            return False
+
+
+# Global instances
+local_triage_model = LocalTriageModel()
+triage_cascade = TriageCascade(local_triage_model)